@@ -1,7 +1,71 @@
-from astrometry_net_client.client import Client
-from astrometry_net_client.session import Session
-from astrometry_net_client.settings import Settings
-from astrometry_net_client.statusables import Job, Submission
-from astrometry_net_client.uploads import FileUpload
+import importlib
+from typing import TYPE_CHECKING
 
-__all__ = ["Settings", "Session", "Job", "Submission", "Client", "FileUpload"]
+if TYPE_CHECKING:
+    # The same names for type checkers, which do not see __getattr__
+    from astrometry_net_client.aio import (
+        AsyncClient,
+        AsyncJob,
+        AsyncSession,
+        AsyncSubmission,
+    )
+    from astrometry_net_client.client import Client
+    from astrometry_net_client.session import Session, SessionPool
+    from astrometry_net_client.settings import Settings
+    from astrometry_net_client.statusables import Job, Submission
+    from astrometry_net_client.uploads import (
+        ArrayUpload,
+        BytesUpload,
+        FileUpload,
+        HDUListUpload,
+    )
+
+# The public classes, imported from their module on first access, so importing
+# the package (e.g. to only poll jobs) does not import astropy and numpy
+_lazy = {
+    "Settings": "astrometry_net_client.settings",
+    "Session": "astrometry_net_client.session",
+    "SessionPool": "astrometry_net_client.session",
+    "Job": "astrometry_net_client.statusables",
+    "Submission": "astrometry_net_client.statusables",
+    "Client": "astrometry_net_client.client",
+    "FileUpload": "astrometry_net_client.uploads",
+    "ArrayUpload": "astrometry_net_client.uploads",
+    "HDUListUpload": "astrometry_net_client.uploads",
+    "BytesUpload": "astrometry_net_client.uploads",
+    "AsyncSession": "astrometry_net_client.aio",
+    "AsyncJob": "astrometry_net_client.aio",
+    "AsyncSubmission": "astrometry_net_client.aio",
+    "AsyncClient": "astrometry_net_client.aio",
+}
+
+__all__ = [
+    "Settings",
+    "Session",
+    "SessionPool",
+    "Job",
+    "Submission",
+    "Client",
+    "FileUpload",
+    "ArrayUpload",
+    "HDUListUpload",
+    "BytesUpload",
+    "AsyncSession",
+    "AsyncJob",
+    "AsyncSubmission",
+    "AsyncClient",
+]
+
+
+def __getattr__(name):
+    if name not in _lazy:
+        msg = "module {!r} has no attribute {!r}".format(__name__, name)
+        raise AttributeError(msg)
+    value = getattr(importlib.import_module(_lazy[name]), name)
+    # Cache it, so __getattr__ is only used on the first access
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
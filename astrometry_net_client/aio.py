@@ -0,0 +1,536 @@
+import asyncio
+import functools
+import itertools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Union
+
+from astrometry_net_client.cache import SessionCache
+from astrometry_net_client.client import MAX_WORKERS
+from astrometry_net_client.config import Endpoint
+from astrometry_net_client.session import Session
+from astrometry_net_client.settings import Settings
+from astrometry_net_client.statusables import Job, JobRegistry, Submission
+from astrometry_net_client.transport import POOL_SIZE, DirectTransport, Transport
+from astrometry_net_client.uploads import FileUpload
+
+log = logging.getLogger(__name__)
+
+
+class AsyncTransport(object):
+    """
+    Asynchronous wrapper around a (blocking) transport.
+
+    The blocking calls are run on a small, bounded thread pool, so the event
+    loop is never blocked. A thread is only occupied while a request is
+    actually in progress; waiting in between status queries is done on the
+    event loop itself. Therefore a single event loop can keep many uploads in
+    flight, with at most ``max_workers`` threads.
+
+    Note that the requests themselves are still blocking (``requests``) calls,
+    run with ``run_in_executor``: at most ``max_workers`` requests are in
+    progress at the same time, so the throughput is bounded by the number of
+    threads, not by the event loop.
+
+    Parameters
+    ----------
+    transport: :py:class:`astrometry_net_client.transport.DirectTransport`
+        The transport which sends the requests. If not specified, a pooled
+        :py:class:`astrometry_net_client.transport.Transport` is created with
+        a pool size equal to ``max_workers``.
+    max_workers: int
+        Maximum number of simultaneous requests.
+    """
+
+    def __init__(
+        self,
+        transport: Optional[DirectTransport] = None,
+        max_workers: int = POOL_SIZE,
+    ):
+        if transport is None:
+            transport = Transport(pool_maxsize=max_workers)
+        self.transport = transport
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="anc-async"
+        )
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run the blocking function ``func`` with the given arguments on the
+        thread pool, and wait for the result.
+        """
+        loop = asyncio.get_running_loop()
+        call = functools.partial(func, *args, **kwargs)
+        return await loop.run_in_executor(self._executor, call)
+
+    async def make(self, request):
+        """
+        Send a :py:class:`astrometry_net_client.request.Request` and wait
+        for the response. Same as ``request.make()``.
+        """
+        return await self.run(request.make)
+
+    def close(self) -> None:
+        """
+        Shutdown the thread pool and close the connections of the transport.
+        """
+        self._executor.shutdown(wait=True)
+        self.transport.close()
+
+    def __repr__(self):
+        msg = "AsyncTransport({}, max_workers={})"
+        return msg.format(self.transport, self.max_workers)
+
+
+# Shared by the jobs and submissions which are created without a transport,
+# created on first use (see _default_async_transport)
+_default_transport: Optional[AsyncTransport] = None
+_default_lock = threading.Lock()
+
+
+def _default_async_transport() -> AsyncTransport:
+    global _default_transport
+    with _default_lock:
+        if _default_transport is None:
+            _default_transport = AsyncTransport()
+        return _default_transport
+
+
+class AsyncSession(object):
+    """
+    Asynchronous version of :py:class:`astrometry_net_client.session.Session`.
+
+    Wraps a normal session (available in the :py:attr:`session` attribute),
+    so the API key can be given in the same ways. The :py:meth:`login` is a
+    coroutine, and simultaneous logins are combined into a single request.
+
+    Parameters
+    ----------
+    api_key: str
+        See :py:class:`astrometry_net_client.session.Session`
+    key_location: str
+        See :py:class:`astrometry_net_client.session.Session`
+    transport: :py:class:`AsyncTransport`
+        Optional transport used for the login, and the requests made with this
+        session.
+    key_cache: :py:class:`astrometry_net_client.cache.SessionCache`
+        See :py:class:`astrometry_net_client.session.Session`
+    endpoint: :py:class:`astrometry_net_client.config.Endpoint` or str
+        See :py:class:`astrometry_net_client.session.Session`
+
+    Examples
+    --------
+    >>> session = AsyncSession(api_key='XXXXX')
+    >>> await session.login()
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        key_location: Optional[str] = None,
+        transport: Optional[AsyncTransport] = None,
+        key_cache: Optional[SessionCache] = None,
+        endpoint: Optional[Union[str, Endpoint]] = None,
+    ):
+        self.transport = AsyncTransport() if transport is None else transport
+        self.session = Session(
+            api_key=api_key,
+            key_location=key_location,
+            transport=self.transport.transport,
+            key_cache=key_cache,
+            endpoint=endpoint,
+        )
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def logged_in(self) -> bool:
+        return self.session.logged_in
+
+    @property
+    def key(self) -> str:
+        return self.session.key
+
+    async def login(self, force: bool = False) -> None:
+        """
+        Log-in with the Astrometry.net API. See
+        :py:meth:`astrometry_net_client.session.Session.login`.
+
+        Parameters
+        ----------
+        force: bool
+            Forces the login by ignoring the ``logged_in`` boolean.
+
+        Raises
+        ------
+        LoginFailedException
+            If the login response does not have the status 'success'.
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        # Other tasks wait here until the running login is done
+        async with self._lock:
+            if not force and self.logged_in:
+                return
+            await self.transport.run(self.session.login, force=force)
+
+
+class AsyncStatusable(object):
+    """
+    Asynchronous wrapper around a
+    :py:class:`astrometry_net_client.statusables.Statusable`, which is
+    available in the :py:attr:`statusable` attribute.
+
+    The :py:meth:`status` and :py:meth:`until_done` methods are coroutines.
+    Other attributes (e.g. ``id``, ``done()`` or ``success()``) are taken from
+    the wrapped statusable.
+    """
+
+    def __init__(self, statusable, transport: AsyncTransport):
+        self.statusable = statusable
+        self.transport = transport
+
+    def __getattr__(self, name):
+        # Only called when the attribute is not found on this object
+        if name == "statusable":
+            raise AttributeError(name)
+        return getattr(self.statusable, name)
+
+    async def status(self, force=False):
+        """
+        Coroutine which queries the status if it is needed. See
+        :py:meth:`astrometry_net_client.statusables.Statusable.status`.
+        """
+        if force or not self.done():
+            return await self.transport.run(self.statusable.status, force=force)
+        return self.statusable.stat_response
+
+    async def until_done(self, start=4, end=300, timeout=None):
+        """
+        Coroutine which waits for the statusable to be finished, with the same
+        sleeping behaviour as
+        :py:meth:`astrometry_net_client.statusables.Statusable.until_done`.
+        The event loop is free to run other tasks while waiting.
+
+        Raises
+        ------
+        TimeoutError
+            When parameter `timeout` is set and the waited time exceeds this
+            value.
+        """
+        now = asyncio.get_running_loop().time
+        start_time = now()
+
+        sleep_time = start
+        while timeout is None or now() - start_time < timeout:
+            response = await self.status()
+            log.debug("Current status response: {}".format(response))
+
+            if self.done():
+                break
+
+            log.debug("Not done, sleeping for {}s".format(sleep_time))
+            await asyncio.sleep(sleep_time)
+            sleep_time *= 2
+            sleep_time = end if end and end < sleep_time else sleep_time
+        else:
+            raise TimeoutError()
+
+        return self.statusable.stat_response
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, self.statusable.id)
+
+
+class AsyncJob(AsyncStatusable):
+    """
+    Asynchronous version of :py:class:`astrometry_net_client.statusables.Job`.
+
+    The result methods (e.g. :py:meth:`info` or :py:meth:`wcs_file`) are
+    coroutines, with the same result as the blocking version.
+
+    Parameters
+    ----------
+    job_id: int or :py:class:`astrometry_net_client.statusables.Job`
+        The id of the job, or an existing job to wrap.
+    transport: :py:class:`AsyncTransport`
+        Optional transport used for the requests. Defaults to a transport
+        shared by all jobs and submissions, created on first use.
+
+    Examples
+    --------
+    >>> job = AsyncJob(1234)
+    >>> await job.until_done()
+    >>> if job.success():
+    ...     wcs = await job.wcs_file()
+    """
+
+    def __init__(self, job_id, transport: Optional[AsyncTransport] = None):
+        if transport is None:
+            transport = _default_async_transport()
+        job = job_id
+        if not isinstance(job, Job):
+            job = Job(job_id, transport=transport.transport)
+        super().__init__(job, transport)
+
+    async def _result(self, name, *args, **kwargs):
+        method = getattr(self.statusable, name)
+        return await self.transport.run(method, *args, **kwargs)
+
+    async def info(self, **kwargs):
+        return await self._result("info", **kwargs)
+
+    async def wcs_file(self, **kwargs):
+        return await self._result("wcs_file", **kwargs)
+
+    async def new_fits_file(self, **kwargs):
+        return await self._result("new_fits_file", **kwargs)
+
+    async def new_fits_header(self, **kwargs):
+        return await self._result("new_fits_header", **kwargs)
+
+    async def rdls_file(self, **kwargs):
+        return await self._result("rdls_file", **kwargs)
+
+    async def axy_file(self, **kwargs):
+        return await self._result("axy_file", **kwargs)
+
+    async def corr_file(self, **kwargs):
+        return await self._result("corr_file", **kwargs)
+
+    async def annotated_display(self, **kwargs):
+        return await self._result("annotated_display", **kwargs)
+
+    async def red_green_image_display(self, **kwargs):
+        return await self._result("red_green_image_display", **kwargs)
+
+    async def extraction_image_display(self, **kwargs):
+        return await self._result("extraction_image_display", **kwargs)
+
+    async def download(self, product, path, memmap=False):
+        return await self._result("download", product, path, memmap=memmap)
+
+    async def download_new_fits_file(self, path, memmap=False):
+        return await self.download("new_fits_file", path, memmap=memmap)
+
+
+class AsyncSubmission(AsyncStatusable):
+    """
+    Asynchronous version of
+    :py:class:`astrometry_net_client.statusables.Submission`.
+
+    The :py:attr:`jobs` are available as :py:class:`AsyncJob` objects.
+
+    Parameters
+    ----------
+    submission_id: int or :py:class:`astrometry_net_client.statusables.Submission`
+        The id of the submission, or an existing submission to wrap.
+    transport: :py:class:`AsyncTransport`
+        Optional transport used for the requests. Defaults to a transport
+        shared by all jobs and submissions, created on first use.
+    """
+
+    def __init__(self, submission_id, transport: Optional[AsyncTransport] = None):
+        if transport is None:
+            transport = _default_async_transport()
+        submission = submission_id
+        if not isinstance(submission, Submission):
+            submission = Submission(submission_id, transport=transport.transport)
+        super().__init__(submission, transport)
+
+    @property
+    def jobs(self):
+        return [AsyncJob(job, self.transport) for job in self.statusable.jobs]
+
+
+class AsyncClient(object):
+    """
+    Asynchronous version of :py:class:`astrometry_net_client.client.Client`.
+
+    All requests are made on a single :py:class:`AsyncTransport`, so many
+    uploads can be processed at the same time, without a thread per upload.
+
+    Parameters
+    ----------
+    session: :py:class:`AsyncSession`
+        Optional argument to provide the session for the API. If not provided,
+        it is created from the ``api_key`` or ``key_location`` keyword
+        arguments, or the environment.
+    settings: :py:class:`astrometry_net_client.settings.Settings`, dict
+        An optional settings object, which will be applied to all uploads.
+    transport: :py:class:`AsyncTransport`
+        Optional transport. If not specified, the transport of the session is
+        used.
+    kwargs: arguments
+        Used to create a session or settings object, if either is not
+        specified. See :py:class:`astrometry_net_client.client.Client`.
+
+    Examples
+    --------
+    >>> async def main(files):
+    ...     client = AsyncClient(api_key='XXXXX')
+    ...     await client.login()
+    ...     async for job, filename in client.upload_files(files):
+    ...         if job.success():
+    ...             wcs = await job.wcs_file()
+    >>> asyncio.run(main(files))
+    """
+
+    def __init__(self, session=None, settings=None, transport=None, **kwargs):
+        if session is None:
+            session_args = {"api_key", "key_location", "key_cache", "endpoint"}
+            args = {k: v for k, v in kwargs.items() if k in session_args}
+            session = AsyncSession(transport=transport, **args)
+        self.session = session
+        self.transport = session.transport if transport is None else transport
+        self.registry = JobRegistry(
+            transport=self.transport.transport, endpoint=session.session.endpoint
+        )
+
+        if settings is None:
+            setting_args = {k: v for k, v in kwargs.items() if k in Settings._settings}
+            self.settings = Settings(**setting_args)
+        else:
+            self.settings = Settings(settings)
+
+    async def login(self, force=False):
+        """
+        Log-in with the API, see :py:meth:`AsyncSession.login`.
+        """
+        await self.session.login(force=force)
+
+    async def submit_file(self, filename, settings=None):
+        """
+        Uploads the file, and returns the resulting submission.
+
+        Parameters
+        ----------
+        filename: str
+            Location + name of the file to upload.
+        settings: :py:class:`astrometry_net_client.settings.Settings`
+            Optional settings which only apply to this upload, overriding the
+            settings of the client.
+
+        Returns
+        -------
+        :py:class:`AsyncSubmission`
+        """
+        upl_settings = Settings(self.settings)
+        if settings is not None:
+            upl_settings.update(settings)
+
+        await self.session.login()
+        upl = FileUpload(
+            filename,
+            session=self.session.session,
+            settings=upl_settings,
+            transport=self.transport.transport,
+        )
+        submission = await self.transport.run(upl.submit, registry=self.registry)
+        log.info("File {} submitted".format(filename))
+        return AsyncSubmission(submission, self.transport)
+
+    async def upload_file(self, filename, settings=None, start=4, end=300):
+        """
+        Uploads the file and returns the job when it is finished. See
+        :py:meth:`astrometry_net_client.client.Client.upload_file`.
+
+        The ``start`` and ``end`` arguments determine the time between the
+        status queries, see :py:meth:`AsyncStatusable.until_done`.
+
+        Returns
+        -------
+        :py:class:`AsyncJob`
+            The job of the resulting upload. Note that it is possible that the
+            job did not succeed.
+        """
+        submission = await self.submit_file(filename, settings=settings)
+        await submission.until_done(start=start, end=end)
+
+        # pretty much guarenteed to have exactly one job
+        job = submission.jobs[0]
+        await job.until_done(start=start, end=end)
+        return job
+
+    async def upload_files(
+        self, files_iter, queue_size=MAX_WORKERS, settings=None, start=4, end=300
+    ):
+        """
+        Asynchronous generator which uploads a number of files concurrently,
+        yielding the :py:class:`AsyncJob` & filename when it is finished.
+
+        Parameters
+        ----------
+        files_iter: iterable
+            Some iterable containing paths to the files which will be uploaded.
+        queue_size: int, optional
+            A positive integer, the maximum number of simultaneous
+            submissions. Since waiting does not take up a thread, this can be
+            much larger than :py:const:`MAX_WORKERS`.
+        settings: :py:class:`astrometry_net_client.settings.Settings`
+            Optional settings which apply to these uploads.
+        start: int
+            See :py:meth:`AsyncStatusable.until_done`
+        end: int
+            See :py:meth:`AsyncStatusable.until_done`
+
+        Yields
+        ------
+        (:py:class:`AsyncJob`, ``str``):
+            The finished job and the corresponding filename. Order can be
+            different from the given ``files_iter``.
+
+        Raises
+        ------
+        ValueError
+            When the queue_size is invalid.
+        """
+        if queue_size < 1:
+            raise ValueError(f"queue_size must be greater than 0, was: {queue_size}")
+
+        await self.login()
+
+        async def process(filename):
+            job = await self.upload_file(
+                filename, settings=settings, start=start, end=end
+            )
+            return job, filename
+
+        # Files are taken from the iterable only when there is room, so at
+        # most queue_size tasks exist at any time
+        files = iter(files_iter)
+        pending = set()
+        try:
+            while True:
+                for filename in itertools.islice(files, queue_size - len(pending)):
+                    pending.add(asyncio.ensure_future(process(filename)))
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    job, filename = task.result()
+                    log.info("FINISHED submission {}, yielding...".format(filename))
+                    yield job, filename
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def calibrate_file_wcs(self, filename, settings=None):
+        """
+        Uploads a file, returning the wcs header if it succeeds, None
+        otherwise.
+        """
+        job = await self.upload_file(filename, settings=settings)
+        if job.success():
+            return await job.wcs_file()
+        return None
+
+    def close(self):
+        """
+        Close the transport of the client.
+        """
+        self.transport.close()
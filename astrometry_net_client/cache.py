@@ -0,0 +1,533 @@
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Optional
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, no locking between processes
+    fcntl = None  # type: ignore
+
+log = logging.getLogger(__name__)
+
+# Default maximal size of the cache: 1 GiB
+MAX_SIZE = 2**30
+
+# Default maximal size of the in-memory product cache: 256 MiB
+MEMORY_MAX_SIZE = 2**28
+
+# Default time (in seconds) a cached session key is used: 12 hours
+SESSION_MAX_AGE = 12 * 3600
+
+
+class DiskCache(object):
+    """
+    Persistent cache on disk for the result files of solved jobs (e.g. the
+    WCS file or the new FITS file), so they do not have to be downloaded
+    again by a new process.
+
+    Results of a solved job do not change, so they can be cached forever.
+    The file of a result is named by the hash of the job id and the product
+    name (e.g. ``"wcs_file"``). When the total size exceeds ``max_size``, the
+    least recently used files are removed.
+
+    Files are written to a temporary file first and then renamed, so a reader
+    never sees a partially written file. Writing and evicting is guarded by
+    a lock file, so multiple processes can share the same directory. The
+    total size of the files is kept in the directory as well (and only
+    updated while holding the lock), so ``max_size`` holds for all processes
+    together.
+
+    Parameters
+    ----------
+    directory: str
+        Directory in which the files are stored. Created if it does not exist.
+    max_size: int
+        Maximal total size (in bytes) of the cached files.
+
+    Attributes
+    ----------
+    hits: int
+        Number of results found in the cache (by this object).
+    misses: int
+        Number of results not found in the cache (by this object).
+
+    Examples
+    --------
+    >>> cache = DiskCache("~/.cache/astrometry_net_client", max_size=2**30)
+    >>> client = Client(api_key="XXXXX", disk_cache=cache)
+    """
+
+    lock_name = ".lock"
+    size_name = ".size"
+
+    def __init__(self, directory: str, max_size: int = MAX_SIZE):
+        if max_size < 0:
+            raise ValueError("max_size must be positive")
+        self.directory = os.path.abspath(os.path.expanduser(directory))
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def _path(self, job_id, product: str) -> str:
+        key = hashlib.sha256("{}/{}".format(job_id, product).encode()).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            path = os.path.join(self.directory, self.lock_name)
+            with open(path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_size(self) -> int:
+        # Only called with the lock held
+        try:
+            with open(os.path.join(self.directory, self.size_name)) as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            # Not written yet (or cut off by a crash), count the files
+            return self.size()
+
+    def _write_size(self, size: int) -> None:
+        with open(os.path.join(self.directory, self.size_name), "w") as f:
+            f.write(str(size))
+
+    def get(self, job_id, product: str) -> Optional[bytes]:
+        """
+        Read the cached result of the job.
+
+        Parameters
+        ----------
+        job_id: int
+            Identifier of the job.
+        product: str
+            Name of the result, e.g. ``"wcs_file"``.
+
+        Returns
+        -------
+        bytes or None
+            The contents of the result, or ``None`` if it is not cached.
+        """
+        path = self._path(job_id, product)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._stats_lock:
+                self.misses += 1
+            return None
+
+        try:
+            # Mark as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            pass  # evicted by another process after it was read
+
+        log.debug("Cache hit for {} of job {}".format(product, job_id))
+        with self._stats_lock:
+            self.hits += 1
+        return data
+
+    def put(self, job_id, product: str, data: bytes) -> None:
+        """
+        Store the result of a job in the cache, removing the least recently
+        used results if the cache becomes too large.
+
+        Parameters
+        ----------
+        job_id: int
+            Identifier of the job.
+        product: str
+            Name of the result, e.g. ``"wcs_file"``.
+        data: bytes
+            The contents of the result.
+        """
+        if len(data) > self.max_size:
+            log.debug("Result {} of job {} too large to cache".format(product, job_id))
+            return
+
+        path = self._path(job_id, product)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with self._locked():
+            size = self._read_size()
+            try:
+                # The file of the same result is replaced
+                size -= os.stat(path).st_size
+            except FileNotFoundError:
+                pass
+
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+            size += len(data)
+            if size > self.max_size:
+                size = self._evict()
+            self._write_size(size)
+
+    def _files(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name in (self.lock_name, self.size_name) or name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def _evict(self) -> int:
+        files = sorted(self._files())
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, path in files:
+            if size <= self.max_size:
+                break
+            log.debug("Evicting {} from the cache".format(path))
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+        return size
+
+    def size(self) -> int:
+        """
+        The total size (in bytes) of the cached results.
+        """
+        return sum(file_size for _, file_size, _ in self._files())
+
+    def clear(self) -> None:
+        """
+        Remove all cached results.
+        """
+        with self._locked():
+            for _, _, path in list(self._files()):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            self._write_size(0)
+
+    def __contains__(self, key):
+        job_id, product = key
+        return os.path.exists(self._path(job_id, product))
+
+    def __repr__(self):
+        msg = "DiskCache({!r}, max_size={}, hits={}, misses={})"
+        return msg.format(self.directory, self.max_size, self.hits, self.misses)
+
+
+def sizeof(value) -> int:
+    """
+    Estimate the size (in bytes) of a job result, as used by the
+    :py:class:`ProductCache`.
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    # Only a FITS object if astropy was imported already, never import it here
+    fits = sys.modules.get("astropy.io.fits")
+    if fits is None:
+        return sys.getsizeof(value)
+    if isinstance(value, fits.HDUList):
+        return sum(hdu.filebytes() for hdu in value)
+    if isinstance(value, fits.Header):
+        return len(value) * fits.Card.length
+    return sys.getsizeof(value)
+
+
+class ProductCache(object):
+    """
+    In-memory cache for the results of jobs (e.g.
+    :py:meth:`astrometry_net_client.statusables.Job.wcs_file` or
+    :py:meth:`astrometry_net_client.statusables.Job.new_fits_file`), limited
+    to a total of ``max_size`` bytes.
+
+    A single cache is shared by all jobs (see :py:data:`default_product_cache`),
+    so memory use stays bounded, no matter how many jobs are processed or kept
+    alive. When the cache is full, the least recently used results are
+    evicted. Evicted results are kept as weak references: as long as they are
+    still used somewhere else, the same object is returned without
+    downloading it again, but the cache does not keep it alive. (Results
+    which cannot be weakly referenced, such as ``bytes``, are simply dropped.)
+
+    A cache is safe to use from multiple threads.
+
+    Parameters
+    ----------
+    max_size: int
+        Maximal total size (in bytes) of the results kept alive by the cache.
+        A single result larger than this is not cached.
+
+    Attributes
+    ----------
+    hits: int
+        Number of results found in the cache (including weak references).
+    misses: int
+        Number of results not found in the cache.
+
+    Examples
+    --------
+    >>> cache = ProductCache(max_size=2**27)
+    >>> job = Job(1234, product_cache=cache)
+    >>> header = job.wcs_file()
+    >>> job.release()  # remove all results of the job from the cache
+    """
+
+    def __init__(self, max_size: int = MEMORY_MAX_SIZE):
+        if max_size < 0:
+            raise ValueError("max_size must be positive")
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._weak: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def get(self, job_id, product: str, default=None) -> Any:
+        """
+        Get a cached result of a job, or ``default`` if it is not cached.
+        """
+        key = (job_id, product)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+            value = self._weak.get(key)
+            if value is not None:
+                # Still in use elsewhere, make it a strong entry again
+                del self._weak[key]
+                self._insert(key, value, sizeof(value))
+                self.hits += 1
+                return value
+
+            self.misses += 1
+            return default
+
+    def put(self, job_id, product: str, value) -> None:
+        """
+        Store a result of a job, evicting the least recently used results
+        when the cache becomes too large.
+        """
+        key = (job_id, product)
+        size = sizeof(value)
+        with self._lock:
+            self._remove(key)
+            if size > self.max_size:
+                log.debug(
+                    "Result {} of job {} too large to cache".format(product, job_id)
+                )
+                self._keep_weak(key, value)
+                return
+            self._insert(key, value, size)
+
+    def _insert(self, key, value, size):
+        self._entries[key] = (value, size)
+        self._size += size
+        while self._size > self.max_size:
+            old_key, (old_value, old_size) = self._entries.popitem(last=False)
+            self._size -= old_size
+            log.debug(
+                "Evicting {} of job {} from memory".format(old_key[1], old_key[0])
+            )
+            self._keep_weak(old_key, old_value)
+
+    def _keep_weak(self, key, value):
+        try:
+            self._weak[key] = value
+        except TypeError:
+            pass  # not weakly referenceable
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
+        self._weak.pop(key, None)
+
+    def release(self, job_id, product: Optional[str] = None) -> None:
+        """
+        Remove the results of a job from the cache (also the weak references).
+
+        Parameters
+        ----------
+        job_id: int
+            Identifier of the job.
+        product: str
+            Name of the result to remove. All results of the job are removed
+            if not given.
+        """
+        with self._lock:
+            if product is not None:
+                self._remove((job_id, product))
+                return
+            keys = [k for k in self._entries if k[0] == job_id]
+            keys += [k for k in list(self._weak.keys()) if k[0] == job_id]
+            for key in keys:
+                self._remove(key)
+
+    def clear(self) -> None:
+        """
+        Remove all results from the cache.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._weak.clear()
+            self._size = 0
+
+    def size(self) -> int:
+        """
+        The total size (in bytes) of the results kept alive by the cache.
+        """
+        return self._size
+
+    def __contains__(self, key):
+        return key in self._entries or key in self._weak
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        msg = "ProductCache(max_size={}, size={}, hits={}, misses={})"
+        return msg.format(self.max_size, self._size, self.hits, self.misses)
+
+
+default_product_cache = ProductCache()
+
+
+class SessionCache(object):
+    """
+    Persistent cache of session keys on disk, so a new process can reuse the
+    session of an earlier one instead of logging in again (see the
+    ``key_cache`` of :py:class:`astrometry_net_client.session.Session`).
+
+    The session keys are stored in a single JSON file (only readable by the
+    user), by the hash of the API key, together with the time of the login.
+    Keys older than ``max_age`` seconds are not used. Reading and writing is
+    guarded by a lock file, so multiple processes can share the cache.
+
+    Parameters
+    ----------
+    path: str
+        Path of the cache file, created if it does not exist.
+    max_age: float
+        Time (in seconds) after the login during which a session key is used.
+
+    Examples
+    --------
+    >>> cache = SessionCache("~/.cache/astrometry_net_client/sessions.json")
+    >>> client = Client(api_key="XXXXX", key_cache=cache)  # no login request
+    """
+
+    def __init__(self, path: str, max_age: float = SESSION_MAX_AGE):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.max_age = max_age
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._thread_lock = threading.Lock()
+
+    @staticmethod
+    def _name(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode()).hexdigest()
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.path + ".lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            log.warning("Ignoring invalid session cache {}".format(self.path))
+            return {}
+
+    def _write(self, entries: dict) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def get(self, api_key: str) -> Optional[str]:
+        """
+        The cached session key for the API key, or ``None`` if there is none
+        (or it is older than :py:attr:`max_age`).
+        """
+        with self._locked():
+            entry = self._read().get(self._name(api_key))
+        if entry is None or time.time() - entry["time"] > self.max_age:
+            return None
+        return entry["key"]
+
+    def put(self, api_key: str, key: str) -> None:
+        """
+        Store the session key of a new login with the API key.
+        """
+        with self._locked():
+            entries = self._read()
+            now = time.time()
+            # Drop the expired keys of other API keys as well
+            entries = {
+                name: entry
+                for name, entry in entries.items()
+                if now - entry["time"] <= self.max_age
+            }
+            entries[self._name(api_key)] = {"key": key, "time": now}
+            self._write(entries)
+
+    def remove(self, api_key: str) -> None:
+        """
+        Remove the session key of the API key.
+        """
+        with self._locked():
+            entries = self._read()
+            if entries.pop(self._name(api_key), None) is not None:
+                self._write(entries)
+
+    def __repr__(self):
+        return "SessionCache({!r}, max_age={})".format(self.path, self.max_age)
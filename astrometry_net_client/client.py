@@ -1,16 +1,46 @@
 import logging
+import os
+import sys
 import time
-from queue import Queue
-
-from astrometry_net_client.session import Session
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from astrometry_net_client.config import DEFAULT_ENDPOINT
+from astrometry_net_client.index import file_hash
+from astrometry_net_client.journal import Journal
+from astrometry_net_client.pipeline import AdaptiveLimit, UploadPipeline
+from astrometry_net_client.session import Session, SessionPool
 from astrometry_net_client.settings import Settings
-from astrometry_net_client.uploads import FileUpload
+from astrometry_net_client.statusables import JobRegistry, Submission
+from astrometry_net_client.transport import Transport
+from astrometry_net_client.uploads import (
+    ArrayUpload,
+    BytesUpload,
+    FileUpload,
+    HDUListUpload,
+    SourcesUpload,
+)
 
 log = logging.getLogger(__name__)
 
-# TODO: document this value.
+# Default number of files in progress of ``upload_files_gen`` (at most, for
+# nova.astrometry.net), and the size of the connection pool of a client
 MAX_WORKERS = 10
 
+# Number of processes extracting sources (see ``upload_files_gen``)
+EXTRACT_WORKERS = min(os.cpu_count() or 1, MAX_WORKERS)
+
+
+def _is_array(data) -> bool:
+    # Without numpy imported, the data cannot be an array
+    np = sys.modules.get("numpy")
+    return np is not None and isinstance(data, np.ndarray)
+
+
+def _is_hdulist(data) -> bool:
+    fits = sys.modules.get("astropy.io.fits")
+    return fits is not None and isinstance(data, fits.HDUList)
+
 
 class Client:
     """
@@ -22,28 +52,133 @@ class Client:
         Optional argument to provide the session for the API. If not provided,
         you must either specify the keyword ``api_key`` or ``location``, or
         have the key present in your environment. See
-        :py:class:`astrometry_net_client.session.Session`
+        :py:class:`astrometry_net_client.session.Session`. Can also be a
+        :py:class:`astrometry_net_client.session.SessionPool`, to spread the
+        uploads over several sessions.
     settings: :py:class:`astrometry_net_client.settings.Settings`, dict
         An optional settings object, which will be applied to all uploads.
         If not specified, the settings object will be created from given
         keyword arguments which correspond to valid settings. For this see
         :py:class:`astrometry_net_client.settings.Settings`.
+    transport: :py:class:`astrometry_net_client.transport.DirectTransport`
+        Optional transport used for all requests of the client. If not
+        specified, the transport of the given ``session`` is used. When the
+        session is created by the client, a pooled
+        :py:class:`astrometry_net_client.transport.Transport` is created
+        for it, with a pool size of :py:const:`MAX_WORKERS`.
+    disk_cache: :py:class:`astrometry_net_client.cache.DiskCache`
+        Optional persistent cache for the result files of the jobs of the
+        client.
+    product_cache: :py:class:`astrometry_net_client.cache.ProductCache`
+        Optional in-memory cache for the results of the jobs of the client,
+        bounded in size. Defaults to the cache shared by all jobs
+        (:py:data:`astrometry_net_client.cache.default_product_cache`).
+    preprocess: :py:class:`astrometry_net_client.preprocess.Preprocessor`
+        Optional preprocessor which reduces the images before they are
+        uploaded. The settings of each upload are adjusted to the reduced
+        image, and the WCS of the jobs is mapped back to the original image.
+    index: :py:class:`astrometry_net_client.index.UploadIndex`
+        Optional index of earlier uploads. A file which was uploaded before
+        with the same settings is not uploaded again, the earlier job (or
+        submission) is used instead, unless that job failed. Not used for
+        uploads with a ``preprocess``, as the reduction of the earlier upload
+        is not known. Uploads to another instance than nova.astrometry.net
+        are keyed by its url as well, so the index can be shared by clients
+        of different instances.
+    journal: :py:class:`astrometry_net_client.journal.Journal` or str
+        Optional journal (or the path of one) in which the progress of the
+        uploads of :py:meth:`upload_files_gen` and :py:meth:`run_batch` is
+        recorded, so they can be resumed after a crash with :py:meth:`resume`.
+        A journal opened from a path is closed by :py:meth:`close`, a given
+        journal object is left open.
+    endpoint: :py:class:`astrometry_net_client.config.Endpoint` or str
+        The Astrometry.net instance to use, when the client creates the
+        session (see :py:class:`astrometry_net_client.session.Session`).
+        Defaults to nova.astrometry.net. To use several instances, give a
+        :py:class:`astrometry_net_client.session.SessionPool` with a session
+        for each of them as the ``session``; an ``index`` cannot be used
+        then.
+    concurrency: :py:class:`astrometry_net_client.pipeline.AdaptiveLimit`
+        Limit of the number of files in progress in :py:meth:`upload_files_gen`
+        and :py:meth:`run_batch` (unless a ``queue_size`` is given), shared by
+        all their runs. It is decreased when the server is congested, i.e.
+        the uploads slow down or requests of the :py:attr:`transport` are
+        retried. For nova.astrometry.net, which is shared by everyone, it
+        defaults to a limit starting at half of :py:const:`MAX_WORKERS`, and
+        at most :py:const:`MAX_WORKERS`. For other instances (e.g. a
+        self-hosted one), it starts at :py:const:`MAX_WORKERS` without a
+        ceiling. To raise the ceiling, give e.g.
+        ``concurrency=AdaptiveLimit(MAX_WORKERS, maximum=50)``.
     kwargs: arguments
         Used to create a session or settings object, if either is not
         specified. Will extract the relevant arguments relevant to the object
         which is created before passing them to the object constructor.
         See :py:class:`astrometry_net_client.settings.Settings` and
         :py:class:`astrometry_net_client.session.Session`
+
+    Attributes
+    ----------
+    registry: :py:class:`astrometry_net_client.statusables.JobRegistry`
+        Registry of all jobs of the client. The same
+        :py:class:`astrometry_net_client.statusables.Job` object is used for a
+        job id everywhere (e.g. submissions, :py:meth:`upload_files_gen` and
+        :py:meth:`get_job`), so its status and cached results are shared.
+    concurrency: :py:class:`astrometry_net_client.pipeline.AdaptiveLimit`
+        The limit of the number of files in progress, its ``value`` is the
+        current limit.
     """
 
-    def __init__(self, session=None, settings=None, **kwargs):
+    def __init__(
+        self,
+        session=None,
+        settings=None,
+        transport=None,
+        disk_cache=None,
+        product_cache=None,
+        preprocess=None,
+        index=None,
+        journal=None,
+        concurrency=None,
+        **kwargs,
+    ):
         # TODO, make session optional?
         if session is None:
-            args = {k: v for k, v in kwargs.items() if k in {"api_key", "key_location"}}
-            self.session = Session(**args)
+            if transport is None:
+                transport = Transport(pool_maxsize=MAX_WORKERS)
+            session_args = {"api_key", "key_location", "key_cache", "endpoint"}
+            args = {k: v for k, v in kwargs.items() if k in session_args}
+            self.session = Session(transport=transport, **args)
         else:
             self.session = session
 
+        self.transport = self.session.transport if transport is None else transport
+        self.preprocess = preprocess
+        # The endpoint of an upload is only chosen when it is submitted, after
+        # it is looked up in the index
+        if index is not None and len(self._endpoints()) > 1:
+            raise ValueError("An index cannot be used with several endpoints")
+        self.index = index
+        # Index keys of the uploads of which the job is not finished yet, by
+        # the (kind, endpoint, id) of their submission or job
+        self._index_keys = {}
+        self.journal = None
+        self._owns_journal = False
+        self._set_journal(journal)
+        self._extract_pool = None
+        if concurrency is None:
+            if DEFAULT_ENDPOINT in self._endpoints():
+                concurrency = AdaptiveLimit(MAX_WORKERS // 2, maximum=MAX_WORKERS)
+            else:
+                concurrency = AdaptiveLimit(MAX_WORKERS)
+        concurrency.watch(self.transport.retry)
+        self.concurrency = concurrency
+        self.registry = JobRegistry(
+            transport=self.transport,
+            disk_cache=disk_cache,
+            product_cache=product_cache,
+            endpoint=self.session.endpoint,
+        )
+
         if settings is None:
             setting_args = {k: v for k, v in kwargs.items() if k in Settings._settings}
             self.settings = Settings(**setting_args)
@@ -56,26 +191,47 @@ class Client:
     def upload_files_gen(
         self,
         files_iter,
-        queue_size=MAX_WORKERS,
+        queue_size=None,
+        fetch=None,
+        start=1,
+        end=60,
+        mode="image",
     ):
         """
         Generator which uploads a number of files concurrently, yielding the
         :py:class:`astrometry_net_client.statusables.Job` & filename when done.
 
-        Note that the ``files_iter`` argument is fully consumed when submitting
-        to the executor is done. This means that the results will only be
-        yielded once the iterator is consumed.
+        The files are processed by a
+        :py:class:`astrometry_net_client.pipeline.UploadPipeline`, with
+        separate workers for uploading, querying the status and (optionally)
+        fetching the results. The ``files_iter`` argument is consumed while
+        the files are processed, when there is room in the queue. With an
+        :py:attr:`index`, files which were uploaded before are not uploaded
+        again.
 
         Parameters
         ----------
         files_iter: iterable
             Some iterable containing paths to the files which will be uploaded.
-            Is fully consumed before any result is yielded.
-        queue_size: int, optional
+        queue_size: int or :py:class:`astrometry_net_client.pipeline.AdaptiveLimit`, optional
             A positive integer, controlling the size of the queue. This will
-            determine the maximum number of simultaneous submissions. Must be
-            greater than 0 and lower than :py:const:`MAX_WORKERS`. Default is
-            :py:const:`MAX_WORKERS`.
+            determine the maximum number of simultaneous submissions. Defaults
+            to the adaptive :py:attr:`concurrency` limit of the client.
+        fetch: str or callable, optional
+            Result to retrieve for each successful job before it is yielded,
+            e.g. ``"wcs_file"``. See
+            :py:class:`astrometry_net_client.pipeline.UploadPipeline`.
+        start: float, optional
+            Initial time (in seconds) between two status queries of a file,
+            doubled after each query.
+        end: float, optional
+            Maximal time (in seconds) between two status queries of a file.
+        mode: str, optional
+            ``"image"`` (default) to upload the files, or ``"sources"`` to
+            extract the sources of each file (in a pool of processes, see
+            :py:func:`astrometry_net_client.sources.extract_sources`) and only
+            upload those, with the size of the image (see
+            :py:class:`astrometry_net_client.uploads.SourcesUpload`).
 
         Yields
         ------
@@ -89,74 +245,409 @@ class Client:
         Raises
         ------
         ValueError
-            When the queue_size is invalid.
+            When the queue_size or mode is invalid.
+        """
+        pipeline = self._make_pipeline(
+            queue_size, fetch=fetch, start=start, end=end, mode=mode
+        )
+        for job, filename in pipeline.run(files_iter):
+            self._record_job(filename, job)
+            yield job, filename
+
+    def run_batch(self, files_iter, queue_size=None, fetch=None, **kwargs):
+        """
+        Uploads a number of files concurrently (see :py:meth:`upload_files_gen`)
+        and waits until all of them are finished.
+
+        Parameters
+        ----------
+        files_iter: iterable
+            Some iterable containing paths to the files which will be uploaded.
+        queue_size: int or :py:class:`astrometry_net_client.pipeline.AdaptiveLimit`, optional
+            The maximum number of simultaneous submissions, defaults to the
+            :py:attr:`concurrency` limit.
+        fetch: str or callable, optional
+            Result to retrieve for each successful job, e.g. ``"wcs_file"``.
+        kwargs: arguments
+            The ``mode`` (see :py:meth:`upload_files_gen`), other arguments are
+            passed to :py:class:`astrometry_net_client.pipeline.UploadPipeline`,
+            e.g. the number of workers per stage.
+
+        Returns
+        -------
+        (list, :py:class:`astrometry_net_client.pipeline.PipelineStats`):
+            The list of ``(job, filename)`` tuples in order of completion, and
+            the statistics (e.g. throughput) of each stage.
+
+        Raises
+        ------
+        ValueError
+            When the queue_size or mode is invalid.
+
+        Examples
+        --------
+        >>> results, stats = client.run_batch(files, fetch="wcs_file")
+        >>> stats["upload"].throughput  # uploads per second
+        """
+        pipeline = self._make_pipeline(queue_size, fetch=fetch, **kwargs)
+        results = []
+        for job, filename in pipeline.run(files_iter):
+            self._record_job(filename, job)
+            results.append((job, filename))
+        log.info("Batch finished: {}".format(pipeline.stats))
+        return results, pipeline.stats
+
+    def _make_pipeline(self, queue_size, mode="image", **kwargs):
+        if queue_size is None:
+            queue_size = self.concurrency
+        elif not isinstance(queue_size, AdaptiveLimit) and queue_size < 1:
+            raise ValueError(f"queue_size must be greater than 0, was: {queue_size}")
+        if mode == "image":
+            submit = self._submit_file
+        elif mode == "sources":
+            submit = self._submit_sources
+            # Each upload worker waits for its extraction, so use as many
+            # as there are processes
+            kwargs.setdefault("upload_workers", EXTRACT_WORKERS)
+        else:
+            raise ValueError("mode must be 'image' or 'sources', was: {}".format(mode))
+        return UploadPipeline(
+            self._journaled(submit), queue_size, on_job=self._job_known, **kwargs
+        )
+
+    def resume(self, journal=None, fetch=None, start=1, end=60):
         """
-        SLEEP_TIME = 0.3  # seconds
+        Generator which continues the uploads recorded in a journal (e.g. of
+        a batch which crashed), without uploading the files again. The
+        outstanding submissions and jobs are polled until they are done, and
+        yielded like :py:meth:`upload_files_gen` does.
+
+        Parameters
+        ----------
+        journal: :py:class:`astrometry_net_client.journal.Journal` or str
+            The journal (or its path) to resume. Becomes the :py:attr:`journal`
+            of the client, so the progress is recorded in it. Defaults to the
+            current journal of the client.
+        fetch: str or callable, optional
+            Result to retrieve for each successful job before it is yielded.
+        start: float, optional
+            Initial time (in seconds) between two status queries of a file.
+        end: float, optional
+            Maximal time (in seconds) between two status queries of a file.
 
-        files_iter = iter(files_iter)
-        if queue_size < 1 or queue_size > MAX_WORKERS:
-            raise ValueError(
-                "queue_size must be greater than 0 and less or equal to ",
-                f"{MAX_WORKERS}, was: {queue_size}",
+        Yields
+        ------
+        (:py:class:`astrometry_net_client.statusables.Job`, ``str``):
+            The finished job and the corresponding filename.
+
+        Raises
+        ------
+        ValueError
+            When no journal is given, and the client has none.
+        """
+        if journal is not None:
+            self._set_journal(journal)
+        if self.journal is None:
+            raise ValueError("No journal to resume")
+
+        outstanding = defaultdict(deque)
+        for entry in self.journal.outstanding():
+            outstanding[entry.filename].append(entry)
+        filenames = [name for name, entries in outstanding.items() for _ in entries]
+        log.info("Resuming {} uploads".format(len(filenames)))
+
+        def reattach(filename):
+            entry = outstanding[filename].popleft()
+            if entry.job_id is not None:
+                return self.registry.get(entry.job_id, endpoint=entry.endpoint)
+            return Submission(
+                entry.submission_id,
+                transport=self.transport,
+                registry=self.registry,
+                endpoint=entry.endpoint,
             )
-        processing_queue = Queue(maxsize=queue_size)
-
-        # Populate queue initially
-        for _, filename in zip(range(queue_size), files_iter):
-            self._insert_submission(filename, processing_queue)
-
-        while not processing_queue.empty():
-            filename, submission, job = processing_queue.get()
-            log_msg = "Checking file {}, job exists: {}"
-            log.debug(log_msg.format(filename, job is not None))
-            # The item in the queue has 2 states; if it is still only a
-            # submission job will be None and we have to create a job out of
-            # it. When the job is made, we can check if the job is done. When
-            # the job is finished return (yield) the value, otherwise put it
-            # back in the queue.
-
-            if job is None:
-                submission.status()
-                if submission.done():
-                    job = submission.jobs[0]
-                else:
-                    processing_queue.put((filename, submission, job))
-                    continue
-
-            job.status()
-            if job.done():
-                try:
-                    filename = next(files_iter)
-                except StopIteration:
-                    pass
-                else:
-                    self._insert_submission(filename, processing_queue)
-                log_msg = "FINISHED submission {}, yielding..."
-                log.info(log_msg.format(filename))
-                yield (job, filename)
+
+        # Nothing is uploaded, so all uploads can be polled at the same time
+        pipeline = UploadPipeline(
+            reattach,
+            max(len(filenames), 1),
+            fetch=fetch,
+            on_job=self._job_known,
+            start=start,
+            end=end,
+        )
+        for job, filename in pipeline.run(filenames):
+            self._record_job(filename, job)
+            yield job, filename
+
+    def _set_journal(self, journal):
+        """
+        Use the given journal (or open the one at the given path), closing
+        the current journal if the client opened it.
+        """
+        if journal is self.journal:
+            return
+        if self._owns_journal:
+            self.journal.close()
+        self._owns_journal = isinstance(journal, str)
+        self.journal = Journal(journal) if self._owns_journal else journal
+
+    def _journaled(self, submit):
+        """
+        Wrap a submit function, such that the resulting submission (or
+        reused job) is recorded in the :py:attr:`journal`.
+        """
+        if self.journal is None:
+            return submit
+
+        def wrapper(filename):
+            submission = submit(filename)
+            endpoint = self._endpoint_url(submission)
+            if isinstance(submission, Submission):
+                self.journal.submitted(filename, submission.id, endpoint=endpoint)
             else:
-                processing_queue.put((filename, submission, job))
+                self.journal.job(filename, submission.id, endpoint=endpoint)
+            return submission
+
+        return wrapper
+
+    def _job_known(self, filename, submission, job):
+        """
+        Called when the job of a submission is known: the pending index key
+        moves to the job, and the job is recorded in the :py:attr:`journal`.
+        """
+        self._pending_job(submission, job)
+        self._journal_job(filename, submission, job)
+
+    def _journal_job(self, filename, submission, job):
+        if self.journal is not None:
+            self.journal.job(
+                filename,
+                job.id,
+                submission_id=submission.id,
+                endpoint=self._endpoint_url(job),
+            )
 
-            time.sleep(SLEEP_TIME)
+    def _endpoints(self):
+        """
+        The endpoints of the session(s) of the client.
+        """
+        sessions = getattr(self.session, "sessions", [self.session])
+        return {session.endpoint for session in sessions}
 
-    def _insert_submission(self, filename, queue):
+    def _endpoint_url(self, statusable):
+        """
+        The url of the endpoint of a submission or job, to record in the
+        :py:attr:`journal`. Only given for another instance than
+        nova.astrometry.net.
+        """
+        if statusable.endpoint == DEFAULT_ENDPOINT:
+            return None
+        return statusable.endpoint.url
+
+    def _extraction_pool(self):
+        if self._extract_pool is None:
+            self._extract_pool = ProcessPoolExecutor(EXTRACT_WORKERS)
+        return self._extract_pool
+
+    def _submit_sources(self, filename):
+        """
+        Helper function which extracts the sources of the given file (in the
+        process pool), uploads them and returns the submission. This is not
+        intended to be used by a user.
+        """
+        key, earlier = self._lookup(filename, self.settings, mode="sources")
+        if earlier is not None:
+            return earlier
+
+        # Imported here, as it needs numpy and astropy
+        from astrometry_net_client.sources import extract_file_sources
+
+        future = self._extraction_pool().submit(extract_file_sources, filename)
+        sources, (height, width) = future.result()
+        log.debug("Extracted {} sources from {}".format(len(sources), filename))
+
+        submission = self._submit(
+            SourcesUpload,
+            sources,
+            settings=self.settings,
+            image_width=width,
+            image_height=height,
+        )
+        return self._remember(key, submission, filename)
+
+    def _submit(self, upload_cls, *args, **kwargs):
+        """
+        Create an upload of the given class with the session of the client,
+        and submit it. With a
+        :py:class:`astrometry_net_client.session.SessionPool`, the least busy
+        session of the pool is used.
+        """
+
+        def make_upload(session):
+            return upload_cls(
+                *args, session=session, transport=self.transport, **kwargs
+            )
+
+        if isinstance(self.session, SessionPool):
+            return self.session.submit(make_upload, registry=self.registry)
+        return make_upload(self.session).submit(registry=self.registry)
+
+    def close(self):
+        """
+        Stop the process pool used to extract sources (if it was started),
+        and close the :py:attr:`journal` if the client opened it.
+        """
+        if self._extract_pool is not None:
+            self._extract_pool.shutdown()
+            self._extract_pool = None
+        if self._owns_journal:
+            self.journal.close()
+            self._owns_journal = False
+
+    def _lookup(self, filename, settings, mode="image"):
+        """
+        Look up an earlier upload of the file in the :py:attr:`index`.
+
+        Returns
+        -------
+        (tuple, :py:class:`astrometry_net_client.statusables.Job` or :py:class:`astrometry_net_client.statusables.Submission`)
+            The key of the file in the index (``None`` if the index is not
+            used) and the earlier job or submission (``None`` if there is
+            none, or if its job failed).
+        """
+        if self.index is None or (mode == "image" and self.preprocess is not None):
+            return None, None
+
+        effective = dict(settings)
+        if mode != "image":
+            effective["mode"] = mode
+        # Job ids are only unique per instance
+        endpoint = self.registry.endpoint
+        if endpoint != DEFAULT_ENDPOINT:
+            effective["endpoint"] = endpoint.url
+        key = (file_hash(filename), effective)
+
+        entry = self.index.get(*key)
+        if entry is None:
+            return key, None
+        if entry.job_id is None:
+            log.info("File {} was submitted before".format(filename))
+            submission = Submission(
+                entry.submission_id,
+                transport=self.transport,
+                registry=self.registry,
+                endpoint=self.registry.endpoint,
+            )
+            self._pending(key, submission)
+            return key, submission
+
+        job = self.registry.get(entry.job_id)
+        job.status()
+        if job.done() and not job.success():
+            log.info("Earlier job {} of {} failed".format(job.id, filename))
+            self.index.remove(*key)
+            return key, None
+        log.info("File {} was solved before by job {}".format(filename, job.id))
+        self._pending(key, job)
+        return key, job
+
+    def _remember(self, key, submission, filename):
+        """
+        Add the submission of a file to the :py:attr:`index` (if the file has
+        a ``key``), and return it.
+        """
+        if key is not None:
+            self.index.add(*key, submission_id=submission.id, filename=str(filename))
+            self._pending(key, submission)
+        return submission
+
+    def _pending(self, key, statusable):
+        """
+        Keep the index ``key`` of an upload until its job is finished (see
+        :py:meth:`_record_job`).
+        """
+        kind = "submission" if isinstance(statusable, Submission) else "job"
+        self._index_keys[kind, statusable.endpoint, statusable.id] = key
+
+    def _pending_job(self, submission, job):
+        """
+        Move the pending index key of a submission to its job.
+        """
+        if not isinstance(submission, Submission):
+            return
+        pending = ("submission", submission.endpoint, submission.id)
+        key = self._index_keys.pop(pending, None)
+        if key is not None:
+            self._pending(key, job)
+
+    def _record_job(self, filename, job):
+        """
+        Store the job of a finished upload in the :py:attr:`journal` and the
+        :py:attr:`index`, or remove the upload from the index if the job
+        failed (so it is uploaded again next time).
+        """
+        self._finished(job)
+        if self.journal is not None:
+            self.journal.finished(
+                filename, job.id, job.success(), endpoint=self._endpoint_url(job)
+            )
+        key = self._index_keys.pop(("job", job.endpoint, job.id), None)
+        if key is None:
+            return
+        if job.success():
+            self.index.add(*key, job_id=job.id, filename=str(filename))
+        else:
+            self.index.remove(*key)
+
+    def _finished(self, job):
+        """
+        Mark the submission of the job as finished in the
+        :py:class:`astrometry_net_client.session.SessionPool`, if any.
+        """
+        if isinstance(self.session, SessionPool):
+            self.session.finished(job)
+
+    def _submit_file(self, filename):
         """
         Helper function which creates an upload for the given filename, and
-        inserts the submission in a queue. This is not intended to be used
-        by a user.
+        returns the submission. This is not intended to be used by a user.
 
         Parameters
         ----------
         filename: str
-            The filename of the file to be submitted into the queue.
-        queue: Queue
-            The queue in which to insert the submission.
+            The filename of the file to be submitted.
+
+        Returns
+        -------
+        :py:class:`astrometry_net_client.statusables.Submission` or :py:class:`astrometry_net_client.statusables.Job`
+            The submission, or the earlier job if the file was solved before
+            (see :py:attr:`index`).
         """
-        log_msg = "Submitting file {}"
-        log.info(log_msg.format(filename))
-        upl = FileUpload(filename, session=self.session, settings=self.settings)
-        submission = upl.submit()
-        queue.put((filename, submission, None))
+        key, earlier = self._lookup(filename, self.settings)
+        if earlier is not None:
+            return earlier
+
+        submission = self._submit(
+            FileUpload, filename, settings=self.settings, preprocess=self.preprocess
+        )
+        return self._remember(key, submission, filename)
+
+    def get_job(self, job_id):
+        """
+        Returns the job with the given id, from the :py:attr:`registry` of the
+        client.
+
+        Parameters
+        ----------
+        job_id: int
+            Identifier of the job.
+
+        Returns
+        -------
+        :py:class:`astrometry_net_client.statusables.Job`
+        """
+        return self.registry.get(job_id)
 
     def upload_file(self, filename, settings=None):
         """
@@ -183,17 +674,84 @@ class Client:
         if settings is not None:
             upl_settings.update(settings)
 
-        upl = FileUpload(filename, session=self.session, settings=upl_settings)
-        start = time.time()
-        submission = upl.submit()
+        key, earlier = self._lookup(filename, upl_settings)
+        if earlier is None:
+            submission = self._submit(
+                FileUpload, filename, settings=upl_settings, preprocess=self.preprocess
+            )
+            earlier = self._remember(key, submission, filename)
+        job = self._wait_for_upload(earlier, filename)
+        self._record_job(filename, job)
+        return job
 
-        msg = "File {} submitted, waiting for it to finish"
-        log.info(msg.format(filename))
+    def upload_data(self, data, settings=None, filename="upload.fits", header=None):
+        """
+        Uploads data which is already in memory and returns the completed
+        job when finished solving. No temporary file is written, and the
+        pixel data is not copied (see
+        :py:class:`astrometry_net_client.uploads.HDUListUpload`).
 
-        submission.until_done()  # blocks here
+        Parameters
+        ----------
+        data: numpy.ndarray, astropy.io.fits.HDUList or bytes
+            The image (array), FITS file (HDUList) or contents of an image
+            file (bytes) to upload.
+        settings: :py:class:`astrometry_net_client.settings.Settings`
+            An optional settings dict which only applies to this specific
+            upload. Will override the default settings with which the
+            :py:class:`Client` was constructed.
+        filename: str
+            Name of the uploaded file, as it is shown by Astrometry.net.
+        header: astropy.io.fits.Header
+            Optional header for the FITS file, only used if ``data`` is an
+            array.
 
-        # pretty much guarenteed to have exactly one job
-        job = submission.jobs[0]
+        Returns
+        -------
+        Job: :py:class:`astrometry_net_client.statusables.Job`
+            The job of the resulting upload. NOTE: It is possible that the job
+            did not succeed, therefore check with
+            :py:meth:`astrometry_net_client.statusables.Statusable.success` if
+            it did.
+        """
+        upl_settings = Settings(self.settings)
+        if settings is not None:
+            upl_settings.update(settings)
+
+        kwargs = dict(
+            settings=upl_settings,
+            filename=filename,
+            preprocess=self.preprocess,
+        )
+        if isinstance(data, (bytes, bytearray)):
+            submission = self._submit(BytesUpload, bytes(data), **kwargs)
+        elif _is_array(data):
+            submission = self._submit(ArrayUpload, data, header=header, **kwargs)
+        elif _is_hdulist(data):
+            submission = self._submit(HDUListUpload, data, **kwargs)
+        else:
+            msg = "Cannot upload data of type {}"
+            raise TypeError(msg.format(type(data).__name__))
+        job = self._wait_for_upload(submission, filename)
+        self._finished(job)
+        return job
+
+    def _wait_for_upload(self, submission, filename):
+        """
+        Waits for the job of the submission (or the given job) to finish.
+        """
+        start = time.time()
+        if isinstance(submission, Submission):
+            msg = "File {} submitted, waiting for it to finish"
+            log.info(msg.format(filename))
+
+            submission.until_done()  # blocks here
+
+            # pretty much guarenteed to have exactly one job
+            job = submission.jobs[0]
+            self._pending_job(submission, job)
+        else:
+            job = submission
 
         job.until_done()  # blocks here
         end = time.time()
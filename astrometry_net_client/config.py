@@ -1,9 +1,77 @@
-BASE_URL = "http://nova.astrometry.net/api"
+from typing import Optional, Union
+
+SITE_URL = "http://nova.astrometry.net"
+BASE_URL = SITE_URL + "/api"
 login_url = BASE_URL + "/login"
 upload_url = BASE_URL + "/upload"
 url_upload_url = BASE_URL + "/url_upload"
 
 
+class Endpoint(object):
+    """
+    An Astrometry.net web instance, e.g. a self-hosted one. The API is
+    located at ``<url>/api``, the result files of jobs directly under the
+    ``url``.
+
+    Parameters
+    ----------
+    url: str
+        Address of the instance, with or without the ``/api`` path. Defaults
+        to nova.astrometry.net.
+
+    Examples
+    --------
+    >>> Endpoint("https://astrometry.example.org/api").url
+    'https://astrometry.example.org'
+    >>> Endpoint("https://astrometry.example.org").login_url
+    'https://astrometry.example.org/api/login'
+    """
+
+    def __init__(self, url: str = SITE_URL):
+        url = url.rstrip("/")
+        if url.endswith("/api"):
+            url = url[: -len("/api")]
+        self.url = url
+        self.api_url = url + "/api"
+
+    @property
+    def login_url(self) -> str:
+        return self.api_url + "/login"
+
+    @property
+    def upload_url(self) -> str:
+        return self.api_url + "/upload"
+
+    @property
+    def url_upload_url(self) -> str:
+        return self.api_url + "/url_upload"
+
+    def __eq__(self, other):
+        return isinstance(other, Endpoint) and self.url == other.url
+
+    def __hash__(self):
+        return hash(self.url)
+
+    def __repr__(self):
+        return "Endpoint({!r})".format(self.url)
+
+
+# The public instance, used when no endpoint is given
+DEFAULT_ENDPOINT = Endpoint()
+
+
+def as_endpoint(endpoint: Optional[Union[str, Endpoint]]) -> Endpoint:
+    """
+    The :py:class:`Endpoint` for the given url (or endpoint), the
+    :py:data:`DEFAULT_ENDPOINT` if it is ``None``.
+    """
+    if endpoint is None:
+        return DEFAULT_ENDPOINT
+    if isinstance(endpoint, Endpoint):
+        return endpoint
+    return Endpoint(endpoint)
+
+
 def read_api_key(location):
     """
     Reads an api key from a file in the specifies location.
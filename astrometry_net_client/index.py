@@ -0,0 +1,272 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Iterable, List, Mapping, NamedTuple, Optional, Tuple, Union
+
+log = logging.getLogger(__name__)
+
+# Number of bytes read at once when hashing a file
+CHUNK_SIZE = 2**20
+
+# Seconds to wait for a lock on the database held by another connection
+TIMEOUT = 30.0
+
+
+def file_hash(file: Union[str, IO[bytes]], chunk_size: int = CHUNK_SIZE) -> str:
+    """
+    SHA-256 hash of the contents of a file, read in chunks of ``chunk_size``
+    bytes (so also large files are never loaded in memory at once).
+
+    Parameters
+    ----------
+    file: str or file-like
+        Path of the file, or a binary file object, which is read from its
+        current position until the end.
+    chunk_size: int
+        Number of bytes read at once.
+
+    Returns
+    -------
+    str
+        The hexadecimal digest.
+    """
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as f:
+            return file_hash(f, chunk_size=chunk_size)
+
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(chunk_size), b""):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def settings_hash(settings: Optional[Mapping] = None) -> str:
+    """
+    Hash of the (effective) settings of an upload, independent of the order
+    of the settings. Values which are not JSON types are hashed by their
+    string representation.
+    """
+    text = json.dumps(dict(settings or {}), sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class IndexEntry(NamedTuple):
+    content_hash: str
+    settings_hash: str
+    submission_id: Optional[int]
+    job_id: Optional[int]
+    filename: Optional[str]
+    created: float
+
+
+class UploadIndex(object):
+    """
+    Persistent index of earlier uploads, stored in an SQLite database, to
+    avoid submitting the same file again (with the same settings).
+
+    Uploads are keyed by the hash of the contents of the file (see
+    :py:func:`file_hash`) and the hash of the effective settings (see
+    :py:func:`settings_hash`), so a renamed or copied file is still
+    recognized, but an upload with other settings is not. For every key, the
+    submission id and (once it is known) the job id are stored.
+
+    The index can be shared by multiple threads and processes: every thread
+    uses its own connection, and the database uses write-ahead logging, so
+    readers are not blocked by a writer.
+
+    Parameters
+    ----------
+    path: str
+        Path of the database file, created if it does not exist.
+
+    Examples
+    --------
+    >>> index = UploadIndex("~/.cache/astrometry_net_client/uploads.sqlite")
+    >>> client = Client(api_key="XXXXX", index=index)
+    >>> # Files which were submitted before are not uploaded again
+    >>> results, stats = client.run_batch(files)
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS uploads ("
+                " content_hash TEXT NOT NULL,"
+                " settings_hash TEXT NOT NULL,"
+                " submission_id INTEGER,"
+                " job_id INTEGER,"
+                " filename TEXT,"
+                " created REAL NOT NULL,"
+                " PRIMARY KEY (content_hash, settings_hash))"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=TIMEOUT)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(
+        self, content_hash: str, settings: Optional[Mapping] = None
+    ) -> Optional[IndexEntry]:
+        """
+        Get the entry of an earlier upload.
+
+        Parameters
+        ----------
+        content_hash: str
+            Hash of the contents of the uploaded file (see :py:func:`file_hash`).
+        settings: dict
+            The effective settings of the upload.
+
+        Returns
+        -------
+        :py:class:`IndexEntry` or None
+            The entry, or ``None`` if the file was not uploaded with these
+            settings before.
+        """
+        row = (
+            self._connection()
+            .execute(
+                "SELECT * FROM uploads WHERE content_hash = ? AND settings_hash = ?",
+                (content_hash, settings_hash(settings)),
+            )
+            .fetchone()
+        )
+        return None if row is None else IndexEntry(*row)
+
+    def lookup_file(
+        self, filename: str, settings: Optional[Mapping] = None
+    ) -> Optional[IndexEntry]:
+        """
+        Get the entry of an earlier upload of the given file (see :py:meth:`get`).
+        """
+        return self.get(file_hash(filename), settings)
+
+    def add(
+        self,
+        content_hash: str,
+        settings: Optional[Mapping] = None,
+        submission_id: Optional[int] = None,
+        job_id: Optional[int] = None,
+        filename: Optional[str] = None,
+    ) -> None:
+        """
+        Record an upload, replacing an existing entry for the same key. When
+        only the job id is given for an existing entry, its submission id is
+        kept (and vice versa).
+
+        Parameters
+        ----------
+        content_hash: str
+            Hash of the contents of the uploaded file (see :py:func:`file_hash`).
+        settings: dict
+            The effective settings of the upload.
+        submission_id: int
+            Identifier of the submission of the upload.
+        job_id: int
+            Identifier of the job of the upload.
+        filename: str
+            Name of the uploaded file, only for inspection.
+        """
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT INTO uploads VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (content_hash, settings_hash) DO UPDATE SET "
+                " submission_id = COALESCE(excluded.submission_id, submission_id),"
+                " job_id = COALESCE(excluded.job_id, job_id),"
+                " filename = COALESCE(excluded.filename, filename)",
+                (
+                    content_hash,
+                    settings_hash(settings),
+                    submission_id,
+                    job_id,
+                    filename,
+                    time.time(),
+                ),
+            )
+
+    def remove(self, content_hash: str, settings: Optional[Mapping] = None) -> None:
+        """
+        Remove the entry of an upload (e.g. when its job failed), so the file
+        is uploaded again.
+        """
+        with self._connection() as conn:
+            conn.execute(
+                "DELETE FROM uploads WHERE content_hash = ? AND settings_hash = ?",
+                (content_hash, settings_hash(settings)),
+            )
+
+    def warm(
+        self,
+        uploads: Iterable[Tuple[str, int]],
+        settings: Optional[Mapping] = None,
+        workers: int = 4,
+    ) -> int:
+        """
+        Add the jobs of files which were solved before, e.g. from the logs of
+        an earlier run. The files are hashed concurrently.
+
+        Parameters
+        ----------
+        uploads: iterable
+            Tuples of ``(filename, job_id)``.
+        settings: dict
+            The effective settings with which the files were uploaded.
+        workers: int
+            Number of threads hashing the files.
+
+        Returns
+        -------
+        int
+            The number of added entries.
+        """
+        uploads = list(uploads)
+        with ThreadPoolExecutor(workers) as pool:
+            hashes = list(pool.map(file_hash, (filename for filename, _ in uploads)))
+        for content_hash, (filename, job_id) in zip(hashes, uploads):
+            self.add(content_hash, settings, job_id=job_id, filename=filename)
+        log.info("Added {} uploads to the index".format(len(uploads)))
+        return len(uploads)
+
+    def entries(self) -> List[IndexEntry]:
+        """
+        All entries of the index, in the order they were added.
+        """
+        rows = self._connection().execute("SELECT * FROM uploads ORDER BY created")
+        return [IndexEntry(*row) for row in rows]
+
+    def clear(self) -> None:
+        """
+        Remove all entries.
+        """
+        with self._connection() as conn:
+            conn.execute("DELETE FROM uploads")
+
+    def close(self) -> None:
+        """
+        Close the connection of the current thread.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM uploads").fetchone()[0]
+
+    def __repr__(self):
+        return "UploadIndex({!r})".format(self.path)
@@ -0,0 +1,230 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, NamedTuple, Optional
+
+log = logging.getLogger(__name__)
+
+# Status of the entries of a journal
+SUBMITTED = "submitted"
+RUNNING = "running"
+SUCCESS = "success"
+FAILURE = "failure"
+
+
+def _endpoint(endpoint: Optional[str]) -> dict:
+    # The endpoint is only recorded if it is given
+    return {} if endpoint is None else {"endpoint": endpoint}
+
+
+class JournalEntry(NamedTuple):
+    filename: str
+    submission_id: Optional[int]
+    job_id: Optional[int]
+    status: str
+    time: float
+    endpoint: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        """
+        Whether the job of the upload is done (succeeded or failed).
+        """
+        return self.status in {SUCCESS, FAILURE}
+
+
+class Journal(object):
+    """
+    Durable, append-only journal of the progress of uploads, so a batch can
+    be resumed after a crash without uploading the files again (see
+    :py:meth:`astrometry_net_client.client.Client.resume`).
+
+    Every transition of an upload is appended as a single line of JSON, in
+    order:
+
+    #. ``submitted``: the file was uploaded, with the submission id.
+    #. ``job``: the job of the submission is known.
+    #. ``done``: the job is finished, with its result.
+
+    For uploads to another instance than nova.astrometry.net, the url of its
+    endpoint is recorded as well.
+
+    Each record is flushed (and by default synced) to disk before the upload
+    continues, so no submission is lost when the process dies. A partially
+    written last line (from a crash during a write) is ignored when reading.
+
+    Parameters
+    ----------
+    path: str
+        Path of the journal file, created if it does not exist.
+    sync: bool
+        Sync each record to disk (``os.fsync``), so it also survives a crash
+        of the machine. Only flushed to the operating system otherwise.
+
+    Examples
+    --------
+    >>> client = Client(api_key="XXXXX", journal=Journal("batch.journal"))
+    >>> results, stats = client.run_batch(files)
+    >>> # After a crash, in a new process:
+    >>> for job, filename in client.resume("batch.journal"):
+    ...     process(job, filename)
+    """
+
+    def __init__(self, path: str, sync: bool = True):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.sync = sync
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "a+b")
+        # Terminate a line which was cut off by a crash, so new records start
+        # on a line of their own
+        if self._file.seek(0, os.SEEK_END) > 0:
+            self._file.seek(-1, os.SEEK_END)
+            if self._file.read(1) != b"\n":
+                self._file.write(b"\n")
+
+    def record(self, event: str, filename, **fields) -> None:
+        """
+        Append a record to the journal.
+
+        Parameters
+        ----------
+        event: str
+            The transition: ``"submitted"``, ``"job"`` or ``"done"``.
+        filename: str
+            The uploaded file.
+        fields: arguments
+            Additional (JSON serializable) values of the record, e.g. the
+            ``submission`` or ``job`` id.
+        """
+        record = dict(event=event, file=str(filename), time=time.time(), **fields)
+        line = (json.dumps(record) + "\n").encode()
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+
+    def submitted(
+        self, filename, submission_id: int, endpoint: Optional[str] = None
+    ) -> None:
+        """
+        Record that the file was uploaded, and created the given submission
+        (at the instance with the ``endpoint`` url).
+        """
+        self.record(
+            "submitted", filename, submission=submission_id, **_endpoint(endpoint)
+        )
+
+    def job(
+        self,
+        filename,
+        job_id: int,
+        submission_id: Optional[int] = None,
+        endpoint: Optional[str] = None,
+    ) -> None:
+        """
+        Record the job of an upload. The submission id is not known when an
+        earlier job is reused (see :py:class:`astrometry_net_client.index.UploadIndex`).
+        """
+        self.record(
+            "job", filename, submission=submission_id, job=job_id, **_endpoint(endpoint)
+        )
+
+    def finished(
+        self, filename, job_id: int, success: bool, endpoint: Optional[str] = None
+    ) -> None:
+        """
+        Record that the job of an upload is done.
+        """
+        self.record(
+            "done", filename, job=job_id, success=success, **_endpoint(endpoint)
+        )
+
+    def _records(self):
+        with open(self.path, "rb") as f:
+            for number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    msg = "Ignoring invalid record on line {} of {}"
+                    log.warning(msg.format(number, self.path))
+
+    def entries(self) -> List[JournalEntry]:
+        """
+        Replay the journal, returning the last state of each upload, in the
+        order the uploads were started.
+        """
+        entries: OrderedDict = OrderedDict()
+        job_keys = {}
+        for record in self._records():
+            event = record.get("event")
+            submission_id = record.get("submission")
+            job_id = record.get("job")
+            endpoint = record.get("endpoint")
+            if event == "submitted":
+                key = ("submission", endpoint, submission_id)
+                entries[key] = JournalEntry(
+                    record["file"],
+                    submission_id,
+                    None,
+                    SUBMITTED,
+                    record["time"],
+                    endpoint,
+                )
+            elif event == "job":
+                if submission_id is not None:
+                    key = ("submission", endpoint, submission_id)
+                else:
+                    key = ("job", endpoint, job_id)
+                entry = entries.get(key) or JournalEntry(
+                    record["file"],
+                    submission_id,
+                    None,
+                    SUBMITTED,
+                    record["time"],
+                    endpoint,
+                )
+                entries[key] = entry._replace(
+                    job_id=job_id, status=RUNNING, time=record["time"]
+                )
+                job_keys[endpoint, job_id] = key
+            elif event == "done":
+                key = job_keys.get((endpoint, job_id), ("job", endpoint, job_id))
+                entry = entries.get(key) or JournalEntry(
+                    record["file"], None, job_id, RUNNING, record["time"], endpoint
+                )
+                status = SUCCESS if record.get("success") else FAILURE
+                entries[key] = entry._replace(status=status, time=record["time"])
+        return list(entries.values())
+
+    def outstanding(self) -> List[JournalEntry]:
+        """
+        The uploads of which the job is not yet finished (according to the
+        journal).
+        """
+        return [entry for entry in self.entries() if not entry.finished]
+
+    def close(self) -> None:
+        """
+        Close the journal file.
+        """
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        return "Journal({!r}, sync={})".format(self.path, self.sync)
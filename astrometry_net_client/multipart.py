@@ -0,0 +1,174 @@
+import io
+import logging
+import os
+import uuid
+from typing import IO, Callable, Dict, List, Optional, Tuple, Union
+
+log = logging.getLogger(__name__)
+
+# Maximal number of bytes read from a file at once
+CHUNK_SIZE = 2**16
+
+
+class MultipartEncoder(object):
+    """
+    Streaming encoder for a ``multipart/form-data`` request body.
+
+    Unlike the ``files`` argument of the requests library, the body is not
+    built in memory: the files are read in chunks of at most ``chunk_size``
+    bytes while the body is being sent. The total size is known in advance,
+    so the request is sent with a ``Content-Length`` header (not chunked).
+
+    An encoder is a file-like object, which can be passed as the ``data``
+    of a request (together with the :py:attr:`content_type` header). It can
+    be rewound with ``seek(0)`` to send the body again (e.g. when the request
+    is retried).
+
+    Parameters
+    ----------
+    fields: dict
+        Plain form fields, mapping the name to a string value.
+    files: dict
+        File fields, mapping the name to a ``(filename, fileobj)`` tuple.
+        The file objects are read from their current position until the end,
+        they must be opened in binary mode and be seekable.
+    callback: callable
+        Optional function called as ``callback(bytes_read, total)`` after
+        each chunk of the body is read (i.e. sent).
+    chunk_size: int
+        Maximal number of bytes read from a file at once.
+    boundary: str
+        Boundary between the parts. A random one is used if not given.
+
+    Examples
+    --------
+    >>> with open("image.fits", "rb") as f:
+    ...     files = {"file": ("image.fits", f)}
+    ...     encoder = MultipartEncoder({"request-json": "{}"}, files)
+    ...     headers = {"Content-Type": encoder.content_type}
+    ...     requests.post(url, data=encoder, headers=headers)
+    """
+
+    def __init__(
+        self,
+        fields: Optional[Dict[str, str]] = None,
+        files: Optional[Dict[str, Tuple[str, IO[bytes]]]] = None,
+        callback: Optional[Callable[[int, int], None]] = None,
+        chunk_size: int = CHUNK_SIZE,
+        boundary: Optional[str] = None,
+    ):
+        self.boundary = uuid.uuid4().hex if boundary is None else boundary
+        self.callback = callback
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+
+        self._parts: List[Union[bytes, IO[bytes]]] = []
+        self._starts: List[Tuple[IO[bytes], int]] = []
+        self._len = 0
+        for name, value in (fields or {}).items():
+            header = self._part_header(name)
+            self._add(header + value.encode() + b"\r\n")
+        for name, (filename, fileobj) in (files or {}).items():
+            self._add(self._part_header(name, filename))
+            self._add_file(fileobj)
+            self._add(b"\r\n")
+        self._add("--{}--\r\n".format(self.boundary).encode())
+
+        self._all_parts = list(self._parts)
+        self._current: Optional[IO[bytes]] = None
+
+    def _part_header(self, name: str, filename: Optional[str] = None) -> bytes:
+        disposition = 'form-data; name="{}"'.format(name)
+        lines = ["--{}".format(self.boundary)]
+        if filename is None:
+            lines.append("Content-Disposition: {}".format(disposition))
+        else:
+            disposition += '; filename="{}"'.format(os.path.basename(filename))
+            lines.append("Content-Disposition: {}".format(disposition))
+            lines.append("Content-Type: application/octet-stream")
+        return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+    def _add(self, data: bytes):
+        self._parts.append(data)
+        self._len += len(data)
+
+    def _add_file(self, fileobj: IO[bytes]):
+        position = fileobj.tell()
+        size = fileobj.seek(0, io.SEEK_END) - position
+        fileobj.seek(position)
+        self._parts.append(fileobj)
+        self._starts.append((fileobj, position))
+        self._len += size
+
+    @property
+    def content_type(self) -> str:
+        """
+        Value of the ``Content-Type`` header of the request.
+        """
+        return "multipart/form-data; boundary={}".format(self.boundary)
+
+    def __len__(self):
+        """
+        Total size (in bytes) of the body.
+        """
+        return self._len
+
+    def _next_part(self) -> Optional[IO[bytes]]:
+        if not self._parts:
+            return None
+        part = self._parts.pop(0)
+        if isinstance(part, bytes):
+            return io.BytesIO(part)
+        return part
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Read the next (at most ``size``, and at most ``chunk_size`` from a
+        file) bytes of the body. Returns an empty bytes object at the end.
+        """
+        if size is None or size < 0:
+            size = self._len
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            if self._current is None:
+                self._current = self._next_part()
+                if self._current is None:
+                    break
+            chunk = self._current.read(min(remaining, self.chunk_size))
+            if not chunk:
+                self._current = None
+                continue
+            chunks.append(chunk)
+            remaining -= len(chunk)
+
+        data = b"".join(chunks)
+        if data:
+            self.bytes_read += len(data)
+            if self.callback is not None:
+                self.callback(self.bytes_read, self._len)
+        return data
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """
+        Rewind the body to the start, only ``seek(0)`` is supported.
+        """
+        if offset != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("Can only seek to the start of the body")
+        for fileobj, position in self._starts:
+            fileobj.seek(position)
+        self._parts = list(self._all_parts)
+        self._current = None
+        self.bytes_read = 0
+        return 0
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def __repr__(self):
+        msg = "MultipartEncoder(boundary={!r}, length={}, read={})"
+        return msg.format(self.boundary, self._len, self.bytes_read)
@@ -0,0 +1,592 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from operator import methodcaller
+from queue import Queue
+from typing import Callable, Dict, Optional, Tuple, Union
+
+from astrometry_net_client.scheduler import PollScheduler
+from astrometry_net_client.statusables import Job
+from astrometry_net_client.transport import RetryPolicy
+
+log = logging.getLogger(__name__)
+
+# Default number of worker threads per stage
+UPLOAD_WORKERS = 2
+POLL_WORKERS = 2
+FETCH_WORKERS = 2
+
+# Factor between the sizes of uploads of which the latencies are compared, so
+# the latency is about the same for the same server load
+SIZE_CLASS = math.sqrt(2)
+
+
+class AdaptiveLimit(object):
+    """
+    Limit on the number of files in progress in an :py:class:`UploadPipeline`,
+    which adapts to what the server can sustain (additive increase,
+    multiplicative decrease, like TCP congestion control).
+
+    The pipeline records the latency of every upload: the time of its HTTP
+    request (see :py:attr:`astrometry_net_client.uploads.BaseUpload.latency`),
+    so waits for a rate limit or the extraction of sources are not taken for
+    congestion. As a request has a fixed cost besides the cost per byte, a
+    latency is only compared with those of uploads of a similar size (within
+    a factor :py:data:`SIZE_CLASS`). When the latency is more than
+    ``tolerance`` times the lowest of the last ``window`` comparable
+    latencies, or when requests were retried (see :py:meth:`watch`), the
+    server is considered congested and the limit is multiplied by
+    ``decrease``. Otherwise the limit grows by ``increase / limit``, i.e.
+    about ``increase`` for every ``limit`` uploads. Uploads which started
+    before the last decrease are ignored, as they do not reflect the
+    decreased limit yet.
+
+    The pipeline also records the time the submissions wait in the queue of
+    the server, and the time the server takes to solve the jobs (as another
+    ``kind`` of latency, see :py:meth:`record`). These can only decrease the
+    limit.
+
+    Parameters
+    ----------
+    initial: int
+        Initial limit.
+    minimum: int
+        The limit is never lower than this (floor).
+    maximum: int
+        The limit is never higher than this (ceiling). No ceiling if ``None``.
+    increase: float
+        Additive increase per round of ``limit`` uploads.
+    decrease: float
+        Factor (between 0 and 1) applied to the limit on congestion.
+    tolerance: float
+        Factor by which the latency may exceed the lowest recent latency
+        before it is considered congestion.
+    window: int
+        Number of recent comparable latencies of which the lowest is used.
+
+    Attributes
+    ----------
+    increases, decreases: int
+        Number of times the limit was increased or decreased.
+    ignored: int
+        Number of uploads which were ignored, as they started before the last
+        decrease.
+
+    Examples
+    --------
+    >>> limit = AdaptiveLimit(10, minimum=2, maximum=200)
+    >>> client = Client(api_key="XXXXX", concurrency=limit)
+    >>> results, stats = client.run_batch(files)
+    >>> limit.value  # limit reached during the batch
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int = 1,
+        maximum: Optional[int] = None,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        tolerance: float = 2.0,
+        window: int = 50,
+    ):
+        if minimum < 1:
+            raise ValueError("minimum must be greater than 0")
+        if maximum is not None and maximum < minimum:
+            raise ValueError("maximum must not be lower than the minimum")
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must be between 0 and 1")
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self._value = float(self._clamp(initial))
+        self.window = window
+        self._latencies: Dict[Tuple[str, Optional[int]], deque] = {}
+        self._last_decrease = float("-inf")
+        self._retry: Optional[RetryPolicy] = None
+        self._retried = 0
+        self.increases = 0
+        self.decreases = 0
+        self.ignored = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def fixed(cls, size: int) -> "AdaptiveLimit":
+        """
+        A limit which always has the given size.
+        """
+        return cls(size, minimum=size, maximum=size)
+
+    def _clamp(self, value: float) -> float:
+        if self.maximum is not None:
+            value = min(value, self.maximum)
+        return max(value, self.minimum)
+
+    @property
+    def value(self) -> int:
+        """
+        The current limit.
+        """
+        return int(self._value)
+
+    def watch(self, retry: RetryPolicy) -> None:
+        """
+        Also consider the server congested when requests are retried by the
+        given policy (e.g. after a 429 or 503 status), typically the policy
+        of the transport of the uploads.
+        """
+        with self._lock:
+            self._retry = retry
+            self._retried = retry.retries + retry.exhausted
+
+    def _new_retries(self) -> bool:
+        if self._retry is None:
+            return False
+        retried = self._retry.retries + self._retry.exhausted
+        new, self._retried = retried > self._retried, retried
+        return new
+
+    @staticmethod
+    def _size_class(size: Optional[int]) -> Optional[int]:
+        if size is None:
+            return None
+        return int(math.log(max(size, 1), SIZE_CLASS))
+
+    def record(
+        self,
+        latency: float,
+        start: Optional[float] = None,
+        size: Optional[int] = None,
+        kind: str = "upload",
+        resolution: float = 0.0,
+    ) -> None:
+        """
+        Adapt the limit to the latency of a finished upload (or another
+        operation, see ``kind``).
+
+        Parameters
+        ----------
+        latency: float
+            The latency (in seconds) of the upload.
+        start: float
+            The time (of ``time.monotonic()``) at which the upload started.
+            Defaults to now, i.e. the upload is never ignored.
+        size: int
+            The size (in bytes) of the upload. The latency is only compared
+            with those of a similar size. If ``None``, it is compared with the
+            other latencies without a size.
+        kind: str
+            The kind of latency, it is only compared with latencies of the same
+            kind. Only ``"upload"`` latencies increase the limit, others (e.g.
+            the time until a job is solved) can only decrease it.
+        resolution: float
+            Precision (in seconds) of the latency, e.g. when it is measured by
+            polling: it is only taken for congestion when it is too high by
+            more than this.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if start is not None and start < self._last_decrease:
+                self._new_retries()  # caused by the old limit as well
+                self.ignored += 1
+                return
+            key = (kind, self._size_class(size))
+            latencies = self._latencies.get(key)
+            if latencies is None:
+                latencies = self._latencies[key] = deque(maxlen=self.window)
+            latencies.append(latency)
+            slow = latency - resolution > self.tolerance * min(latencies)
+            if slow or self._new_retries():
+                self._last_decrease = now
+                self._value = self._clamp(self._value * self.decrease)
+                self.decreases += 1
+                msg = "Congestion ({}), decreased the limit to {}"
+                reason = "{} latency".format(kind) if slow else "retries"
+                log.info(msg.format(reason, self.value))
+            elif kind == "upload" and (
+                self.maximum is None or self._value < self.maximum
+            ):
+                self._value = self._clamp(self._value + self.increase / self._value)
+                self.increases += 1
+
+    def __repr__(self):
+        return "AdaptiveLimit(value={}, minimum={}, maximum={})".format(
+            self.value, self.minimum, self.maximum
+        )
+
+
+class StageStats(object):
+    """
+    Statistics of a single stage of the :py:class:`UploadPipeline`.
+
+    Attributes
+    ----------
+    name: str
+        Name of the stage (``"upload"``, ``"poll"`` or ``"fetch"``).
+    count: int
+        Number of finished operations of the stage.
+    errors: int
+        Number of operations which raised an exception.
+    busy_time: float
+        Total time (in seconds) spend in the operations of this stage. Can be
+        larger than the elapsed time, if the stage has multiple workers.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.busy_time = 0.0
+        self._first: Optional[float] = None
+        self._last: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self):
+        """
+        Context manager which records a single operation of the stage.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            end = time.monotonic()
+            with self._lock:
+                self.count += 1
+                self.busy_time += end - start
+                self._first = start if self._first is None else self._first
+                self._last = end
+
+    @property
+    def elapsed(self) -> float:
+        """
+        Time (in seconds) between the start of the first and the end of the
+        last operation.
+        """
+        if self._first is None or self._last is None:
+            return 0.0
+        return self._last - self._first
+
+    @property
+    def throughput(self) -> float:
+        """
+        Number of operations per second, over the :py:attr:`elapsed` time.
+        """
+        elapsed = self.elapsed
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def __repr__(self):
+        msg = "StageStats({}, count={}, errors={}, busy_time={:.2f}s, throughput={:.2f}/s)"
+        return msg.format(
+            self.name, self.count, self.errors, self.busy_time, self.throughput
+        )
+
+
+class PipelineStats(object):
+    """
+    Statistics of a run of the :py:class:`UploadPipeline`, one
+    :py:class:`StageStats` per stage (in the :py:attr:`stages` dictionary).
+
+    Attributes
+    ----------
+    stages: dict
+        Dictionary mapping the stage name to its :py:class:`StageStats`.
+    finished: int
+        Number of files which went through the whole pipeline.
+    elapsed: float
+        Total running time (in seconds) of the pipeline.
+    """
+
+    stage_names = ("upload", "poll", "fetch")
+
+    def __init__(self):
+        self.stages: Dict[str, StageStats] = {
+            name: StageStats(name) for name in self.stage_names
+        }
+        self.finished = 0
+        self.elapsed = 0.0
+
+    def __getitem__(self, name):
+        return self.stages[name]
+
+    @property
+    def throughput(self) -> float:
+        """
+        Number of finished files per second.
+        """
+        return self.finished / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __repr__(self):
+        msg = "PipelineStats(finished={}, elapsed={:.2f}s, stages={})"
+        return msg.format(self.finished, self.elapsed, list(self.stages.values()))
+
+
+class _PipelineItem(object):
+    __slots__ = ("filename", "submission", "job", "start", "since")
+
+    def __init__(self, filename, submission, start=None):
+        self.filename = filename
+        self.submission = submission
+        self.job = None
+        # Start of the upload, and of the current poll stage (queue or solve)
+        self.start = start
+        self.since = time.monotonic()
+
+
+class _Failure(object):
+    def __init__(self, exception):
+        self.exception = exception
+
+
+_FEED_DONE = object()
+
+
+class UploadPipeline(object):
+    """
+    Processes the uploads of many files concurrently, split into separate
+    stages:
+
+    #. upload: a pool of workers uploading the files, as long as there are
+       less files in progress than the limit (``queue_size``).
+    #. poll: a :py:class:`astrometry_net_client.scheduler.PollScheduler`
+       which keeps track of the next time each submission or job needs to be
+       queried, and hands them to a pool of workers when due. Every item has
+       its own interval, doubling from ``start`` up to ``end`` seconds, so an
+       item is never queried again right after it was checked.
+    #. fetch (optional): a pool of workers which retrieve the results of the
+       successful jobs, e.g. the WCS header, using the ``fetch`` argument.
+
+    Normally used via
+    :py:meth:`astrometry_net_client.client.Client.upload_files_gen` or
+    :py:meth:`astrometry_net_client.client.Client.run_batch`.
+
+    Parameters
+    ----------
+    submit: callable
+        Function which uploads the given filename and returns the resulting
+        :py:class:`astrometry_net_client.statusables.Submission`, or an
+        existing :py:class:`astrometry_net_client.statusables.Job` if the
+        file does not need to be uploaded (e.g. it was solved before).
+    queue_size: int or :py:class:`AdaptiveLimit`
+        Maximum number of files in progress, either fixed or adapting to the
+        latency of the uploads.
+    fetch: str or callable
+        Optional, either the name of a
+        :py:class:`astrometry_net_client.statusables.Job` method (e.g.
+        ``"wcs_file"``) or a function taking the job, which is called for each
+        successful job before it is yielded. The results of the Job methods
+        are kept in the (size bounded) product cache of the Job.
+    on_job: callable
+        Optional function called as ``on_job(filename, submission, job)``
+        when the job of a submission is known.
+    upload_workers, poll_workers, fetch_workers: int
+        Number of worker threads for each stage.
+    start: float
+        Initial time (in seconds) between two status queries of a file.
+    end: float
+        Maximal time (in seconds) between two status queries of a file.
+
+    Attributes
+    ----------
+    limit: :py:class:`AdaptiveLimit`
+        The limit of the number of files in progress, its ``value`` is the
+        current limit.
+    stats: :py:class:`PipelineStats`
+        Statistics of the last (or current) run.
+    """
+
+    def __init__(
+        self,
+        submit: Callable,
+        queue_size: Union[int, AdaptiveLimit],
+        fetch: Optional[Union[str, Callable]] = None,
+        on_job: Optional[Callable] = None,
+        upload_workers: int = UPLOAD_WORKERS,
+        poll_workers: int = POLL_WORKERS,
+        fetch_workers: int = FETCH_WORKERS,
+        start: float = 1,
+        end: float = 60,
+    ):
+        self.submit = submit
+        if not isinstance(queue_size, AdaptiveLimit):
+            queue_size = AdaptiveLimit.fixed(queue_size)
+        self.limit = queue_size
+        if isinstance(fetch, str):
+            fetch = methodcaller(fetch)
+        self.fetch = fetch
+        self.on_job = on_job
+        self.upload_workers = upload_workers
+        self.poll_workers = poll_workers
+        self.fetch_workers = fetch_workers
+        self.start = start
+        self.end = end
+        self.stats = PipelineStats()
+
+    def run(self, files_iter):
+        """
+        Generator which runs the pipeline over the given files, yielding the
+        :py:class:`astrometry_net_client.statusables.Job` & filename when
+        done. The ``files_iter`` is consumed while the pipeline runs.
+
+        If any stage raises an exception, the pipeline is stopped and the
+        exception is raised from this generator.
+        """
+        self.stats = PipelineStats()
+        run_start = time.monotonic()
+
+        self._stop = threading.Event()
+        self._results: Queue = Queue()
+        self._in_flight = 0
+        self._in_flight_changed = threading.Condition()
+        self._scheduler = PollScheduler(
+            self.poll_workers,
+            start=self.start,
+            end=self.end,
+            stats=self.stats["poll"],
+        )
+
+        self._upload_pool = ThreadPoolExecutor(
+            self.upload_workers, thread_name_prefix="anc-upload"
+        )
+        self._fetch_pool = ThreadPoolExecutor(
+            self.fetch_workers, thread_name_prefix="anc-fetch"
+        )
+
+        def feed():
+            try:
+                for filename in files_iter:
+                    with self._in_flight_changed:
+                        self._in_flight_changed.wait_for(
+                            lambda: self._stop.is_set()
+                            or self._in_flight < self.limit.value
+                        )
+                        if self._stop.is_set():
+                            return
+                        self._in_flight += 1
+                    self._upload_pool.submit(self._guard, self._upload, filename)
+            except Exception as e:
+                self._results.put(_Failure(e))
+            finally:
+                self._results.put(_FEED_DONE)
+
+        threading.Thread(target=feed, name="anc-feeder", daemon=True).start()
+
+        feed_done = False
+        try:
+            while True:
+                with self._in_flight_changed:
+                    if feed_done and self._in_flight == 0:
+                        break
+                item = self._results.get()
+                if item is _FEED_DONE:
+                    feed_done = True
+                    continue
+                if isinstance(item, _Failure):
+                    raise item.exception
+
+                with self._in_flight_changed:
+                    self._in_flight -= 1
+                    self._in_flight_changed.notify_all()
+                self.stats.finished += 1
+                self.stats.elapsed = time.monotonic() - run_start
+
+                log.info("FINISHED submission {}, yielding...".format(item.filename))
+                yield (item.job, item.filename)
+        finally:
+            self.stats.elapsed = time.monotonic() - run_start
+            self._shutdown()
+
+    def _shutdown(self):
+        # Unblock the feeder, if it waits for a free slot
+        with self._in_flight_changed:
+            self._stop.set()
+            self._in_flight_changed.notify_all()
+        self._scheduler.close()
+        for pool in (self._upload_pool, self._fetch_pool):
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _guard(self, func, *args):
+        """
+        Runs a stage function, sending any exception to the consumer.
+        """
+        if self._stop.is_set():
+            return
+        try:
+            func(*args)
+        except Exception as e:
+            log.exception("Pipeline stage failed")
+            self._results.put(_Failure(e))
+
+    def _upload(self, filename):
+        with self.stats["upload"].measure():
+            log.info("Submitting file {}".format(filename))
+            start = time.monotonic()
+            submission = self.submit(filename)
+        if isinstance(submission, Job):
+            item = _PipelineItem(filename, None)
+            item.job = submission
+            self._scheduler.register(
+                item.job,
+                callback=lambda future: self._guard(self._job_done, item, future),
+            )
+            return
+
+        # The limit may increase, allowing the feeder to continue
+        latency = getattr(submission, "upload_latency", None)
+        if latency is not None:
+            size = getattr(submission, "upload_size", None)
+            with self._in_flight_changed:
+                self.limit.record(latency, start=start, size=size)
+                self._in_flight_changed.notify_all()
+        item = _PipelineItem(filename, submission, start=start)
+        self._scheduler.register(
+            submission,
+            callback=lambda future: self._guard(self._submission_done, item, future),
+            delay=self.start,
+        )
+
+    def _submission_done(self, item, future):
+        future.result()  # raises the exception of the status query, if any
+        self._record_wait(item, "queue")
+        item.job = item.submission.jobs[0]
+        if self.on_job is not None:
+            self.on_job(item.filename, item.submission, item.job)
+        self._scheduler.register(
+            item.job,
+            callback=lambda future: self._guard(self._job_done, item, future),
+        )
+
+    def _job_done(self, item, future):
+        job = future.result()
+        if item.submission is not None:
+            self._record_wait(item, "solve")
+        if self.fetch is not None and job.success():
+            self._fetch_pool.submit(self._guard, self._fetch, item)
+        else:
+            self._results.put(item)
+
+    def _record_wait(self, item, kind):
+        """
+        Record the time the server took for the poll stage of the item (in
+        its queue, or solving the job) with the limit. It is only known up to
+        the interval between the last two status queries.
+        """
+        now = time.monotonic()
+        elapsed, item.since = now - item.since, now
+        resolution = min(self.end, (elapsed + self.start) / 2)
+        self.limit.record(elapsed, start=item.start, kind=kind, resolution=resolution)
+
+    def _fetch(self, item):
+        with self.stats["fetch"].measure():
+            self.fetch(item.job)
+        self._results.put(item)
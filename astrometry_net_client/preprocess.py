@@ -0,0 +1,369 @@
+import gzip
+import io
+import logging
+import re
+from typing import Mapping, Optional, Tuple, Union
+
+import numpy as np
+from astropy.io import fits
+
+from astrometry_net_client.settings import Settings
+
+log = logging.getLogger(__name__)
+
+# Keywords which are not copied to the header of the reduced image: those
+# describing the structure of the data (set by astropy) and those of a
+# (possibly distorted) WCS, which is invalid after the reduction
+_SKIPPED_KEYWORD = re.compile(
+    r"^(SIMPLE|BITPIX|NAXIS\d*|EXTEND|XTENSION|PCOUNT|GCOUNT|BSCALE|BZERO|EXTNAME"
+    r"|WCSAXES|CRPIX\d|CRVAL\d|CDELT\d|CTYPE\d|CUNIT\d|CROTA\d|CD\d_\d|PC\d_\d"
+    r"|LONPOLE|LATPOLE|(A|B|AP|BP)_(\d_\d|ORDER|DMAX)|)$"
+)
+
+_DTYPES = {"uint8": np.uint8, "uint16": np.uint16}
+_COMPRESSIONS = {"gzip", "rice"}
+
+
+def bin_image(data: np.ndarray, factor: int) -> np.ndarray:
+    """
+    Bin an image by averaging blocks of ``factor`` x ``factor`` pixels. Rows
+    and columns which do not fill a complete block are dropped.
+
+    Parameters
+    ----------
+    data: numpy.ndarray
+        2D image.
+    factor: int
+        Size of the blocks.
+
+    Returns
+    -------
+    numpy.ndarray
+        The binned image, as ``float32``.
+    """
+    height, width = data.shape[0] // factor, data.shape[1] // factor
+    blocks = data[: height * factor, : width * factor].reshape(
+        height, factor, width, factor
+    )
+    return blocks.mean(axis=(1, 3), dtype=np.float64).astype(np.float32)
+
+
+def rescale(
+    data: np.ndarray, dtype, clip: Tuple[float, float] = (0.5, 99.9)
+) -> np.ndarray:
+    """
+    Rescale an image to the full range of an unsigned integer type, after
+    clipping to the given percentiles. ``NaN`` values become 0.
+
+    Parameters
+    ----------
+    data: numpy.ndarray
+        The image.
+    dtype: numpy.dtype
+        The unsigned integer type, e.g. ``numpy.uint16``.
+    clip: tuple(float, float)
+        Lower and upper percentile, which are mapped to the minimum and
+        maximum of ``dtype``.
+
+    Returns
+    -------
+    numpy.ndarray
+    """
+    lower, upper = np.nanpercentile(data, clip)
+    maximum = np.iinfo(dtype).max
+    scale = maximum / (upper - lower) if upper > lower else 0.0
+    scaled = (np.asarray(data, dtype=np.float32) - lower) * scale
+    scaled = np.clip(np.nan_to_num(scaled, nan=0.0), 0, maximum)
+    return np.rint(scaled).astype(dtype)
+
+
+class Reduction(object):
+    """
+    The result of a :py:class:`Preprocessor`: the reduced image, and how it
+    relates to the original image.
+
+    A pixel ``(x', y')`` (0 based) of the reduced image covers the pixels
+    ``offset + binning * (x', y')`` up to (not including)
+    ``offset + binning * (x' + 1, y' + 1)`` of the original image.
+
+    Attributes
+    ----------
+    hdulist: astropy.io.fits.HDUList
+        The reduced FITS file (uncompressed, or Rice compressed).
+    binning: int
+        The binning factor.
+    offset: tuple(int, int)
+        Column and row (x, y) of the original image where the cropped region
+        starts.
+    original_shape: tuple(int, int)
+        Shape (rows, columns) of the original image.
+    shape: tuple(int, int)
+        Shape (rows, columns) of the reduced image.
+    compression: str or None
+        ``"gzip"`` if the FITS file is gzipped when uploaded.
+    """
+
+    def __init__(self, hdulist, binning, offset, original_shape, shape, compression):
+        self.hdulist = hdulist
+        self.binning = binning
+        self.offset = offset
+        self.original_shape = original_shape
+        self.shape = shape
+        self.compression = compression
+
+    def fileobj(self) -> io.BytesIO:
+        """
+        The reduced file, as it is uploaded.
+        """
+        buffer = io.BytesIO()
+        self.hdulist.writeto(buffer)
+        if self.compression == "gzip":
+            return io.BytesIO(gzip.compress(buffer.getvalue()))
+        buffer.seek(0)
+        return buffer
+
+    def adjust_settings(self, settings: Optional[Mapping] = None) -> Settings:
+        """
+        Adjust the upload settings to the reduced image.
+
+        * ``image_width`` / ``image_height`` are set to the reduced size.
+        * ``downsample_factor`` is divided by the binning (the image is
+          already binned), but is at least 1.
+        * Scale hints in ``arcsecperpix`` are multiplied by the binning. Hints
+          of the field width (``arcminwidth``, ``degwidth``) are multiplied by
+          the fraction of the width which is left after cropping.
+
+        Parameters
+        ----------
+        settings: :py:class:`astrometry_net_client.settings.Settings` or dict
+            The settings of the upload. Not modified.
+
+        Returns
+        -------
+        :py:class:`astrometry_net_client.settings.Settings`
+            The adjusted settings.
+        """
+        adjusted = Settings(settings or {})
+        adjusted["image_height"], adjusted["image_width"] = (
+            int(self.shape[0]),
+            int(self.shape[1]),
+        )
+
+        if "downsample_factor" in adjusted:
+            adjusted["downsample_factor"] = max(
+                1, adjusted["downsample_factor"] / self.binning
+            )
+
+        units = adjusted.get("scale_units")
+        if units == "arcsecperpix":
+            factor = self.binning
+        elif units in ("arcminwidth", "degwidth"):
+            factor = self.shape[1] * self.binning / self.original_shape[1]
+        else:
+            factor = 1
+        if factor != 1:
+            for key in ("scale_lower", "scale_upper", "scale_est"):
+                if key in adjusted:
+                    adjusted[key] = adjusted[key] * factor
+        return adjusted
+
+    def restore_wcs(self, header: fits.Header) -> fits.Header:
+        """
+        Map a WCS of the reduced image (e.g. the result of
+        :py:meth:`astrometry_net_client.statusables.Job.wcs_file`) to the
+        pixel grid of the original image.
+
+        Handles a linear WCS (``CD`` matrix or ``CDELT``) and SIP
+        distortions.
+
+        Parameters
+        ----------
+        header: astropy.io.fits.Header
+            WCS header of the reduced image. Not modified.
+
+        Returns
+        -------
+        astropy.io.fits.Header
+            WCS header of the original image.
+        """
+        header = header.copy()
+        factor = self.binning
+        # Center of reduced pixel X' (1 based) in original pixels (1 based)
+        shift = (factor - 1) / 2
+        for axis, offset in ((1, self.offset[0]), (2, self.offset[1])):
+            key = "CRPIX{}".format(axis)
+            if key in header:
+                header[key] = factor * header[key] + offset - shift
+            key = "CDELT{}".format(axis)
+            if key in header and "CD1_1" not in header:
+                header[key] = header[key] / factor
+        for key in ("CD1_1", "CD1_2", "CD2_1", "CD2_2"):
+            if key in header:
+                header[key] = header[key] / factor
+
+        # Polynomial distortions: coefficient of u^p v^q scales by b^(1-p-q)
+        for prefix in ("A", "B", "AP", "BP"):
+            order = header.get("{}_ORDER".format(prefix))
+            if order is None:
+                continue
+            for p in range(order + 1):
+                for q in range(order + 1 - p):
+                    key = "{}_{}_{}".format(prefix, p, q)
+                    if key in header:
+                        header[key] = header[key] * factor ** (1 - p - q)
+
+        if "IMAGEW" in header:
+            header["IMAGEW"] = self.original_shape[1]
+        if "IMAGEH" in header:
+            header["IMAGEH"] = self.original_shape[0]
+        return header
+
+    def __repr__(self):
+        msg = "Reduction(binning={}, offset={}, original_shape={}, shape={})"
+        return msg.format(self.binning, self.offset, self.original_shape, self.shape)
+
+
+class Preprocessor(object):
+    """
+    Reduces an image before it is uploaded, so less data is sent and the
+    server needs less time to solve it. Astrometry.net only needs enough of
+    the star field to solve the image.
+
+    The image is (in this order) cropped around the center, binned, rescaled
+    to unsigned integers and compressed. Each step is optional. The
+    resulting :py:class:`Reduction` adjusts the upload settings to the
+    reduced image, and maps the resulting WCS back to the original image.
+
+    Typically given to a :py:class:`astrometry_net_client.client.Client` or
+    an upload (e.g. :py:class:`astrometry_net_client.uploads.FileUpload`) as
+    the ``preprocess`` argument, in which case the WCS of
+    :py:meth:`astrometry_net_client.statusables.Job.wcs_file` is mapped back
+    automatically.
+
+    Parameters
+    ----------
+    binning: int
+        Bin the image in blocks of ``binning`` x ``binning`` pixels.
+    crop: float or tuple(int, int)
+        Keep only the center of the image. Either the fraction of the width
+        and height to keep (between 0 and 1), or the size (rows, columns) in
+        pixels.
+    dtype: str
+        Rescale the image to ``"uint16"`` or ``"uint8"``.
+    clip: tuple(float, float)
+        Percentiles mapped to the minimum and maximum value of ``dtype``.
+    compression: str
+        ``"gzip"`` to gzip the FITS file, or ``"rice"`` to store the image in
+        a Rice compressed (tiled) image HDU.
+
+    Examples
+    --------
+    >>> preprocess = Preprocessor(binning=2, crop=0.5, dtype="uint16")
+    >>> client = Client(api_key="XXXXX", preprocess=preprocess)
+    >>> wcs = client.calibrate_file_wcs("image.fits")  # for the original image
+    """
+
+    def __init__(
+        self,
+        binning: int = 1,
+        crop: Optional[Union[float, Tuple[int, int]]] = None,
+        dtype: Optional[str] = None,
+        clip: Tuple[float, float] = (0.5, 99.9),
+        compression: Optional[str] = None,
+    ):
+        if binning < 1:
+            raise ValueError("binning must be at least 1")
+        if isinstance(crop, float) and not 0 < crop <= 1:
+            raise ValueError("crop fraction must be in the range (0, 1]")
+        if dtype is not None and dtype not in _DTYPES:
+            raise ValueError("dtype must be one of {}".format(list(_DTYPES)))
+        if compression is not None and compression not in _COMPRESSIONS:
+            raise ValueError("compression must be one of {}".format(_COMPRESSIONS))
+
+        self.binning = binning
+        self.crop = crop
+        self.dtype = dtype
+        self.clip = clip
+        self.compression = compression
+
+    def _crop_region(self, shape):
+        if self.crop is None:
+            return (0, 0), shape
+        if isinstance(self.crop, float):
+            size = (
+                max(1, int(shape[0] * self.crop)),
+                max(1, int(shape[1] * self.crop)),
+            )
+        else:
+            size = (min(self.crop[0], shape[0]), min(self.crop[1], shape[1]))
+        start = ((shape[0] - size[0]) // 2, (shape[1] - size[1]) // 2)
+        return start, size
+
+    def reduce(self, data, header: Optional[fits.Header] = None) -> Reduction:
+        """
+        Reduce an image.
+
+        Parameters
+        ----------
+        data: numpy.ndarray or astropy.io.fits.HDUList
+            The (2D) image, or a FITS file, in which case the first HDU with
+            image data is used.
+        header: astropy.io.fits.Header
+            Optional header of the image, if ``data`` is an array. The WCS
+            keywords are removed, as they no longer apply.
+
+        Returns
+        -------
+        :py:class:`Reduction`
+        """
+        if isinstance(data, fits.HDUList):
+            hdu = next((h for h in data if h.is_image and h.data is not None), None)
+            if hdu is None:
+                raise ValueError("No image data in {}".format(data))
+            data, header = hdu.data, hdu.header
+        if data.ndim != 2:
+            raise ValueError("Can only reduce 2D images, not {}D".format(data.ndim))
+
+        original_shape = data.shape
+        (row, col), size = self._crop_region(original_shape)
+        image = data[row : row + size[0], col : col + size[1]]
+
+        if self.binning > 1:
+            image = bin_image(image, self.binning)
+        if self.dtype is not None:
+            image = rescale(image, _DTYPES[self.dtype], self.clip)
+        # Never refer to (e.g. memory mapped) data of the original
+        image = np.array(image)
+
+        new_header = fits.Header()
+        if header is not None:
+            for card in header.cards:
+                if not _SKIPPED_KEYWORD.match(card.keyword):
+                    new_header.append(card)
+
+        if self.compression == "rice":
+            hdulist = fits.HDUList(
+                [
+                    fits.PrimaryHDU(),
+                    fits.CompImageHDU(
+                        image, header=new_header, compression_type="RICE_1"
+                    ),
+                ]
+            )
+        else:
+            hdulist = fits.HDUList([fits.PrimaryHDU(image, header=new_header)])
+
+        reduction = Reduction(
+            hdulist,
+            self.binning,
+            (col, row),
+            original_shape,
+            image.shape,
+            self.compression,
+        )
+        log.debug("Reduced image: {}".format(reduction))
+        return reduction
+
+    def __repr__(self):
+        msg = "Preprocessor(binning={}, crop={}, dtype={}, compression={})"
+        return msg.format(self.binning, self.crop, self.dtype, self.compression)
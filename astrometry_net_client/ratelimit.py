@@ -0,0 +1,239 @@
+import logging
+import os
+import struct
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, no locking between processes
+    fcntl = None  # type: ignore
+
+log = logging.getLogger(__name__)
+
+# Categories of requests, each with their own bucket in a RateLimiter
+UPLOADS = "uploads"
+POLLS = "polls"
+DOWNLOADS = "downloads"
+CATEGORIES = (UPLOADS, POLLS, DOWNLOADS)
+
+
+class TokenBucket(object):
+    """
+    Token bucket limiting the rate of requests of the threads of a process.
+
+    The bucket holds at most ``burst`` tokens, and is refilled with ``rate``
+    tokens per second. Every request takes a token, waiting until one is
+    available if the bucket is empty. So on average at most ``rate`` requests
+    per second are made, with bursts of at most ``burst`` requests.
+
+    Parameters
+    ----------
+    rate: float
+        Number of tokens (requests) per second.
+    burst: float
+        Capacity of the bucket. Defaults to ``rate`` (at least 1), i.e. one
+        second worth of requests.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be greater than 0")
+        self.rate = rate
+        self.burst = max(rate, 1.0) if burst is None else burst
+        if self.burst < 1:
+            raise ValueError("burst must be at least 1")
+        self._tokens = self.burst
+        self._time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, tokens: float, last: float, now: float) -> float:
+        return min(self.burst, tokens + max(now - last, 0.0) * self.rate)
+
+    def _take(self, tokens: float) -> float:
+        """
+        Take the tokens if they are available, returning 0. Otherwise returns
+        the time (in seconds) until they will be available.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = self._refill(self._tokens, self._time, now)
+            self._time = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        Take ``tokens`` tokens from the bucket, waiting until they are
+        available.
+
+        Returns
+        -------
+        float
+            The time (in seconds) spent waiting.
+        """
+        if tokens > self.burst:
+            raise ValueError("Cannot take more tokens than the burst size")
+        waited = 0.0
+        while True:
+            wait = self._take(tokens)
+            if wait == 0:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def __repr__(self):
+        return "{}(rate={}, burst={})".format(
+            self.__class__.__name__, self.rate, self.burst
+        )
+
+
+class FileTokenBucket(TokenBucket):
+    """
+    Token bucket (see :py:class:`TokenBucket`) shared by all processes on a
+    host which use the same ``path``.
+
+    The state of the bucket (the number of tokens and the time of the last
+    update) is stored in a small file, which is locked while it is updated.
+    All processes should use the same ``rate`` and ``burst``.
+
+    Parameters
+    ----------
+    path: str
+        Path of the state file, created if it does not exist.
+    rate: float
+        Number of tokens (requests) per second, for all processes together.
+    burst: float
+        Capacity of the bucket.
+    """
+
+    _format = struct.Struct("<dd")
+
+    def __init__(self, path: str, rate: float, burst: Optional[float] = None):
+        super().__init__(rate, burst)
+        self.path = os.path.abspath(os.path.expanduser(path))
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _take(self, tokens: float) -> float:
+        with self._lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                data = os.pread(fd, self._format.size, 0)
+                now = time.time()
+                if len(data) == self._format.size:
+                    available, last = self._format.unpack(data)
+                    available = self._refill(available, last, now)
+                else:  # a new bucket starts full
+                    available = self.burst
+
+                wait = 0.0
+                if available >= tokens:
+                    available -= tokens
+                else:
+                    wait = (tokens - available) / self.rate
+                os.pwrite(fd, self._format.pack(available, now), 0)
+                return wait
+            finally:
+                # Closing the file releases the lock
+                os.close(fd)
+
+    def __repr__(self):
+        return "FileTokenBucket({!r}, rate={}, burst={})".format(
+            self.path, self.rate, self.burst
+        )
+
+
+class RateLimiter(object):
+    """
+    Limits the rate of the requests of a transport (see
+    :py:class:`astrometry_net_client.transport.DirectTransport`), with a
+    separate :py:class:`TokenBucket` per category of requests:
+
+    * ``"uploads"``: the uploads (submissions).
+    * ``"polls"``: all other API requests, e.g. the status of submissions and
+      jobs, the info of jobs and the login.
+    * ``"downloads"``: the result files of jobs.
+
+    A retried request takes a new token for every attempt.
+
+    Parameters
+    ----------
+    uploads, polls, downloads: float or :py:class:`TokenBucket`
+        The maximal number of requests per second of the category, or a
+        bucket. Not limited if not given.
+
+    Attributes
+    ----------
+    waited: dict
+        Total time (in seconds) requests waited for a token, per category.
+
+    Examples
+    --------
+    >>> limiter = RateLimiter(uploads=0.5, polls=5, downloads=2)
+    >>> client = Client(api_key="XXXXX", transport=Transport(limiter=limiter))
+
+    Sharing the limits between all processes on the host:
+
+    >>> limiter = RateLimiter.shared("/tmp/anc-limits", uploads=0.5, polls=5)
+    """
+
+    def __init__(
+        self,
+        uploads: Optional[Union[float, TokenBucket]] = None,
+        polls: Optional[Union[float, TokenBucket]] = None,
+        downloads: Optional[Union[float, TokenBucket]] = None,
+    ):
+        limits = {UPLOADS: uploads, POLLS: polls, DOWNLOADS: downloads}
+        self.buckets: Dict[str, TokenBucket] = {
+            category: limit if isinstance(limit, TokenBucket) else TokenBucket(limit)
+            for category, limit in limits.items()
+            if limit is not None
+        }
+        self.waited: Dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(
+        cls,
+        directory: str,
+        uploads: Optional[float] = None,
+        polls: Optional[float] = None,
+        downloads: Optional[float] = None,
+    ) -> "RateLimiter":
+        """
+        Create a limiter which is shared by all processes using the same
+        ``directory``, using a :py:class:`FileTokenBucket` per category.
+        """
+        limits = {UPLOADS: uploads, POLLS: polls, DOWNLOADS: downloads}
+        buckets = {
+            category: FileTokenBucket(
+                os.path.join(directory, "{}.bucket".format(category)), rate
+            )
+            for category, rate in limits.items()
+            if rate is not None
+        }
+        return cls(**buckets)
+
+    def acquire(self, category: str) -> None:
+        """
+        Wait until a request of the given category can be made.
+        """
+        bucket = self.buckets.get(category)
+        if bucket is None:
+            return
+        waited = bucket.acquire()
+        if waited > 0:
+            log.debug("Waited {:.2f}s for a {} token".format(waited, category))
+            with self._lock:
+                self.waited[category] += waited
+
+    def __repr__(self):
+        return "RateLimiter({!r})".format(self.buckets)
@@ -1,9 +1,8 @@
 import json
 import logging
-from typing import Optional, Union, cast
-
-import requests
-from astropy.io import fits
+import os
+import tempfile
+from typing import TYPE_CHECKING, Optional, Union, cast
 
 from astrometry_net_client.exceptions import (
     InvalidRequest,
@@ -11,10 +10,34 @@ from astrometry_net_client.exceptions import (
     NoSessionError,
     UnkownContentError,
 )
+from astrometry_net_client.ratelimit import DOWNLOADS
 from astrometry_net_client.settings import Settings
+from astrometry_net_client.transport import DirectTransport, default_transport
+
+if TYPE_CHECKING:
+    from astropy.io import fits
 
 log = logging.getLogger(__name__)
 
+# Size (in bytes) of the chunks in which a streamed download is written
+CHUNK_SIZE = 2**20
+
+# A FITS header consists of blocks of 2880 bytes, each with 36 cards of 80
+FITS_BLOCK_SIZE = 2880
+FITS_CARD_SIZE = 80
+
+
+def _umask() -> int:
+    # Only readable by setting it, so restore it immediately
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+# Downloaded files get the permissions of a file created with open(), instead
+# of the owner-only permissions of a temporary file
+FILE_MODE = 0o666 & ~_umask()
+
 
 class Request(object):
     """
@@ -51,6 +74,15 @@ class Request(object):
     used in this class or any subclass) will be stored and passed to the
     request call.
 
+    The request is send using the given ``transport`` (see
+    :py:mod:`astrometry_net_client.transport`), which can be shared between
+    requests to reuse connections. If no transport is given, the module level
+    functions of the requests library are used.
+
+    The ``category`` argument determines which rate limit of the transport
+    applies to the request (see
+    :py:class:`astrometry_net_client.ratelimit.RateLimiter`).
+
     The original response (as returned from the requests module call) is stored
     in the `original_response` attribute.
     """
@@ -64,27 +96,33 @@ class Request(object):
         method: str = "get",
         data: Optional[dict] = None,
         settings: Optional[Settings] = None,
+        transport: Optional[DirectTransport] = None,
         **kwargs,
     ):
         self.data = {} if data is None else data.copy()
         self.settings = {} if settings is None else settings.copy()
         self.arguments = kwargs
+        self.transport = default_transport if transport is None else transport
         if url is not None:
             self.url = url
 
-        # We have to get the attribute like this, otherwise we cannot
-        # monkeypatch (e.g. replace requests.get) in the test cases
         if method in self._allowed_methods:
-            self.method = getattr(requests, method)
+            self.method = getattr(self.transport, method)
         else:
             err_msg = "Method argument must be one of {}"
             raise ValueError(err_msg.format(self._allowed_methods))
 
-    def _make_request(self) -> Union[dict, bytes]:
+    def _payload(self) -> Optional[dict]:
+        """
+        The form data of the request: the data and settings wrapped into the
+        'request-json' field, or ``None`` if there is nothing to send.
+        """
         if len(self.data) + len(self.settings) > 0:
-            payload = {"request-json": json.dumps({**self.data, **self.settings})}
-        else:
-            payload = None
+            return {"request-json": json.dumps({**self.data, **self.settings})}
+        return None
+
+    def _make_request(self) -> Union[dict, bytes]:
+        payload = self._payload()
 
         log.debug("Sending {!r} with payload {}".format(self, payload))
         response = self.method(self.url, data=payload, **self.arguments)
@@ -169,7 +207,7 @@ class PostRequest(Request):
         super().__init__(*args, method="post", **kwargs)
 
 
-def file_request(url: str) -> bytes:
+def file_request(url: str, transport: Optional[DirectTransport] = None) -> bytes:
     """
     Utility function which makes a request to ``url`` and gets a file in
     response.
@@ -178,17 +216,21 @@ def file_request(url: str) -> bytes:
     ----------
     url: str
         URL to send the request to.
+    transport: :py:class:`astrometry_net_client.transport.DirectTransport`
+        Optional transport used to send the request.
 
     Returns
     -------
         the binary contents of this file.
     """
-    r = Request(url)
+    r = Request(url, transport=transport, category=DOWNLOADS)
     binary_file = r.make()
     return cast(bytes, binary_file)
 
 
-def fits_file_request(url: str) -> fits.HDUList:
+def fits_file_request(
+    url: str, transport: Optional[DirectTransport] = None
+) -> "fits.HDUList":
     """
     Make request to ``url`` and return a FITS file.
 
@@ -199,11 +241,174 @@ def fits_file_request(url: str) -> fits.HDUList:
     ----------
     url: str
         URL to send the request to.
+    transport: :py:class:`astrometry_net_client.transport.DirectTransport`
+        Optional transport used to send the request.
 
     Returns
     -------
         an astropy fits file (``astropy.io.fits.HDUList``)
     """
-    binary_fits = file_request(url)
+    from astropy.io import fits
+
+    binary_fits = file_request(url, transport=transport)
     hdul = fits.HDUList(file=binary_fits)
     return hdul
+
+
+def _check_file_response(response):
+    """
+    Raise an exception if a (possibly partial) response is not a file.
+    """
+    if response.status_code not in (200, 206):
+        response.raise_for_status()
+
+    content_type = response.headers["Content-Type"]
+    if content_type not in Request._raw_content_types:
+        msg = "Request produced a response with unknown content type {}"
+        raise UnkownContentError(msg.format(content_type))
+
+
+def download_file(
+    url: str,
+    path: str,
+    transport: Optional[DirectTransport] = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> str:
+    """
+    Download the file at ``url`` directly to ``path``, without keeping the
+    whole file in memory.
+
+    The response is streamed and written in chunks of ``chunk_size`` bytes
+    to a temporary file (in the same directory), which is renamed to
+    ``path`` when the download is complete. An interrupted download
+    therefore never leaves a partial file at ``path``.
+
+    Parameters
+    ----------
+    url: str
+        URL to send the request to.
+    path: str
+        Filename where the file is stored. Overwritten if it exists.
+    transport: :py:class:`astrometry_net_client.transport.DirectTransport`
+        Optional transport used to send the request.
+    chunk_size: int
+        Maximal number of bytes held in memory at once.
+
+    Returns
+    -------
+    str
+        The ``path`` of the downloaded file.
+
+    Raises
+    ------
+    UnkownContentError
+        When the response is not a file.
+    """
+    transport = default_transport if transport is None else transport
+    log.debug("Downloading {} to {}".format(url, path))
+    response = transport.get(url, stream=True, category=DOWNLOADS)
+    try:
+        _check_file_response(response)
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+            os.chmod(tmp_path, FILE_MODE)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    finally:
+        response.close()
+    return path
+
+
+def _fits_header_size(data: bytes, start: int = 0) -> Optional[int]:
+    """
+    Size of the FITS header at the start of ``data`` (a multiple of
+    :py:const:`FITS_BLOCK_SIZE`), or ``None`` if ``data`` does not contain
+    the END card. Only complete blocks, from offset ``start``, are searched.
+    """
+    complete = len(data) - len(data) % FITS_BLOCK_SIZE
+    for offset in range(start, complete, FITS_CARD_SIZE):
+        if data[offset : offset + 8] == b"END     ":
+            return (offset // FITS_BLOCK_SIZE + 1) * FITS_BLOCK_SIZE
+    return None
+
+
+def fits_header_request(
+    url: str, transport: Optional[DirectTransport] = None, blocks: int = 4
+) -> "fits.Header":
+    """
+    Get the (primary) header of the FITS file at ``url``, without downloading
+    the rest of the file.
+
+    The header is fetched with HTTP range requests, ``blocks`` FITS blocks
+    (of 2880 bytes) at a time, doubling the number of blocks for each next
+    request, until the END card is found. If the server does not support
+    range requests (i.e. responds with the whole file), the response is
+    streamed and closed as soon as the END card is read.
+
+    Parameters
+    ----------
+    url: str
+        URL to send the request to.
+    transport: :py:class:`astrometry_net_client.transport.DirectTransport`
+        Optional transport used to send the request.
+    blocks: int
+        Number of FITS blocks requested by the first range request.
+
+    Returns
+    -------
+    astropy.io.fits.Header
+
+    Raises
+    ------
+    UnkownContentError
+        When the response is not a file, or does not contain a FITS header.
+    """
+    transport = default_transport if transport is None else transport
+    data = b""
+    while True:
+        start = len(data)
+        byte_range = "bytes={}-{}".format(start, start + blocks * FITS_BLOCK_SIZE - 1)
+        log.debug("Requesting {} of {}".format(byte_range, url))
+        response = transport.get(
+            url, headers={"Range": byte_range}, stream=True, category=DOWNLOADS
+        )
+        try:
+            if response.status_code == 416:
+                # Range not satisfiable: the file ended on the previous range
+                break
+            _check_file_response(response)
+            if response.status_code == 206:
+                chunk = response.content
+                data += chunk
+                size = _fits_header_size(data, start)
+                if size is None and len(chunk) < blocks * FITS_BLOCK_SIZE:
+                    break  # end of the file
+            else:
+                log.debug("Range requests not supported, streaming {}".format(url))
+                data = b""
+                size = None
+                for chunk in response.iter_content(chunk_size=FITS_BLOCK_SIZE):
+                    offset = len(data) - len(data) % FITS_BLOCK_SIZE
+                    data += chunk
+                    size = _fits_header_size(data, offset)
+                    if size is not None:
+                        break
+                if size is None:
+                    break
+        finally:
+            response.close()
+
+        if size is not None:
+            from astropy.io import fits
+
+            return fits.Header.fromstring(data[:size])
+        blocks *= 2
+
+    raise UnkownContentError("No FITS header found in the response of {}".format(url))
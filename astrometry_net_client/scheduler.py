@@ -0,0 +1,281 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Callable, Optional
+
+log = logging.getLogger(__name__)
+
+# Default number of threads which make the status queries
+POLL_WORKERS = 4
+
+
+def _resolve(future: Future, result=None, exception=None) -> None:
+    """
+    Set the result (or exception) of a future, unless the caller cancelled it
+    (which can happen at any moment).
+    """
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        log.debug("Not resolving {}, it was cancelled".format(future))
+
+
+class _Entry(object):
+    __slots__ = ("statusable", "future", "interval", "end", "deadline")
+
+    def __init__(self, statusable, future, interval, end, deadline):
+        self.statusable = statusable
+        self.future = future
+        self.interval = interval
+        self.end = end
+        self.deadline = deadline
+
+
+class PollScheduler(object):
+    """
+    Waits for any number of statusables (e.g.
+    :py:class:`astrometry_net_client.statusables.Job` or
+    :py:class:`astrometry_net_client.statusables.Submission`) at the same
+    time, using a fixed number of threads.
+
+    Registered statusables are kept in a priority queue, ordered by the time
+    their next status query is due. A single dispatcher thread hands the due
+    statusables to a small pool of ``workers``, which query the status. When a
+    statusable is not yet done, it is put back with a doubled interval (from
+    ``start`` up to ``end`` seconds, the same behaviour as
+    :py:meth:`astrometry_net_client.statusables.Statusable.until_done`).
+
+    The total number of status queries is limited to ``rate`` per second,
+    regardless of the number of registered statusables.
+
+    Parameters
+    ----------
+    workers: int
+        Number of threads making the status queries.
+    rate: float or None
+        Maximum number of status queries per second. No limit if ``None``.
+    start: float
+        Default initial interval (in seconds) between two status queries.
+    end: float
+        Default maximal interval (in seconds) between two status queries.
+    stats: object
+        Optional object with a ``measure()`` context manager (e.g. a
+        :py:class:`astrometry_net_client.pipeline.StageStats`), which is used
+        to record each status query.
+
+    Examples
+    --------
+    >>> with PollScheduler(workers=4, rate=5) as scheduler:
+    ...     futures = [scheduler.register(Job(job_id)) for job_id in job_ids]
+    ...     for future in as_completed(futures):
+    ...         job = future.result()
+    """
+
+    def __init__(
+        self,
+        workers: int = POLL_WORKERS,
+        rate: Optional[float] = None,
+        start: float = 4,
+        end: float = 300,
+        stats=None,
+    ):
+        if workers < 1:
+            raise ValueError("workers must be greater than 0")
+        if rate is not None and rate <= 0:
+            raise ValueError("rate must be greater than 0")
+
+        self.workers = workers
+        self.rate = rate
+        self.start = start
+        self.end = end
+        self.stats = stats
+
+        self._heap: list = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._next_allowed = 0.0
+        self._outstanding = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def register(
+        self,
+        statusable,
+        callback: Optional[Callable] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        timeout: Optional[float] = None,
+        delay: float = 0,
+    ) -> Future:
+        """
+        Register a statusable, which will be queried until it is done.
+
+        Parameters
+        ----------
+        statusable: :py:class:`astrometry_net_client.statusables.Statusable`
+            The job or submission to wait for.
+        callback: callable
+            Optional function called with the resulting future, when the
+            statusable is done (or failed).
+        start: float
+            Initial interval between the status queries. Defaults to the
+            ``start`` of the scheduler.
+        end: float
+            Maximal interval between the status queries. Defaults to the
+            ``end`` of the scheduler.
+        timeout: float
+            If given, the future gets a :py:exc:`TimeoutError` when the
+            statusable is not done after this many seconds.
+        delay: float
+            Time (in seconds) before the first status query. By default the
+            first query is made as soon as possible.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Future which resolves to the statusable when it is done. If a
+            status query raises an exception, the future gets that exception.
+
+        Raises
+        ------
+        RuntimeError
+            When the scheduler is closed.
+        """
+        future: Future = Future()
+        if callback is not None:
+            future.add_done_callback(callback)
+
+        if statusable.done():
+            future.set_result(statusable)
+            return future
+
+        now = time.monotonic()
+        deadline = None if timeout is None else now + timeout
+        entry = _Entry(
+            statusable,
+            future,
+            self.start if start is None else start,
+            self.end if end is None else end,
+            deadline,
+        )
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Cannot register with a closed PollScheduler")
+            self._ensure_started()
+            self._outstanding += 1
+            self._push(entry, now + delay)
+        return future
+
+    def _ensure_started(self):
+        if self._thread is None:
+            self._executor = ThreadPoolExecutor(
+                self.workers, thread_name_prefix="anc-scheduler"
+            )
+            self._thread = threading.Thread(
+                target=self._dispatch_loop, name="anc-scheduler", daemon=True
+            )
+            self._thread.start()
+
+    def _push(self, entry, due):
+        heapq.heappush(self._heap, (due, next(self._counter), entry))
+        self._cond.notify()
+
+    def _dispatch_loop(self):
+        with self._cond:
+            while not self._closed:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+
+                now = time.monotonic()
+                due = max(self._heap[0][0], self._next_allowed)
+                if due > now:
+                    self._cond.wait(due - now)
+                    continue
+
+                _, _, entry = heapq.heappop(self._heap)
+                if self.rate is not None:
+                    self._next_allowed = max(now, self._next_allowed) + 1 / self.rate
+                self._executor.submit(self._poll, entry)
+
+    def _poll(self, entry):
+        future = entry.future
+        finished = True
+        try:
+            if future.cancelled():
+                return
+
+            if entry.deadline is not None and time.monotonic() > entry.deadline:
+                _resolve(future, exception=TimeoutError())
+                return
+
+            measure = self.stats.measure() if self.stats is not None else nullcontext()
+            try:
+                with measure:
+                    entry.statusable.status()
+            except Exception as e:
+                log.debug("Status query of {} failed".format(entry.statusable))
+                _resolve(future, exception=e)
+                return
+
+            if entry.statusable.done():
+                _resolve(future, result=entry.statusable)
+                return
+
+            finished = False
+            with self._cond:
+                if self._closed:
+                    return
+                due = time.monotonic() + entry.interval
+                if entry.deadline is not None:
+                    due = min(due, entry.deadline)
+                self._push(entry, due)
+                entry.interval = min(entry.interval * 2, entry.end)
+        finally:
+            if finished:
+                self._finish()
+
+    def _finish(self):
+        with self._cond:
+            self._outstanding -= 1
+
+    def __len__(self):
+        """
+        The number of registered statusables which are not yet done.
+        """
+        return self._outstanding
+
+    def close(self, cancel: bool = True) -> None:
+        """
+        Stop the scheduler. The futures of statusables which are still waiting
+        are cancelled (if ``cancel`` is ``True``).
+        """
+        with self._cond:
+            self._closed = True
+            entries = [entry for _, _, entry in self._heap]
+            self._heap.clear()
+            self._cond.notify_all()
+
+        if cancel:
+            for entry in entries:
+                entry.future.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        msg = "PollScheduler(workers={}, rate={}, outstanding={})"
+        return msg.format(self.workers, self.rate, len(self))
@@ -4,9 +4,8 @@ import logging
 import textwrap
 from pathlib import Path
 
-from astropy.io import fits
-
 from astrometry_net_client import Client, Settings
+from astrometry_net_client.index import UploadIndex
 
 # These lines set up logging
 FMT = "[%(asctime)s] %(levelname)-8s |" " %(funcName)s - %(message)s"
@@ -50,7 +49,14 @@ def main():
         s.set_scale_estimate(args.fov_width, args.fov_width_err, unit="arcminwidth")
 
     log.info("Initializing client (logging in)")
-    c = Client(api_key=args.key, key_location=args.key_location, settings=s)
+    index = UploadIndex(args.index) if args.index else None
+    c = Client(
+        api_key=args.key,
+        key_location=args.key_location,
+        settings=s,
+        index=index,
+        endpoint=args.endpoint,
+    )
     log.info("Log in done")
 
     # Prepare the output directory
@@ -76,6 +82,9 @@ def main():
     # generator, generating pairs containing the finished job and filename.
     result_iter = c.upload_files_gen(fits_files)
 
+    # Only imported now, so e.g. --help does not have to wait for astropy
+    from astropy.io import fits
+
     # Iterate over the jobs when they are finished
     for job, filename in result_iter:
 
@@ -142,6 +151,20 @@ def parse_arguments():
         help="If a file with a similar name already exists in the 'output' directory, overwrite it. Default: False",
     )
 
+    parser.add_argument(
+        "--index",
+        metavar="FILE",
+        type=str,
+        help="Database of earlier uploads. Files which were solved before (with the same settings) are not uploaded again, but the earlier result is used",
+    )
+
+    parser.add_argument(
+        "--endpoint",
+        metavar="URL",
+        type=str,
+        help="Address of the Astrometry.net instance to use, e.g. a self-hosted one. Default: http://nova.astrometry.net",
+    )
+
     # One of the methods to specify the key:
     key_group = parser.add_mutually_exclusive_group(required=True)
     key_group.add_argument(
@@ -1,15 +1,34 @@
 import logging
 import os
-from typing import Optional, cast
-
-from astrometry_net_client.config import login_url, read_api_key
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Mapping, Optional, Tuple, Union, cast
+
+import requests
+
+from astrometry_net_client.cache import SessionCache
+from astrometry_net_client.config import (
+    DEFAULT_ENDPOINT,
+    Endpoint,
+    as_endpoint,
+    login_url,
+    read_api_key,
+)
 from astrometry_net_client.exceptions import (
     APIKeyError,
+    ExhaustedAttemptsException,
     InvalidRequest,
     InvalidSessionError,
     LoginFailedException,
 )
+from astrometry_net_client.ratelimit import POLLS
 from astrometry_net_client.request import PostRequest, Request
+from astrometry_net_client.statusables import Job
+from astrometry_net_client.transport import (
+    DirectTransport,
+    default_transport,
+    retry_after,
+)
 
 log = logging.getLogger(__name__)
 
@@ -20,6 +39,11 @@ class Session(object):
     read an API key from multiple possible locations, and login to retrieve
     a session key (stored in the id attribute).
 
+    A session can be shared by many threads (and by the tasks of an
+    :py:class:`astrometry_net_client.aio.AsyncSession`): only one login is
+    made at a time, and callers which need a login while one is running wait
+    for it and use its result, instead of logging in again.
+
     Attributes
     ----------
     logged_in : bool
@@ -31,6 +55,22 @@ class Session(object):
     key : str
         The session key (not the :py:attr:`api_key`) which is given by the API
         after a valid :py:func:`login`.
+    generation : int
+        Number of successful logins. Identifies the current :py:attr:`key`,
+        so a request made with an expired key can tell whether the session
+        was renewed since (see :py:meth:`renew`).
+    transport : :py:class:`astrometry_net_client.transport.DirectTransport`
+        The transport used for the login, and by default for all requests
+        made with this session (see :py:class:`SessionRequest`).
+    key_cache : :py:class:`astrometry_net_client.cache.SessionCache`
+        Optional persistent cache of session keys. A session key of an
+        earlier login (e.g. by another process) is used instead of logging in,
+        and the key of every new login is stored in it.
+    endpoint : :py:class:`astrometry_net_client.config.Endpoint`
+        The Astrometry.net instance at which the session is used (can be
+        given as its url). Defaults to nova.astrometry.net. The uploads made
+        with the session, and their submissions and jobs, use the same
+        endpoint.
 
     Examples
     --------
@@ -55,6 +95,20 @@ class Session(object):
 
     >>> session_3 = Session()
 
+    To reuse connections for all requests made with the session, give it a
+    pooled :py:class:`astrometry_net_client.transport.Transport`:
+
+    >>> session_4 = Session('the api key', transport=Transport())
+
+    To reuse the session key of earlier processes (no login request at all,
+    as long as the key is valid):
+
+    >>> session_5 = Session('the api key', key_cache=SessionCache(path))
+
+    To use a self-hosted Astrometry.net instance:
+
+    >>> session_6 = Session('the api key', endpoint='https://astrometry.example.org')
+
     If you do not specify any of the above, an exception will be thrown:
 
     >>> Session()
@@ -69,7 +123,12 @@ class Session(object):
     url: str = login_url
 
     def __init__(
-        self, api_key: Optional[str] = None, key_location: Optional[str] = None
+        self,
+        api_key: Optional[str] = None,
+        key_location: Optional[str] = None,
+        transport: Optional[DirectTransport] = None,
+        key_cache: Optional[SessionCache] = None,
+        endpoint: Optional[Union[str, Endpoint]] = None,
     ):
         if api_key is not None:
             self.api_key = api_key.strip()
@@ -87,7 +146,13 @@ class Session(object):
                 )
             self.api_key = cast(str, env_key)
 
+        self.transport = default_transport if transport is None else transport
+        self.key_cache = key_cache
+        self.endpoint = as_endpoint(endpoint)
+        self.url = self.endpoint.login_url
         self.logged_in = False
+        self.generation = 0
+        self._lock = threading.Lock()
 
     def login(self, force: bool = False) -> None:
         """
@@ -99,11 +164,14 @@ class Session(object):
 
         After a successful login, the session key is stored in the
         :py:attr:`key` attribute and :py:attr:`logged_in` is set to `True`.
+        With a :py:attr:`key_cache`, a cached session key is used instead of
+        logging in, if there is one.
 
         Parameters
         ----------
         force: bool
-            Forces the login by ignoring the :py:attr:`logged_in` boolean.
+            Forces the login by ignoring the :py:attr:`logged_in` boolean
+            (and the :py:attr:`key_cache`).
 
         Raises
         ------
@@ -113,14 +181,100 @@ class Session(object):
         if not force and self.logged_in:
             return
 
-        r = PostRequest(self.url, data={"apikey": self.api_key})
+        with self._lock:
+            # Another thread may have logged in while waiting for the lock
+            if not force and (self.logged_in or self._use_cached()):
+                return
+            self._login()
+
+    @property
+    def _cache_id(self) -> str:
+        # Session keys of other instances are cached separately
+        if self.endpoint == DEFAULT_ENDPOINT:
+            return self.api_key
+        return "{} {}".format(self.endpoint.url, self.api_key)
+
+    def _use_cached(self, rejected: Optional[str] = None) -> bool:
+        """
+        Use the session key in the :py:attr:`key_cache`, if there is one (and
+        it is not the ``rejected`` key). Returns whether a key was used.
+        """
+        if self.key_cache is None:
+            return False
+        key = self.key_cache.get(self._cache_id)
+        if key is None or key == rejected:
+            return False
+        log.debug("Using cached session key")
+        self._set_key(key)
+        return True
+
+    def _set_key(self, key: str) -> None:
+        self.key: str = key
+        self.logged_in = True
+        self.generation += 1
+
+    def _login(self) -> None:
+        # Logging in again is harmless, so it can always be retried
+        r = PostRequest(
+            self.url,
+            data={"apikey": self.api_key},
+            transport=self.transport,
+            idempotent=True,
+            category=POLLS,
+        )
         try:
             response = cast(dict, r.make())
         except InvalidRequest:
             raise LoginFailedException("The api key given is not valid")
 
-        self.key: str = response["session"]
-        self.logged_in = True
+        self._set_key(response["session"])
+        log.debug("Logged in (generation {})".format(self.generation))
+        if self.key_cache is not None:
+            self.key_cache.put(self._cache_id, self.key)
+
+    def credentials(self) -> Tuple[str, int]:
+        """
+        Log in if needed, and return the session :py:attr:`key` together with
+        its :py:attr:`generation`. Waits while another thread logs in.
+
+        Returns
+        -------
+        (str, int)
+            The session key and its generation.
+        """
+        self.login()
+        with self._lock:
+            return self.key, self.generation
+
+    def renew(self, generation: int) -> Tuple[str, int]:
+        """
+        Log in again, because the key of the given ``generation`` expired.
+
+        When many requests find out the key expired at the same time, only
+        the first one logs in: the others wait for it, see that the
+        :py:attr:`generation` changed, and use the new key. With a
+        :py:attr:`key_cache`, a newer key of another process is used if
+        there is one.
+
+        Parameters
+        ----------
+        generation: int
+            The generation of the key which was rejected.
+
+        Returns
+        -------
+        (str, int)
+            The new session key and its generation.
+
+        Raises
+        ------
+        LoginFailedException
+            If the login response does not have the status 'success'.
+        """
+        with self._lock:
+            if self.generation == generation and not self._use_cached(self.key):
+                self._login()
+            return self.key, self.generation
 
 
 class SessionRequest(Request):
@@ -129,7 +283,12 @@ class SessionRequest(Request):
     user is logged in and the session key is send alongside the request.
 
     The separate login request (if needed) is only send just before the
-    original request is made, (e.g. when calling make / _make_request).
+    original request is made, (e.g. when calling make / _make_request). When
+    the session key turns out to be expired, the session is renewed (once for
+    all requests which used that key, see :py:meth:`Session.renew`) and the
+    request is retried exactly once.
+
+    If no ``transport`` is given, the transport of the session is used.
 
     Attributes
     ----------
@@ -137,20 +296,308 @@ class SessionRequest(Request):
     """
 
     def __init__(self, session: Session, *args, **kwargs):
+        if kwargs.get("transport") is None:
+            kwargs["transport"] = session.transport
         super().__init__(*args, **kwargs)
         self.session = session
 
     def _make_request(self) -> dict:
-        self.session.login()
-        self.data["session"] = self.session.key
+        key, generation = self.session.credentials()
+        self.data["session"] = key
         try:
             # A login request will always return a dictionary
             return cast(dict, super()._make_request())
         except InvalidSessionError:
             log.info("Session expired, loggin in again")
-            self.session.login(force=True)
+            key, _ = self.session.renew(generation)
             # update the session key for the request as well
-            self.data["session"] = self.session.key
+            self.data["session"] = key
 
         # A login request will always return a dictionary
         return cast(dict, super()._make_request())
+
+
+# HTTP status codes which mean the API key is throttled
+THROTTLE_STATUS = {429, 503}
+
+# Default time (in seconds) a throttled session is not used
+THROTTLE_TIME = 60.0
+
+# Weight of the latest upload in the average latency of an endpoint
+LATENCY_WEIGHT = 0.3
+
+
+class SessionPool(object):
+    """
+    Pool of several sessions (e.g. for several API keys, or several
+    Astrometry.net instances), to spread the uploads of a
+    :py:class:`astrometry_net_client.client.Client` over them, beyond the
+    limits of a single user or server.
+
+    Can be given as the ``session`` of a Client. Each upload is made with the
+    session which is expected to handle it first: the one with the lowest
+    number of outstanding submissions (submitted, but their job is not yet
+    finished) times the recent upload latency of its endpoint, see
+    :py:meth:`submit`. Endpoints without a measured latency yet are tried
+    first. When a session is throttled by the server (HTTP status 429 or
+    503), it is not used for ``Retry-After`` seconds (or ``throttle_time``),
+    and the upload is made with another session instead. The same happens
+    when the server of the session cannot be reached, so the uploads fail
+    over to the other endpoints.
+
+    The submissions (and their jobs) are always queried at the endpoint of
+    the session which uploaded them.
+
+    Parameters
+    ----------
+    sessions: list
+        The :py:class:`Session` objects of the pool, at least one.
+    throttle_time: float
+        Time (in seconds) a throttled (or unreachable) session is not used, if
+        the server does not specify it.
+
+    Attributes
+    ----------
+    transport : :py:class:`astrometry_net_client.transport.DirectTransport`
+        The transport of the first session, used for the requests which do
+        not need a session (e.g. the status of jobs).
+    endpoint : :py:class:`astrometry_net_client.config.Endpoint`
+        The endpoint of the first session, used for jobs which are not
+        uploaded with the pool (e.g.
+        :py:meth:`astrometry_net_client.client.Client.get_job`).
+
+    Examples
+    --------
+    >>> pool = SessionPool([Session(key) for key in api_keys])
+    >>> client = Client(session=pool)
+    >>> results, stats = client.run_batch(files)
+
+    Spreading the uploads over several self-hosted instances:
+
+    >>> pool = SessionPool.from_endpoints(
+    ...     {"https://a.example.org": key_a, "https://b.example.org": key_b}
+    ... )
+    """
+
+    def __init__(self, sessions, throttle_time: float = THROTTLE_TIME):
+        self.sessions = list(sessions)
+        if not self.sessions:
+            raise ValueError("A session pool needs at least one session")
+        self.throttle_time = throttle_time
+        self.transport = self.sessions[0].transport
+        self.endpoint = self.sessions[0].endpoint
+
+        self._outstanding: Dict[Session, Dict[int, Any]] = {
+            session: {} for session in self.sessions
+        }
+        self._throttled: Dict[Session, float] = {}
+        self._latency: Dict[Endpoint, float] = {}
+        self._owners: Dict[Tuple[str, Endpoint, int], Session] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_endpoints(
+        cls,
+        endpoints: Union[Iterable[Union[str, Endpoint]], Mapping],
+        throttle_time: float = THROTTLE_TIME,
+        **kwargs,
+    ) -> "SessionPool":
+        """
+        Create a pool with a session for each of the endpoints.
+
+        Parameters
+        ----------
+        endpoints: iterable or dict
+            The endpoints (or their urls), or a dictionary mapping each
+            endpoint to its API key.
+        throttle_time: float
+            See :py:class:`SessionPool`.
+        kwargs: arguments
+            Passed to each :py:class:`Session`, e.g. the ``api_key`` (when it
+            is the same for all endpoints) and ``transport``.
+        """
+        if isinstance(endpoints, Mapping):
+            sessions = [
+                Session(api_key=api_key, endpoint=endpoint, **kwargs)
+                for endpoint, api_key in endpoints.items()
+            ]
+        else:
+            sessions = [Session(endpoint=endpoint, **kwargs) for endpoint in endpoints]
+        return cls(sessions, throttle_time=throttle_time)
+
+    @property
+    def logged_in(self) -> bool:
+        return all(session.logged_in for session in self.sessions)
+
+    def login(self, force: bool = False) -> None:
+        """
+        Log in with all sessions (see :py:meth:`Session.login`).
+        """
+        for session in self.sessions:
+            session.login(force=force)
+
+    def outstanding(self, session: Session) -> int:
+        """
+        Number of outstanding submissions of the session.
+        """
+        return len(self._outstanding[session])
+
+    def latency(self, session: Session) -> Optional[float]:
+        """
+        Recent upload latency (in seconds, exponentially averaged) of the
+        endpoint of the session, or ``None`` if nothing was uploaded to it
+        yet.
+        """
+        return self._latency.get(session.endpoint)
+
+    def throttle(self, session: Session, seconds: Optional[float] = None) -> None:
+        """
+        Do not use the session for the given time (defaults to
+        :py:attr:`throttle_time`), because it is throttled by the server (or
+        the server is unavailable).
+        """
+        seconds = self.throttle_time if seconds is None else seconds
+        log.warning("Session {} throttled for {}s".format(session, seconds))
+        with self._lock:
+            self._throttled[session] = time.monotonic() + seconds
+
+    def _choose(self, exclude) -> Session:
+        now = time.monotonic()
+        candidates = [s for s in self.sessions if s not in exclude]
+        available = [s for s in candidates if self._throttled.get(s, 0) <= now]
+        if available:
+            return min(
+                available,
+                key=lambda s: (
+                    (len(self._outstanding[s]) + 1)
+                    * self._latency.get(s.endpoint, 0.0),
+                    len(self._outstanding[s]),
+                ),
+            )
+        # All are throttled, use the one which is available first
+        return min(candidates, key=lambda s: self._throttled[s])
+
+    def submit(self, make_upload: Callable, registry=None):
+        """
+        Create an upload with the least busy session and submit it. When the
+        session is throttled or its server cannot be reached, the upload is
+        made with the next session. When all sessions are throttled, this
+        waits until the first of them may be used again.
+
+        Parameters
+        ----------
+        make_upload: callable
+            Function which creates the upload (e.g. a
+            :py:class:`astrometry_net_client.uploads.FileUpload`) for the
+            given session.
+        registry: :py:class:`astrometry_net_client.statusables.JobRegistry`
+            Optional registry used by the submission for its jobs.
+
+        Returns
+        -------
+        :py:class:`astrometry_net_client.statusables.Submission`
+
+        Raises
+        ------
+        requests.HTTPError
+            When the upload fails, or all sessions are throttled (also after
+            waiting).
+        requests.ConnectionError
+            When none of the servers can be reached.
+        :py:exc:`astrometry_net_client.exceptions.ExhaustedAttemptsException`
+            When the retries of the transport are exhausted (for a reason
+            other than throttling), or all sessions are throttled (also after
+            waiting).
+        """
+        tried: set = set()
+        while True:
+            with self._lock:
+                session = self._choose(tried)
+                wait = self._throttled.get(session, 0) - time.monotonic()
+            if wait > 0:
+                log.info("All sessions throttled, waiting {:.1f}s".format(wait))
+                time.sleep(wait)
+            start = time.monotonic()
+            try:
+                submission = make_upload(session).submit(registry=registry)
+            except (
+                requests.HTTPError,
+                requests.ConnectionError,
+                ExhaustedAttemptsException,
+            ) as e:
+                # The transport may have retried the upload already
+                response = getattr(e, "response", None)
+                if response is not None and response.status_code in THROTTLE_STATUS:
+                    self.throttle(session, retry_after(response))
+                elif response is None and not isinstance(e, requests.HTTPError):
+                    log.warning("Endpoint {} unavailable".format(session.endpoint))
+                    self.throttle(session)
+                else:
+                    raise
+                tried.add(session)
+                if len(tried) == len(self.sessions):
+                    raise
+                continue
+
+            latency = time.monotonic() - start
+            with self._lock:
+                previous = self._latency.get(session.endpoint)
+                if previous is not None:
+                    latency = LATENCY_WEIGHT * latency + (1 - LATENCY_WEIGHT) * previous
+                self._latency[session.endpoint] = latency
+                self._outstanding[session][submission.id] = submission
+                self._owners[self._key(submission)] = session
+            return submission
+
+    @staticmethod
+    def _key(statusable) -> Tuple[str, Endpoint, int]:
+        kind = "job" if isinstance(statusable, Job) else "submission"
+        return kind, statusable.endpoint, statusable.id
+
+    def owner(self, statusable) -> Optional[Session]:
+        """
+        The session with which the submission (or the submission of the job)
+        was made, or ``None`` if it was not made with this pool or is
+        finished.
+        """
+        with self._lock:
+            owner = self._owners.get(self._key(statusable))
+            if owner is None and isinstance(statusable, Job):
+                found = self._find_job(statusable)
+                if found is not None:
+                    owner = found[0]
+                    self._owners[self._key(statusable)] = owner
+            return owner
+
+    def _find_job(self, job) -> Optional[Tuple[Session, Any]]:
+        """
+        Find the session and the outstanding submission of the job.
+        """
+        for session, submissions in self._outstanding.items():
+            for submission in submissions.values():
+                jobs = getattr(submission, "jobs", [])
+                if any(j.id == job.id and j.endpoint == job.endpoint for j in jobs):
+                    return session, submission
+        return None
+
+    def finished(self, job) -> None:
+        """
+        Mark the submission of the job as finished, so it no longer counts as
+        outstanding for its session, and forget its owner.
+        """
+        with self._lock:
+            self._owners.pop(self._key(job), None)
+            found = self._find_job(job)
+            if found is None:
+                return
+            session, submission = found
+            del self._outstanding[session][submission.id]
+            self._owners.pop(self._key(submission), None)
+            for other in getattr(submission, "jobs", []):
+                self._owners.pop(self._key(other), None)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __repr__(self):
+        return "SessionPool({!r})".format(self.sessions)
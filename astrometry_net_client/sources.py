@@ -0,0 +1,201 @@
+import logging
+from typing import Tuple
+
+import numpy as np
+from astropy.io import fits
+
+log = logging.getLogger(__name__)
+
+# Structured type of the extracted sources, pixel coordinates are 0 based
+SOURCE_DTYPE = np.dtype([("x", "f8"), ("y", "f8"), ("flux", "f8")])
+
+# Default maximal number of sources, Astrometry.net only needs the brightest
+MAX_SOURCES = 300
+
+# Number of candidates (brightest first) per returned source which are
+# measured, so the work does not grow with the number of local maxima
+CANDIDATES_PER_SOURCE = 10
+
+
+def estimate_background(data: np.ndarray, box: int = 64) -> Tuple[np.ndarray, float]:
+    """
+    Estimate the background and noise level of an image.
+
+    The background is the median of each ``box`` x ``box`` tile of the image
+    (expanded back to the size of the image). The noise is the median
+    absolute deviation from the background, scaled to a standard deviation.
+    If that is 0 (e.g. for a flat or mostly saturated integer image), the
+    standard deviation of the residual is used instead, but it is always
+    positive.
+
+    Parameters
+    ----------
+    data: numpy.ndarray
+        2D image.
+    box: int
+        Size of the tiles.
+
+    Returns
+    -------
+    (numpy.ndarray, float)
+        The background image and the standard deviation of the noise.
+    """
+    height, width = data.shape
+    rows, cols = -(-height // box), -(-width // box)
+
+    # Pad to complete tiles with NaN, which are ignored by nanmedian
+    padded = np.full((rows * box, cols * box), np.nan, dtype=np.float32)
+    padded[:height, :width] = data
+    tiles = padded.reshape(rows, box, cols, box).transpose(0, 2, 1, 3)
+    medians = np.nanmedian(tiles.reshape(rows, cols, box * box), axis=2)
+
+    background = np.repeat(np.repeat(medians, box, axis=0), box, axis=1)
+    background = background[:height, :width]
+    residual = data - background
+    sigma = 1.4826 * float(np.nanmedian(np.abs(residual)))
+    if not sigma > 0:
+        sigma = float(np.nanstd(residual))
+    if not sigma > 0:
+        sigma = float(np.finfo(np.float32).eps)
+    return background, sigma
+
+
+def _box_mean(data: np.ndarray, radius: int) -> np.ndarray:
+    """
+    Mean over the ``(2 * radius + 1)`` square pixels around each pixel, using
+    a summed-area table (the image is extended at the edges).
+    """
+    size = 2 * radius + 1
+    padded = np.pad(data, radius, mode="edge").astype(np.float64)
+    table = np.pad(padded.cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+    sums = (
+        table[size:, size:]
+        - table[:-size, size:]
+        - table[size:, :-size]
+        + table[:-size, :-size]
+    )
+    return (sums / size**2).astype(np.float32)
+
+
+def _local_maxima(data: np.ndarray) -> np.ndarray:
+    """
+    Mask of the pixels which are a maximum within their 3 x 3 neighbourhood.
+    On flat tops, only a single pixel is marked: a pixel must be strictly
+    larger than the neighbours before it (in memory order), and at least as
+    large as the ones after it.
+    """
+    padded = np.pad(data, 1, mode="constant", constant_values=-np.inf)
+    height, width = data.shape
+    peaks = np.ones(data.shape, dtype=bool)
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            if dy == 0 and dx == 0:
+                continue
+            neighbour = padded[1 + dy : 1 + dy + height, 1 + dx : 1 + dx + width]
+            if (dy, dx) < (0, 0):
+                peaks &= data > neighbour
+            else:
+                peaks &= data >= neighbour
+    return peaks
+
+
+def extract_sources(
+    data: np.ndarray,
+    threshold: float = 5.0,
+    max_sources: int = MAX_SOURCES,
+    radius: int = 2,
+    box: int = 64,
+) -> np.ndarray:
+    """
+    Find the stars in an image, using only ``numpy``.
+
+    After subtracting the background (see :py:func:`estimate_background`),
+    the image is smoothed with a box of ``(2 * radius + 1)`` square pixels.
+    Each local maximum of the smoothed image, where the pixel is above
+    ``threshold`` times the noise, is a source. Its position is the flux
+    weighted centroid of the surrounding box of pixels, and its flux the sum
+    of these pixels. Fainter sources closer than the size of the box to a
+    brighter one (e.g. on a saturated star) are dropped.
+
+    Parameters
+    ----------
+    data: numpy.ndarray
+        2D image.
+    threshold: float
+        Detection threshold, in units of the standard deviation of the noise.
+    max_sources: int
+        Maximal number of sources returned, the brightest are kept.
+    radius: int
+        Half size of the box used for the centroid and flux.
+    box: int
+        Size of the tiles of the background estimate.
+
+    Returns
+    -------
+    numpy.ndarray
+        Structured array (see :py:data:`SOURCE_DTYPE`) with fields ``x``,
+        ``y`` (0 based pixel coordinates) and ``flux``, sorted by decreasing
+        flux.
+    """
+    data = np.asarray(data, dtype=np.float32)
+    background, sigma = estimate_background(data, box=box)
+    residual = np.nan_to_num(data - background, nan=0.0)
+
+    smoothed = _box_mean(residual, radius)
+    candidates = _local_maxima(smoothed) & (residual > threshold * sigma)
+    ys, xs = np.nonzero(candidates)
+    log.debug("Found {} candidate sources".format(len(xs)))
+
+    # Only measure the brightest candidates (by the smoothed image)
+    limit = CANDIDATES_PER_SOURCE * max_sources
+    if len(xs) > limit:
+        brightest = np.argpartition(-smoothed[ys, xs], limit - 1)[:limit]
+        ys, xs = ys[brightest], xs[brightest]
+
+    # Gather the box around all candidates at once: (n, size, size)
+    offsets = np.arange(-radius, radius + 1)
+    rows = np.clip(ys[:, None] + offsets, 0, data.shape[0] - 1)
+    cols = np.clip(xs[:, None] + offsets, 0, data.shape[1] - 1)
+    stamps = np.clip(residual[rows[:, :, None], cols[:, None, :]], 0, None)
+
+    flux = stamps.sum(axis=(1, 2))
+    weights = np.where(flux > 0, flux, 1)
+    sources = np.empty(len(xs), dtype=SOURCE_DTYPE)
+    sources["x"] = (stamps.sum(axis=1) * cols).sum(axis=1) / weights
+    sources["y"] = (stamps.sum(axis=2) * rows).sum(axis=1) / weights
+    sources["flux"] = flux
+
+    # Keep the brightest, at a minimal distance of the size of the box
+    separation = (2 * radius + 1) ** 2
+    keep: list = []
+    for index in np.argsort(-flux, kind="stable"):
+        if len(keep) == max_sources:
+            break
+        distance = (xs[keep] - xs[index]) ** 2 + (ys[keep] - ys[index]) ** 2
+        if not np.any(distance < separation):
+            keep.append(index)
+    return sources[keep]
+
+
+def extract_file_sources(filename: str, **kwargs) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """
+    Extract the sources of the first image in a FITS file (see
+    :py:func:`extract_sources`). Can be used in a process pool.
+
+    Parameters
+    ----------
+    filename: str
+        Path to the FITS file.
+    kwargs: arguments
+        Passed to :py:func:`extract_sources`.
+
+    Returns
+    -------
+    (numpy.ndarray, (int, int))
+        The sources and the shape (height, width) of the image.
+    """
+    with fits.open(filename) as hdulist:
+        hdu = next((h for h in hdulist if h.is_image and h.data is not None), None)
+        if hdu is None:
+            raise ValueError("No image data in {}".format(filename))
+        return extract_sources(hdu.data, **kwargs), hdu.data.shape
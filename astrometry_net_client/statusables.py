@@ -1,16 +1,23 @@
 import abc
 import logging
+import threading
 import time
+import weakref
 from functools import wraps
 
-from astropy.io import fits
-
-from astrometry_net_client.config import BASE_URL
+from astrometry_net_client.cache import default_product_cache
+from astrometry_net_client.config import DEFAULT_ENDPOINT, as_endpoint
 from astrometry_net_client.exceptions import (
     StatusFailedException,
     StillProcessingException,
 )
-from astrometry_net_client.request import Request, file_request, fits_file_request
+from astrometry_net_client.request import (
+    Request,
+    download_file,
+    file_request,
+    fits_header_request,
+)
+from astrometry_net_client.transport import default_transport
 
 log = logging.getLogger(__name__)
 
@@ -45,6 +52,37 @@ def cache_response(func):
     return wrapper
 
 
+def cache_product(func):
+    """
+    Wrapper around a method of a :py:class:`Job` to cache its result in the
+    :py:attr:`Job.product_cache` (shared by all jobs, and bounded in size),
+    under the name of the method.
+
+    Parameters
+    ----------
+    func
+        function to be wrapped
+
+    Returns
+    -------
+    wrapped function
+    """
+    func_name = func.__name__
+
+    @wraps(func)
+    def wrapper(self, *args, force=False, **kwargs):
+        if not force:
+            result = self.product_cache.get(self.cache_key, func_name)
+            if result is not None:
+                log.debug("Result {} already cached. Reusing...".format(func_name))
+                return result
+        result = func(self, *args, **kwargs)
+        self.product_cache.put(self.cache_key, func_name, result)
+        return result
+
+    return wrapper
+
+
 def ensure_status_success(func):
     """
     Decorator for a method to enforce it only being called when the
@@ -264,7 +302,8 @@ class Submission(Statusable):
 
     When :py:func:`status` is called and jobs are available, the status of the
     jobs will also be queried. To see the response of these jobs, see their
-    ``response`` attribute.
+    ``response`` attribute. The jobs are queried at the same time, up to the
+    ``parallelism`` of the :py:attr:`transport`.
 
     Note that some of the attributes listed below are only available when
     :py:func:`status` is queried.
@@ -289,17 +328,54 @@ class Submission(Statusable):
     processing_finished: str
         If available, a string containing the date when the Submission process
         finished.
+    transport: :py:class:`astrometry_net_client.transport.DirectTransport`
+        The transport used for the requests of the submission. Is passed on
+        to the spawned jobs.
+    registry: :py:class:`JobRegistry`
+        The registry from which the :py:attr:`jobs` are taken, so the same
+        :py:class:`Job` object is used for the same job id. If not given, a
+        registry private to the submission is used, which still ensures the
+        jobs are kept between status queries.
+    reduction: :py:class:`astrometry_net_client.preprocess.Reduction`
+        The reduction applied to the uploaded image, if any. Passed on to the
+        spawned jobs.
+    endpoint: :py:class:`astrometry_net_client.config.Endpoint`
+        The Astrometry.net instance of the submission (can be given as its
+        url), defaults to nova.astrometry.net. Passed on to the spawned jobs.
+    upload_latency: float
+        Time (in seconds) of the HTTP request of the upload which created the
+        submission (see
+        :py:attr:`astrometry_net_client.uploads.BaseUpload.latency`), or
+        ``None`` if it is not known.
+    upload_size: int
+        Size (in bytes) of the request body of that upload, or ``None`` if it
+        is not known.
 
     See Also
     --------
     Statusable : For available function on getting the status & waiting
     """
 
-    url = BASE_URL + "/submissions/{submission.id}"
+    url = "{submission.endpoint.api_url}/submissions/{submission.id}"
 
-    def __init__(self, submission_id):
+    def __init__(
+        self,
+        submission_id,
+        transport=None,
+        registry=None,
+        reduction=None,
+        endpoint=None,
+    ):
         self.id = submission_id
+        self.endpoint = as_endpoint(endpoint)
         self.url = self.url.format(submission=self)
+        self.transport = default_transport if transport is None else transport
+        if registry is None:
+            registry = JobRegistry(transport=self.transport)
+        self.registry = registry
+        self.reduction = reduction
+        self.upload_latency = None
+        self.upload_size = None
 
     @ensure_status
     def __iter__(self):
@@ -315,7 +391,7 @@ class Submission(Statusable):
         return iter(self.jobs)
 
     def _make_status_request(self):
-        r = Request(self.url)
+        r = Request(self.url, transport=self.transport)
         response = r.make()
         self.response = response
 
@@ -327,10 +403,25 @@ class Submission(Statusable):
         self.images = response["images"]
         self.job_calibrations = response["job_calibrations"]
 
-        self.jobs = [Job(job_id) for job_id in response["jobs"] if job_id is not None]
-
+        self.jobs = [
+            self.registry.get(job_id, endpoint=self.endpoint)
+            for job_id in response["jobs"]
+            if job_id is not None
+        ]
+        if self.reduction is not None:
+            for job in self.jobs:
+                job.reduction = self.reduction
+
+        # A job with a calibration has been solved, so there is no need for a
+        # separate status request. Only the others are queried, concurrently
+        # if the transport allows it.
+        calibrated = {calibration[0] for calibration in self.job_calibrations}
         for job in self.jobs:
-            job.status()
+            if job.id in calibrated:
+                job._update_status({"status": "success"})
+        self.transport.run_all(
+            Job.status, [job for job in self.jobs if job.id not in calibrated]
+        )
 
         return response
 
@@ -397,40 +488,101 @@ class Job(Statusable):
         {"parity": 1.0, "orientation": 105.74942079091929,
                 "pixscale": 1.0906710701159739, "radius": 0.8106715896625917,
                 "ra": 169.96633791366915, "dec": 13.221011585315143}
+    transport: :py:class:`astrometry_net_client.transport.DirectTransport`
+        The transport used for the status, info and file requests.
+    disk_cache: :py:class:`astrometry_net_client.cache.DiskCache`
+        Optional cache in which the result files (e.g. :py:meth:`wcs_file`)
+        are stored, and looked up before downloading them.
+    product_cache: :py:class:`astrometry_net_client.cache.ProductCache`
+        In-memory cache for the results, shared with the other jobs.
+        Defaults to
+        :py:data:`astrometry_net_client.cache.default_product_cache`.
+    reduction: :py:class:`astrometry_net_client.preprocess.Reduction`
+        The reduction applied to the uploaded image (see
+        :py:class:`astrometry_net_client.preprocess.Preprocessor`), if any.
+        The WCS of :py:meth:`wcs_file` is mapped back to the original image.
+    endpoint: :py:class:`astrometry_net_client.config.Endpoint`
+        The Astrometry.net instance of the job (can be given as its url),
+        defaults to nova.astrometry.net. All requests of the job, including
+        the result files, are made to it.
 
     See Also
     --------
     Statusable : For available functions on getting the status & waiting
     """
 
-    url = BASE_URL + "/jobs/{job.id}"
+    url = "{job.endpoint.api_url}/jobs/{job.id}"
 
     info_suffix = "/info"
 
     # does not include the .../api/ path ... :(
-    wcs_file_url = "http://nova.astrometry.net/wcs_file/{job.id}"
-    fits_file_url = "http://nova.astrometry.net/new_fits_file/{job.id}"
-    rdls_file_url = "http://nova.astrometry.net/rdls_file/{job.id}"
-    axy_file_url = "http://nova.astrometry.net/axy_file/{job.id}"
-    corr_file_url = "http://nova.astrometry.net/corr_file/{job.id}"
-    annotated_display_url = "http://nova.astrometry.net/annotated_display/{job.id}"
-    red_green_image_display_url = (
-        "http://nova.astrometry.net/red_green_image_display/{job.id}"
-    )
+    wcs_file_url = "{job.endpoint.url}/wcs_file/{job.id}"
+    fits_file_url = "{job.endpoint.url}/new_fits_file/{job.id}"
+    rdls_file_url = "{job.endpoint.url}/rdls_file/{job.id}"
+    axy_file_url = "{job.endpoint.url}/axy_file/{job.id}"
+    corr_file_url = "{job.endpoint.url}/corr_file/{job.id}"
+    annotated_display_url = "{job.endpoint.url}/annotated_display/{job.id}"
+    red_green_image_display_url = "{job.endpoint.url}/red_green_image_display/{job.id}"
     extraction_image_display_url = (
-        "http://nova.astrometry.net/extraction_image_display/{job.id}"
+        "{job.endpoint.url}/extraction_image_display/{job.id}"
     )
 
-    def __init__(self, job_id):
+    reduction = None
+
+    # Names of the results which can be downloaded, with their url attribute
+    product_urls = {
+        "wcs_file": "wcs_file_url",
+        "new_fits_file": "fits_file_url",
+        "rdls_file": "rdls_file_url",
+        "axy_file": "axy_file_url",
+        "corr_file": "corr_file_url",
+        "annotated_display": "annotated_display_url",
+        "red_green_image_display": "red_green_image_display_url",
+        "extraction_image_display": "extraction_image_display_url",
+    }
+
+    def __init__(
+        self,
+        job_id,
+        transport=None,
+        disk_cache=None,
+        product_cache=None,
+        endpoint=None,
+    ):
         self.id = job_id
+        self.endpoint = as_endpoint(endpoint)
         self.url = self.url.format(job=self)
+        self.transport = default_transport if transport is None else transport
+        self.disk_cache = disk_cache
+        self.product_cache = (
+            default_product_cache if product_cache is None else product_cache
+        )
+
+    @property
+    def cache_key(self):
+        """
+        Key of the results of this job in the caches: the :py:attr:`id`, or
+        the id prefixed with the url of the endpoint for jobs of another
+        instance than nova.astrometry.net (as their ids can be the same).
+        """
+        if self.endpoint == DEFAULT_ENDPOINT:
+            return self.id
+        return "{} {}".format(self.endpoint.url, self.id)
 
     def _make_status_request(self):
-        r = Request(self.url)
+        r = Request(self.url, transport=self.transport)
         response = r.make()
         self.resp_status = response["status"]
         return response
 
+    def _update_status(self, response):
+        """
+        Set the status from a response obtained elsewhere (e.g. from the
+        submission which spawned this job), without making a request.
+        """
+        self.stat_response = response
+        self.resp_status = response["status"]
+
     def _is_final_status(self):
         try:
             return self.resp_status in {"success", "failure"}
@@ -440,10 +592,26 @@ class Job(Statusable):
     def _status_success(self):
         return self.resp_status == "success"
 
+    def _product(self, name, url):
+        """
+        Get the binary contents of the result file ``name``, from the
+        :py:attr:`disk_cache` if it is there. Otherwise it is downloaded from
+        ``url`` (and stored in the cache).
+        """
+        if self.disk_cache is not None:
+            data = self.disk_cache.get(self.cache_key, name)
+            if data is not None:
+                return data
+
+        data = file_request(url.format(job=self), transport=self.transport)
+        if self.disk_cache is not None:
+            self.disk_cache.put(self.cache_key, name, data)
+        return data
+
     @ensure_status
     @cache_response
     def info(self):
-        r = Request(self.url + self.info_suffix)
+        r = Request(self.url + self.info_suffix, transport=self.transport)
         response = r.make()
 
         self.objects_in_field = response["objects_in_field"]
@@ -457,22 +625,28 @@ class Job(Statusable):
         return response
 
     @ensure_status_success
-    @cache_response
+    @cache_product
     def wcs_file(self):
         """
         Get the resulting wcs file as an astropy.io.fits.Header.
 
+        If the uploaded image was reduced (see :py:attr:`reduction`), the
+        WCS is mapped back to the pixels of the original image.
+
         Returns
         -------
         astropy.io.fits.Header
         """
-        r = Request(self.wcs_file_url.format(job=self))
-        binary_wcs = r.make()
+        from astropy.io import fits
+
+        binary_wcs = self._product("wcs_file", self.wcs_file_url)
         header = fits.Header.fromstring(binary_wcs)
+        if self.reduction is not None:
+            header = self.reduction.restore_wcs(header)
         return header
 
     @ensure_status_success
-    @cache_response
+    @cache_product
     def new_fits_file(self):
         """
         Get the new fits file (original file + new header).
@@ -481,25 +655,93 @@ class Job(Statusable):
         -------
         astropy.io.fits.HDUList
         """
-        return fits_file_request(self.fits_file_url.format(job=self))
+        from astropy.io import fits
+
+        return fits.HDUList(file=self._product("new_fits_file", self.fits_file_url))
 
     @ensure_status_success
-    @cache_response
+    @cache_product
+    def new_fits_header(self):
+        """
+        Get only the header of the new fits file (original header + WCS),
+        without downloading the image data (see
+        :py:func:`astrometry_net_client.request.fits_header_request`).
+
+        Returns
+        -------
+        astropy.io.fits.Header
+        """
+        url = self.fits_file_url.format(job=self)
+        return fits_header_request(url, transport=self.transport)
+
+    @ensure_status_success
+    def download(self, product, path, memmap=False):
+        """
+        Download a result file directly to disk, without keeping the whole
+        file in memory (see
+        :py:func:`astrometry_net_client.request.download_file`).
+
+        Parameters
+        ----------
+        product: str
+            Name of the result, one of the keys of :py:attr:`product_urls`,
+            e.g. ``"new_fits_file"`` or ``"annotated_display"``.
+        path: str
+            Filename where the result is stored.
+        memmap: bool
+            If ``True``, the downloaded (FITS) file is opened with
+            ``astropy.io.fits.open(path, memmap=True)``, so the data is only
+            read from disk when accessed.
+
+        Returns
+        -------
+        str or astropy.io.fits.HDUList
+            The ``path`` of the file, or the opened file if ``memmap`` is
+            ``True``.
+        """
+        try:
+            url = getattr(self, self.product_urls[product])
+        except KeyError:
+            msg = "Unknown product {!r}, must be one of {}"
+            raise ValueError(msg.format(product, list(self.product_urls)))
+
+        download_file(url.format(job=self), path, transport=self.transport)
+        if memmap:
+            from astropy.io import fits
+
+            return fits.open(path, memmap=True)
+        return path
+
+    def download_new_fits_file(self, path, memmap=False):
+        """
+        Download the new fits file (original file + new header) directly to
+        disk. See :py:meth:`download`.
+        """
+        return self.download("new_fits_file", path, memmap=memmap)
+
+    @ensure_status_success
+    @cache_product
     def rdls_file(self):
-        return fits_file_request(self.rdls_file_url.format(job=self))
+        from astropy.io import fits
+
+        return fits.HDUList(file=self._product("rdls_file", self.rdls_file_url))
 
     @ensure_status_success
-    @cache_response
+    @cache_product
     def axy_file(self):
-        return fits_file_request(self.axy_file_url.format(job=self))
+        from astropy.io import fits
+
+        return fits.HDUList(file=self._product("axy_file", self.axy_file_url))
 
     @ensure_status_success
-    @cache_response
+    @cache_product
     def corr_file(self):
-        return fits_file_request(self.corr_file_url.format(job=self))
+        from astropy.io import fits
+
+        return fits.HDUList(file=self._product("corr_file", self.corr_file_url))
 
     @ensure_status_success
-    @cache_response
+    @cache_product
     def annotated_display(self):
         """
         JPEG image as a binary string.
@@ -522,10 +764,10 @@ class Job(Statusable):
         -------
         bytes
         """
-        return file_request(self.annotated_display_url.format(job=self))
+        return self._product("annotated_display", self.annotated_display_url)
 
     @ensure_status_success
-    @cache_response
+    @cache_product
     def red_green_image_display(self):
         """
         PNG image as a binary string
@@ -534,10 +776,12 @@ class Job(Statusable):
         -------
         bytes
         """
-        return file_request(self.red_green_image_display_url.format(job=self))
+        return self._product(
+            "red_green_image_display", self.red_green_image_display_url
+        )
 
     @ensure_status_success
-    @cache_response
+    @cache_product
     def extraction_image_display(self):
         """
         PNG image as a binary string
@@ -546,7 +790,22 @@ class Job(Statusable):
         -------
         bytes
         """
-        return file_request(self.extraction_image_display_url.format(job=self))
+        return self._product(
+            "extraction_image_display", self.extraction_image_display_url
+        )
+
+    def release(self, product=None):
+        """
+        Remove the results of this job from the :py:attr:`product_cache`, so
+        the memory can be freed (once they are no longer used elsewhere).
+
+        Parameters
+        ----------
+        product: str
+            Name of the result to remove, e.g. ``"new_fits_file"``. All results
+            are removed if not given.
+        """
+        self.product_cache.release(self.cache_key, product)
 
     def __repr__(self):
         return "Job({self.id})".format(self=self)
@@ -557,3 +816,149 @@ class Job(Statusable):
 
     def __hash__(self):
         return hash(self.id)
+
+
+class JobRegistry(object):
+    """
+    Identity map for :py:class:`Job` objects: :py:meth:`get` returns the same
+    Job object for the same job id, as long as it is in use somewhere.
+
+    This way the status and cached results (e.g. :py:meth:`Job.info` or
+    :py:meth:`Job.wcs_file`) of a job are shared by all its users, and are
+    not lost when a :py:class:`Submission` queries its status again. The jobs
+    are only weakly referenced, so unused jobs are freed as normal.
+
+    A registry is safe to use from multiple threads.
+
+    Parameters
+    ----------
+    transport: :py:class:`astrometry_net_client.transport.DirectTransport`
+        Transport given to the jobs created by the registry.
+    disk_cache: :py:class:`astrometry_net_client.cache.DiskCache`
+        Optional cache for the result files, given to the jobs created by
+        the registry.
+    product_cache: :py:class:`astrometry_net_client.cache.ProductCache`
+        Optional in-memory cache for the results, given to the jobs created
+        by the registry.
+    endpoint: :py:class:`astrometry_net_client.config.Endpoint`
+        The default endpoint of the jobs (can be given as its url), defaults
+        to nova.astrometry.net. Jobs of other endpoints are registered
+        separately, as their ids can be the same.
+
+    Examples
+    --------
+    >>> registry = JobRegistry()
+    >>> registry.get(1234) is registry.get(1234)
+    True
+    """
+
+    def __init__(
+        self, transport=None, disk_cache=None, product_cache=None, endpoint=None
+    ):
+        self.transport = transport
+        self.disk_cache = disk_cache
+        self.product_cache = product_cache
+        self.endpoint = as_endpoint(endpoint)
+        self._jobs: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
+        self._lock = threading.Lock()
+
+    def _key(self, job_id, endpoint):
+        if endpoint == self.endpoint:
+            return job_id
+        return endpoint, job_id
+
+    def get(self, job_id, endpoint=None) -> "Job":
+        """
+        Return the job with the given id, creating it if it is not yet known.
+
+        Parameters
+        ----------
+        job_id: int
+            Identifier of the job.
+        endpoint: :py:class:`astrometry_net_client.config.Endpoint`
+            The endpoint of the job, defaults to the :py:attr:`endpoint` of
+            the registry.
+
+        Returns
+        -------
+        :py:class:`Job`
+        """
+        endpoint = self.endpoint if endpoint is None else as_endpoint(endpoint)
+        key = self._key(job_id, endpoint)
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None:
+                job = Job(
+                    job_id,
+                    transport=self.transport,
+                    disk_cache=self.disk_cache,
+                    product_cache=self.product_cache,
+                    endpoint=endpoint,
+                )
+                self._jobs[key] = job
+            return job
+
+    def add(self, job: "Job") -> "Job":
+        """
+        Register an existing job. If a job with the same id is already known,
+        that job is returned instead.
+
+        Returns
+        -------
+        :py:class:`Job`
+            The job which is registered for the id.
+        """
+        with self._lock:
+            return self._jobs.setdefault(self._key(job.id, job.endpoint), job)
+
+    def __contains__(self, job_id):
+        return job_id in self._jobs
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def __repr__(self):
+        return "JobRegistry(jobs={})".format(list(self._jobs.keys()))
+
+
+def bulk_status(statusables):
+    """
+    Query the status of many submissions and jobs, using as few requests as
+    possible.
+
+    The submissions are queried first. Jobs with a calibration in the
+    response of their submission are known to be successful, and get their
+    status from there. The other jobs, and the jobs which are not spawned by
+    any of the given submissions, fall back to their own status request. Jobs
+    which are already done are not queried again.
+
+    Parameters
+    ----------
+    statusables: iterable
+        The :py:class:`Submission` and :py:class:`Job` objects to update.
+
+    Examples
+    --------
+    >>> jobs = [Job(job_id) for job_id in job_ids]
+    >>> bulk_status(submissions + jobs)
+    >>> finished = [job for job in jobs if job.done()]
+    """
+    statusables = list(statusables)
+
+    known = {}
+    for submission in statusables:
+        if isinstance(submission, Submission):
+            submission.status()
+            known.update(
+                ((job.endpoint, job.id), job) for job in getattr(submission, "jobs", [])
+            )
+
+    for job in statusables:
+        if not isinstance(job, Job) or job.done():
+            continue
+        other = known.get((job.endpoint, job.id))
+        if other is not None and other is not job and other.done():
+            job._update_status(other.stat_response)
+        else:
+            job.status()
+            known[job.endpoint, job.id] = job
@@ -0,0 +1,483 @@
+import functools
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Iterable, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from astrometry_net_client.exceptions import ExhaustedAttemptsException
+from astrometry_net_client.ratelimit import POLLS, UPLOADS, RateLimiter
+
+log = logging.getLogger(__name__)
+
+# Default size of the connection pool, matches the default queue size of the
+# client (see :py:const:`astrometry_net_client.client.MAX_WORKERS`)
+POOL_SIZE = 10
+
+# Statuses after which the server did not process the request, so any
+# request can be retried
+REFUSED_STATUS = {429, 503}
+
+# Statuses after which idempotent requests (e.g. GET) are retried
+TRANSIENT_STATUS = REFUSED_STATUS | {500, 502, 504}
+
+
+def retry_after(response) -> Optional[float]:
+    """
+    The time (in seconds) to wait according to the ``Retry-After`` header of
+    the response (either a number of seconds or a date), or ``None`` if it is
+    not given (or invalid).
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy(object):
+    """
+    Policy to retry requests which failed because of a transient error, used
+    by a :py:class:`DirectTransport` (and :py:class:`Transport`).
+
+    Idempotent requests (GET requests, like status queries and downloads of
+    results, and the login) are retried after a connection error, a timeout
+    or one of the statuses 429, 500, 502, 503 and 504. Other requests (i.e.
+    uploads) are only retried when it is certain the server did not process
+    them: after a timeout while connecting, or the statuses 429 (too many
+    requests) and 503 (unavailable). A request body which is a stream is
+    rewound (``seek(0)``) before sending it again, requests with a stream
+    which cannot be rewound are never retried.
+
+    The time between the attempts uses "decorrelated jitter": a random time
+    between ``base`` and three times the previous wait, at most ``cap``
+    seconds. When the server sends a ``Retry-After`` header, that time is
+    waited instead.
+
+    Parameters
+    ----------
+    attempts: int
+        Maximum number of attempts of a request (including the first one). A
+        value of 1 disables retrying.
+    base: float
+        Minimal time (in seconds) between two attempts.
+    cap: float
+        Maximal time (in seconds) between two attempts (unless the server
+        asks for longer, using ``Retry-After``).
+    deadline: float
+        Optional maximal total time (in seconds) spent on a request,
+        including the waits.
+
+    Attributes
+    ----------
+    retries: int
+        Total number of retried requests.
+    exhausted: int
+        Number of requests which failed after all attempts.
+    reasons: collections.Counter
+        Number of retries per reason (status code or exception name).
+
+    Raises
+    ------
+    :py:exc:`astrometry_net_client.exceptions.ExhaustedAttemptsException`
+        When a request still fails after the last attempt (or the deadline).
+        The last response (if any) is available in its ``response``
+        attribute.
+
+    Examples
+    --------
+    >>> transport = Transport(retry=RetryPolicy(attempts=8, cap=120))
+    >>> client = Client(api_key="XXXXX", transport=transport)
+    """
+
+    def __init__(
+        self,
+        attempts: int = 5,
+        base: float = 1.0,
+        cap: float = 60.0,
+        deadline: Optional[float] = None,
+    ):
+        if attempts < 1:
+            raise ValueError("attempts must be greater than 0")
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.deadline = deadline
+
+        self.retries = 0
+        self.exhausted = 0
+        self.reasons: Counter = Counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _rewindable(body) -> bool:
+        if body is None or isinstance(body, (bytes, str, dict, list, tuple)):
+            return True
+        return callable(getattr(body, "seek", None))
+
+    def call(self, send: Callable, idempotent: bool = True, body=None):
+        """
+        Call ``send`` (which sends the request and returns the response),
+        retrying it according to the policy.
+
+        Parameters
+        ----------
+        send: callable
+            Function without arguments, which sends the request.
+        idempotent: bool
+            Whether the request can safely be sent more than once.
+        body: object
+            The body of the request, which is rewound before a retry if it
+            is a stream.
+
+        Returns
+        -------
+        requests.Response
+            The response of the last attempt.
+        """
+        if self.attempts == 1 or not self._rewindable(body):
+            return send()
+
+        statuses = TRANSIENT_STATUS if idempotent else REFUSED_STATUS
+        if idempotent:
+            errors = (requests.ConnectionError, requests.Timeout)
+        else:
+            errors = (requests.exceptions.ConnectTimeout,)  # type: ignore
+
+        start = time.monotonic()
+        wait = self.base
+        for attempt in range(1, self.attempts + 1):
+            try:
+                response, error = send(), None
+            except errors as e:
+                response, error = None, e
+                reason = type(e).__name__
+            else:
+                if response.status_code not in statuses:
+                    return response
+                reason = str(response.status_code)
+
+            wait = min(self.cap, random.uniform(self.base, wait * 3))
+            if response is not None and response.status_code in REFUSED_STATUS:
+                wait = retry_after(response) or wait
+            elapsed = time.monotonic() - start
+            if attempt == self.attempts or (
+                self.deadline is not None and elapsed + wait > self.deadline
+            ):
+                break
+
+            log.info(
+                "Request failed ({}), attempt {} of {}, retrying in {:.1f}s".format(
+                    reason, attempt, self.attempts, wait
+                )
+            )
+            with self._lock:
+                self.retries += 1
+                self.reasons[reason] += 1
+            if response is not None:
+                response.close()
+            time.sleep(wait)
+            if callable(getattr(body, "seek", None)):
+                body.seek(0)
+
+        with self._lock:
+            self.exhausted += 1
+        exception = ExhaustedAttemptsException(
+            "Request failed ({}) after {} attempts".format(reason, attempt)
+        )
+        exception.response = response  # type: ignore
+        raise exception from error
+
+    def __repr__(self):
+        msg = "RetryPolicy(attempts={}, base={}, cap={}, retries={}, exhausted={})"
+        return msg.format(
+            self.attempts, self.base, self.cap, self.retries, self.exhausted
+        )
+
+
+class DirectTransport(object):
+    """
+    Transport which sends every request with the module level functions of
+    the requests library (``requests.get`` / ``requests.post``). Every
+    request therefore opens a new connection.
+
+    The functions are looked up at the moment the request is sent, so they
+    can be replaced (monkeypatched) in the test cases.
+
+    This is the transport used by a :py:class:`Request` when no transport is
+    specified.
+
+    Parameters
+    ----------
+    parallelism: int
+        Maximum number of requests made at the same time by
+        :py:meth:`run_all` (e.g. the status queries of the jobs of a
+        submission). The default of 1 makes them one after the other.
+    retry: :py:class:`RetryPolicy`
+        Policy to retry requests after transient errors. Defaults to a
+        :py:class:`RetryPolicy` with the default settings, use
+        ``RetryPolicy(attempts=1)`` to disable retrying.
+    limiter: :py:class:`astrometry_net_client.ratelimit.RateLimiter`
+        Limits the rate of the requests (including the retries), per category
+        of request. GET requests are ``"polls"`` and POST requests
+        ``"uploads"``, unless another ``category`` is given. Not limited by
+        default.
+    """
+
+    def __init__(
+        self,
+        parallelism: int = 1,
+        retry: Optional[RetryPolicy] = None,
+        limiter: Optional[RateLimiter] = None,
+    ):
+        if parallelism < 1:
+            raise ValueError("parallelism must be greater than 0")
+        self.parallelism = parallelism
+        self.retry = RetryPolicy() if retry is None else retry
+        self.limiter = limiter
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """
+        Thread pool of size :py:attr:`parallelism` used by :py:meth:`run_all`,
+        created on first use.
+        """
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        self.parallelism, thread_name_prefix="anc-transport"
+                    )
+        return self._executor
+
+    def run_all(self, func: Callable, items: Iterable) -> List:
+        """
+        Call ``func`` for each of the items, with up to :py:attr:`parallelism`
+        calls at the same time.
+
+        All calls are finished, even if some of them fail. Afterwards the
+        exception of the first failed call (in the order of ``items``) is
+        raised.
+
+        Parameters
+        ----------
+        func: callable
+            Function taking a single item, e.g. a function making a request.
+        items: iterable
+            The arguments for ``func``.
+
+        Returns
+        -------
+        list
+            The results of ``func``, in the same order as ``items``.
+        """
+        items = list(items)
+        results: List = []
+        errors: List[Exception] = []
+
+        calls: List[Callable[[], Any]]
+        if self.parallelism == 1 or len(items) <= 1:
+            calls = [functools.partial(func, item) for item in items]
+        else:
+            futures = [self.executor.submit(func, item) for item in items]
+            calls = [future.result for future in futures]
+
+        for call in calls:
+            try:
+                results.append(call())
+            except Exception as e:
+                results.append(None)
+                errors.append(e)
+
+        if errors:
+            log.debug("{} of {} calls failed".format(len(errors), len(items)))
+            raise errors[0]
+        return results
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        return getattr(requests, method)(url, **kwargs)
+
+    def _limited_send(
+        self, limiter: RateLimiter, category: str, method: str, url: str, **kwargs
+    ):
+        limiter.acquire(category)
+        return self._send(method, url, **kwargs)
+
+    def _request(
+        self, method: str, url: str, idempotent: bool, category: str, **kwargs
+    ) -> requests.Response:
+        if self.limiter is None:
+            send = functools.partial(self._send, method, url, **kwargs)
+        else:
+            send = functools.partial(
+                self._limited_send, self.limiter, category, method, url, **kwargs
+            )
+        return self.retry.call(send, idempotent=idempotent, body=kwargs.get("data"))
+
+    def get(self, url: str, category: str = POLLS, **kwargs) -> requests.Response:
+        """
+        Send a GET request to ``url``, retried according to the
+        :py:attr:`retry` policy and limited by the :py:attr:`limiter` as a
+        request of the given ``category``. Keyword arguments are passed to the
+        underlying requests call.
+        """
+        return self._request("get", url, True, category, **kwargs)
+
+    def post(
+        self, url: str, idempotent: bool = False, category: str = UPLOADS, **kwargs
+    ) -> requests.Response:
+        """
+        Send a POST request to ``url``, limited by the :py:attr:`limiter` as a
+        request of the given ``category``. Keyword arguments are passed to the
+        underlying requests call. The request is only retried when the server
+        did not process it, unless it is ``idempotent`` (see
+        :py:class:`RetryPolicy`).
+        """
+        return self._request("post", url, idempotent, category, **kwargs)
+
+    def close(self) -> None:
+        """
+        Release the resources held by this transport (the thread pool of
+        :py:meth:`run_all`).
+        """
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def __repr__(self):
+        return "{}()".format(self.__class__.__name__)
+
+
+class Transport(DirectTransport):
+    """
+    Transport which sends requests over a pool of keep-alive connections,
+    using a single ``requests.Session``. Reusing the connections avoids the
+    TCP (and TLS) setup for each status query, login or file download.
+
+    A transport can be shared between threads. It is typically owned by a
+    :py:class:`astrometry_net_client.session.Session` or
+    :py:class:`astrometry_net_client.client.Client`, and passed along to all
+    requests, jobs and submissions created by them.
+
+    Parameters
+    ----------
+    pool_connections: int
+        Number of connection pools to cache, one pool per host.
+    pool_maxsize: int
+        Maximum number of connections kept alive per host. Should be at least
+        the number of threads which use this transport simultaneously.
+    pool_block: bool
+        If ``True``, a request waits for a free connection when all
+        ``pool_maxsize`` connections of the host are in use. Otherwise an
+        extra connection is made, which is not returned to the pool.
+    keep_alive: bool
+        If ``False``, connections are closed after each request (sends the
+        ``Connection: close`` header).
+    parallelism: int
+        Maximum number of requests made at the same time by
+        :py:meth:`run_all`. Defaults to ``pool_maxsize``.
+    retry: :py:class:`RetryPolicy`
+        Policy to retry requests after transient errors, see
+        :py:class:`DirectTransport`.
+    limiter: :py:class:`astrometry_net_client.ratelimit.RateLimiter`
+        Limits the rate of the requests, see :py:class:`DirectTransport`.
+
+    Examples
+    --------
+    >>> transport = Transport(pool_maxsize=20)
+    >>> session = Session(api_key='XXXXX', transport=transport)
+    >>> job = Job(1234, transport=transport)
+    """
+
+    def __init__(
+        self,
+        pool_connections: int = POOL_SIZE,
+        pool_maxsize: int = POOL_SIZE,
+        pool_block: bool = False,
+        keep_alive: bool = True,
+        parallelism: Optional[int] = None,
+        retry: Optional[RetryPolicy] = None,
+        limiter: Optional[RateLimiter] = None,
+    ):
+        if pool_connections < 1 or pool_maxsize < 1:
+            raise ValueError("Pool sizes must be greater than 0")
+        super().__init__(
+            pool_maxsize if parallelism is None else parallelism,
+            retry=retry,
+            limiter=limiter,
+        )
+
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+
+        self._http: Optional[requests.Session] = None
+        self._lock = threading.Lock()
+
+    @property
+    def http(self) -> requests.Session:
+        """
+        The underlying ``requests.Session``, created on first use.
+        """
+        if self._http is None:
+            with self._lock:
+                if self._http is None:
+                    self._http = self._create_http()
+        return self._http
+
+    def _create_http(self) -> requests.Session:
+        log.debug("Creating connection pool of size {}".format(self.pool_maxsize))
+        http = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+        )
+        http.mount("http://", adapter)
+        http.mount("https://", adapter)
+        if not self.keep_alive:
+            http.headers["Connection"] = "close"
+        return http
+
+    def _send(self, method: str, url: str, **kwargs) -> requests.Response:
+        return getattr(self.http, method)(url, **kwargs)
+
+    def close(self) -> None:
+        """
+        Close all pooled connections and the thread pool. The transport can
+        still be used afterwards, in which case a new pool is created.
+        """
+        super().close()
+        with self._lock:
+            if self._http is not None:
+                self._http.close()
+                self._http = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        msg = "Transport(pool_connections={}, pool_maxsize={}, keep_alive={})"
+        return msg.format(self.pool_connections, self.pool_maxsize, self.keep_alive)
+
+
+default_transport = DirectTransport()
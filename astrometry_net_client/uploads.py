@@ -1,10 +1,38 @@
 import abc
-from typing import Union, cast
-
-from astrometry_net_client.config import upload_url, url_upload_url
-from astrometry_net_client.request import PostRequest
+import bisect
+import io
+import logging
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Union,
+    cast,
+)
+
+from astrometry_net_client.multipart import MultipartEncoder
+from astrometry_net_client.request import FITS_BLOCK_SIZE, PostRequest
 from astrometry_net_client.session import SessionRequest
-from astrometry_net_client.statusables import Submission
+from astrometry_net_client.settings import Settings
+from astrometry_net_client.statusables import JobRegistry, Submission
+from astrometry_net_client.transport import DirectTransport
+
+# astropy and numpy are only imported when a FITS file is actually read or
+# written, as they are slow to import
+if TYPE_CHECKING:
+    import numpy as np
+    from astropy.io import fits
+
+    from astrometry_net_client.preprocess import Preprocessor, Reduction
+
+log = logging.getLogger(__name__)
+
+# Number of bytes of pixel data converted at once by the HDUListReader
+CHUNK_SIZE = 2**16
 
 
 class Submitter(abc.ABC):
@@ -20,15 +48,23 @@ class Submitter(abc.ABC):
     >>> submission = upl.submit()
     """
 
+    # Transport of the request, also used by the resulting submission
+    transport: DirectTransport
+
     @abc.abstractmethod
     def make(self) -> Union[dict, bytes]:
         pass
 
-    def submit(self) -> Submission:
+    def submit(self, registry: Optional[JobRegistry] = None) -> Submission:
         """
         Submit function, similar to ``make`` but in addition creates and
         returns the resulting submission.
 
+        Parameters
+        ----------
+        registry: :py:class:`astrometry_net_client.statusables.JobRegistry`
+            Optional registry used by the submission for its jobs.
+
         Returns
         -------
         :py:class:`astrometry_net_client.statusables.Submission`
@@ -36,7 +72,16 @@ class Submitter(abc.ABC):
             status & result(s) of your upload.
         """
         response = cast(dict, self.make())
-        return Submission(response["subid"])
+        submission = Submission(
+            response["subid"],
+            transport=self.transport,
+            registry=registry,
+            reduction=getattr(self, "reduction", None),
+            endpoint=getattr(getattr(self, "session", None), "endpoint", None),
+        )
+        submission.upload_latency = getattr(self, "latency", None)
+        submission.upload_size = getattr(self, "size", None)
+        return submission
 
 
 class BaseUpload(SessionRequest, PostRequest, Submitter):
@@ -52,9 +97,105 @@ class BaseUpload(SessionRequest, PostRequest, Submitter):
     default post request and authorization)
 
     Meant as an abstact/base class, not to be called directly.
+
+    Uploads which send files (see :py:meth:`_files`) stream the request body
+    with a :py:class:`astrometry_net_client.multipart.MultipartEncoder`, so
+    the files are read from disk in small chunks while sending, instead of
+    being loaded into memory.
+
+    Parameters
+    ----------
+    progress: callable
+        Optional function called as ``progress(bytes_sent, total)`` while the
+        files are uploaded.
+    preprocess: :py:class:`astrometry_net_client.preprocess.Preprocessor`
+        Optional preprocessor which reduces the uploaded image. The settings
+        of the upload are adjusted to the reduced image.
+
+    The upload is sent to the endpoint of the session (see
+    :py:class:`astrometry_net_client.config.Endpoint`), the resulting
+    submission and its jobs are queried at the same endpoint.
+
+    Attributes
+    ----------
+    reduction: :py:class:`astrometry_net_client.preprocess.Reduction`
+        The reduction of the uploaded image (when it is uploaded with a
+        ``preprocess``). Passed on to the resulting submission and its jobs.
     """
 
-    pass
+    # Attribute of the endpoint with the url of the upload
+    endpoint_url: str = "upload_url"
+
+    def __init__(
+        self,
+        *args,
+        progress: Optional[Callable[[int, int], None]] = None,
+        preprocess: Optional["Preprocessor"] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.url = getattr(self.session.endpoint, self.endpoint_url)
+        self.progress = progress
+        self.preprocess = preprocess
+        self.reduction: Optional["Reduction"] = None
+        self._size = 0
+
+    @property
+    def latency(self) -> Optional[float]:
+        """
+        Time (in seconds) of the HTTP request of the last upload, from sending
+        it until the response arrived. Waits for a rate limit (see
+        :py:class:`astrometry_net_client.ratelimit.RateLimiter`) and earlier
+        failed attempts are not included. ``None`` if it is not known.
+        """
+        response = getattr(self, "original_response", None)
+        elapsed = getattr(response, "elapsed", None)
+        if elapsed is None or self._size == 0:
+            return None
+        return elapsed.total_seconds()
+
+    @property
+    def size(self) -> Optional[int]:
+        """
+        Size (in bytes) of the request body of the last upload, ``None`` if
+        nothing was uploaded yet.
+        """
+        return self._size or None
+
+    def _reduce(self, data) -> IO[bytes]:
+        """
+        Reduce the image ``data`` (array or HDUList) using the
+        :py:attr:`preprocess`, and return the file to upload instead. The
+        image is only reduced once, also when the request is made again.
+        """
+        if self.preprocess is None:
+            raise ValueError("Cannot reduce the image without a preprocess")
+        if self.reduction is None:
+            self.reduction = self.preprocess.reduce(data)
+            self.settings = self.reduction.adjust_settings(self.settings)
+        return self.reduction.fileobj()
+
+    def _files(self) -> Dict[str, Tuple[str, IO[bytes]]]:
+        """
+        The files to upload, mapping the form field name to a
+        ``(filename, fileobj)`` tuple. None by default.
+        """
+        return {}
+
+    def _payload(self):
+        # The files first, as a reduction of the image changes the settings
+        files = self._files()
+        payload = super()._payload()
+        if not files:
+            self._size = len(payload["request-json"]) if payload else 0
+            return payload
+
+        encoder = MultipartEncoder(payload, files, callback=self.progress)
+        self._size = len(encoder)
+        headers = dict(self.arguments.get("headers", {}))
+        headers["Content-Type"] = encoder.content_type
+        self.arguments["headers"] = headers
+        return encoder
 
 
 class FileUpload(BaseUpload):
@@ -83,6 +224,9 @@ class FileUpload(BaseUpload):
         The login session (required by the
         :py:class:`astrometry_net_client.request.AuthorizedRequest`
         class)
+    progress : callable
+        Optional function called as ``progress(bytes_sent, total)`` while
+        the file is uploaded.
 
     Returns
     -------
@@ -90,17 +234,26 @@ class FileUpload(BaseUpload):
         The submission object, which is created when you upload a file.
     """
 
-    url: str = upload_url
-
     def __init__(self, filename: str, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # TODO check if file exists?
         # TODO check if file has the correct type
         self.filename = filename
 
+    def _files(self):
+        # Start from the beginning, also when the request is made again
+        self._file.seek(0)
+        fileobj = self._file
+        if self.preprocess is not None:
+            from astropy.io import fits
+
+            with fits.open(self._file) as hdulist:
+                fileobj = self._reduce(hdulist)
+        return {"file": (self.filename, fileobj)}
+
     def _make_request(self) -> dict:
         with open(self.filename, "rb") as f:
-            self.arguments["files"] = {"file": f}
+            self._file = f
             response = super()._make_request()
         return response
 
@@ -109,6 +262,294 @@ class FileUpload(BaseUpload):
         return msg.format(self.filename, self.session)
 
 
+class HDUListReader(object):
+    """
+    Read-only, seekable file-like object which serialises an
+    ``astropy.io.fits.HDUList`` to the FITS format while it is read.
+
+    The headers are serialised up front, but the pixel data is converted (to
+    the big endian FITS representation) in chunks of ``chunk_size`` bytes,
+    only when read. Therefore no copy of the complete data is made.
+
+    This is possible for image HDUs with numeric data. Other HDUs (e.g.
+    tables) are written to memory completely using astropy, as a fallback.
+
+    Parameters
+    ----------
+    hdulist: astropy.io.fits.HDUList
+        The FITS file to serialise. Must not be changed while reading.
+    chunk_size: int
+        Maximal number of data bytes which are converted at once.
+    """
+
+    def __init__(self, hdulist: "fits.HDUList", chunk_size: int = CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._segments: List[Union[bytes, "np.ndarray"]] = []
+        self._offsets: List[int] = []
+        self._length = 0
+        self._position = 0
+
+        if self._streamable(hdulist):
+            for hdu in hdulist:
+                self._add_hdu(hdu)
+        else:
+            log.debug("Cannot stream {}, serialising it in memory".format(hdulist))
+            buffer = io.BytesIO()
+            hdulist.writeto(buffer)
+            self._add(buffer.getvalue())
+
+    @staticmethod
+    def _streamable(hdulist) -> bool:
+        from astropy.io import fits
+
+        if len(hdulist) == 0 or not isinstance(hdulist[0], fits.PrimaryHDU):
+            return False
+        for i, hdu in enumerate(hdulist):
+            if i > 0 and type(hdu) is not fits.ImageHDU:
+                return False
+            data = hdu.data
+            if data is None:
+                continue
+            kind, itemsize = data.dtype.kind, data.dtype.itemsize
+            # Types without a FITS equivalent are converted by astropy
+            if kind not in "iuf" or (itemsize == 1 and kind != "u"):
+                return False
+            # Scaled data (other than unsigned integers) is rescaled by astropy
+            scaled = "BSCALE" in hdu.header or "BZERO" in hdu.header
+            if scaled and not (kind == "u" and itemsize > 1):
+                return False
+        return True
+
+    def _add(self, segment):
+        # Segments are either bytes or (pixel data) arrays
+        size = len(segment) if isinstance(segment, bytes) else segment.nbytes
+        if size == 0:
+            return
+        self._segments.append(segment)
+        self._offsets.append(self._length)
+        self._length += size
+
+    def _add_hdu(self, hdu):
+        hdu.update_header()
+        self._add(hdu.header.tostring().encode("ascii"))
+        data = hdu.data
+        if data is None:
+            return
+        self._add(data)
+        remainder = data.nbytes % FITS_BLOCK_SIZE
+        if remainder:
+            self._add(bytes(FITS_BLOCK_SIZE - remainder))
+
+    def _convert(self, data: "np.ndarray", start: int, stop: int) -> bytes:
+        """
+        FITS representation of the elements ``start:stop`` of ``data``.
+        """
+        import numpy as np
+
+        chunk = np.asarray(data.flat[start:stop])
+        if chunk.dtype.kind == "u" and chunk.dtype.itemsize > 1:
+            # Stored as signed integers, with BZERO = 2 ** (bits - 1)
+            bits = chunk.dtype.itemsize * 8
+            unsigned = chunk.dtype.newbyteorder("=")
+            chunk = chunk.astype(unsigned) ^ unsigned.type(1 << (bits - 1))
+            chunk = chunk.view("i{}".format(chunk.dtype.itemsize))
+        return chunk.astype(chunk.dtype.newbyteorder(">"), copy=False).tobytes()
+
+    def _read_segment(self, index: int, offset: int, size: int) -> bytes:
+        segment = self._segments[index]
+        if isinstance(segment, bytes):
+            return segment[offset : offset + size]
+
+        itemsize = segment.dtype.itemsize
+        size = min(size, self.chunk_size)
+        start = offset // itemsize
+        stop = min(-(-(offset + size) // itemsize), segment.size)
+        data = self._convert(segment, start, stop)
+        skip = offset - start * itemsize
+        return data[skip : skip + size]
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Read at most ``size`` bytes (at most ``chunk_size`` bytes of pixel
+        data) from the current position.
+        """
+        if size is None or size < 0:
+            size = self._length - self._position
+        chunks = []
+        while size > 0 and self._position < self._length:
+            index = bisect.bisect_right(self._offsets, self._position) - 1
+            offset = self._position - self._offsets[index]
+            chunk = self._read_segment(index, offset, size)
+            chunks.append(chunk)
+            self._position += len(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._length
+        self._position = max(0, offset)
+        return self._position
+
+    def __len__(self):
+        return self._length
+
+    def __repr__(self):
+        return "HDUListReader(length={}, position={})".format(
+            self._length, self._position
+        )
+
+
+class MemoryUpload(BaseUpload):
+    """
+    Extends from :py:class:`BaseUpload`
+
+    Base class for uploads of a file which is already in memory, sent without
+    writing it to disk first. Subclasses provide the file object to upload
+    (see :py:meth:`_fileobj`).
+
+    Meant as an abstact/base class, not to be called directly.
+
+    Parameters
+    ----------
+    session : :py:class:`astrometry_net_client.session.Session`
+        The login session.
+    filename : str
+        Name of the file, as it is shown by Astrometry.net.
+    """
+
+    def __init__(self, *args, filename: str = "upload.fits", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.filename = filename
+
+    @abc.abstractmethod
+    def _fileobj(self) -> IO[bytes]:
+        """
+        The (possibly reduced) file to upload, read from the start.
+        """
+
+    def _files(self):
+        return {"file": (self.filename, self._fileobj())}
+
+    def __repr__(self):
+        msg = "{}(filename={}, session={})"
+        return msg.format(self.__class__.__name__, self.filename, self.session)
+
+
+class BytesUpload(MemoryUpload):
+    """
+    Extends from :py:class:`MemoryUpload`
+
+    Uploads a file which is already in memory (e.g. the contents of a FITS or
+    JPEG file), without writing it to disk first. The data is not copied.
+
+    Example
+    -------
+    >>> upl = BytesUpload(fits_bytes, session=s, filename='image.fits')
+    >>> submission = upl.submit()
+
+    Parameters
+    ----------
+    data : bytes
+        The contents of the file.
+    session : :py:class:`astrometry_net_client.session.Session`
+        The login session.
+    filename : str
+        Name of the file, as it is shown by Astrometry.net.
+    """
+
+    def __init__(self, data: bytes, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.content = data
+
+    def _fileobj(self) -> IO[bytes]:
+        # A BytesIO of a bytes object shares its memory
+        fileobj = io.BytesIO(self.content)
+        if self.preprocess is not None:
+            from astropy.io import fits
+
+            with fits.open(fileobj) as hdulist:
+                return self._reduce(hdulist)
+        return fileobj
+
+
+class HDUListUpload(MemoryUpload):
+    """
+    Extends from :py:class:`MemoryUpload`
+
+    Uploads an ``astropy.io.fits.HDUList``, without writing it to disk first.
+    The FITS file is serialised while it is sent (see
+    :py:class:`HDUListReader`), so no copy of the pixel data is made.
+
+    Example
+    -------
+    >>> hdul = fits.open('image.fits')
+    >>> upl = HDUListUpload(hdul, session=s)
+    >>> submission = upl.submit()
+
+    Parameters
+    ----------
+    hdulist : astropy.io.fits.HDUList
+        The FITS file to upload. Must not be changed during the upload.
+    session : :py:class:`astrometry_net_client.session.Session`
+        The login session.
+    filename : str
+        Name of the file, as it is shown by Astrometry.net.
+    """
+
+    def __init__(self, hdulist: "fits.HDUList", *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.hdulist = hdulist
+
+    def _fileobj(self) -> IO[bytes]:
+        if self.preprocess is not None:
+            return self._reduce(self.hdulist)
+        return cast(IO[bytes], HDUListReader(self.hdulist))
+
+
+class ArrayUpload(HDUListUpload):
+    """
+    Extends from :py:class:`HDUListUpload`
+
+    Uploads an image given as a 2D ``numpy`` array, as a FITS file with a
+    single (primary) HDU. The array is not copied.
+
+    Example
+    -------
+    >>> upl = ArrayUpload(image, session=s, header=header)
+    >>> submission = upl.submit()
+
+    Parameters
+    ----------
+    array : numpy.ndarray
+        The image data.
+    session : :py:class:`astrometry_net_client.session.Session`
+        The login session.
+    header : astropy.io.fits.Header
+        Optional header of the FITS file.
+    filename : str
+        Name of the file, as it is shown by Astrometry.net.
+    """
+
+    def __init__(
+        self,
+        array: "np.ndarray",
+        *args,
+        header: Optional["fits.Header"] = None,
+        **kwargs,
+    ):
+        from astropy.io import fits
+
+        hdulist = fits.HDUList([fits.PrimaryHDU(array, header=header)])
+        super().__init__(hdulist, *args, **kwargs)
+        self.array = array
+
+
 class URLUpload(BaseUpload):
     """
     Extends from :py:class:`BaseUpload`
@@ -142,7 +583,7 @@ class URLUpload(BaseUpload):
         The submission object, which is created when you upload a file.
     """
 
-    url: str = url_upload_url
+    endpoint_url: str = "url_upload_url"
 
     def __init__(self, url_to_upload: str, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -162,8 +603,73 @@ class SourcesUpload(BaseUpload):
     """
     Extends from :py:class:`BaseUpload`
 
-    Class for uploading a list of sources. (inspired by astroquery
-    implementation)
+    Class for uploading a list of sources (an "xylist") instead of an image,
+    which is orders of magnitude less data. The sources can be found with
+    :py:func:`astrometry_net_client.sources.extract_sources`. (inspired by
+    astroquery implementation)
+
+    The sources are sent as a FITS table with the columns ``X``, ``Y`` (1
+    based pixel coordinates, as in FITS) and ``FLUX``. The size of the image
+    is required, given as arguments or the ``image_width`` and
+    ``image_height`` settings.
+
+    Example
+    -------
+    >>> sources = extract_sources(image)
+    >>> upl = SourcesUpload(sources, session=s, image_width=2048, image_height=1024)
+    >>> submission = upl.submit()
+
+    Parameters
+    ----------
+    sources : numpy.ndarray
+        Structured array with (at least) the fields ``x`` and ``y`` (0 based
+        pixel coordinates, see
+        :py:data:`astrometry_net_client.sources.SOURCE_DTYPE`), and optionally
+        ``flux``. Sorted by decreasing brightness.
+    session : :py:class:`astrometry_net_client.session.Session`
+        The login session.
+    image_width, image_height : int
+        Size of the image (in pixels) of the sources.
     """
 
-    # TODO: Decide if this is necessary
+    def __init__(
+        self,
+        sources: "np.ndarray",
+        *args,
+        image_width: Optional[int] = None,
+        image_height: Optional[int] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.sources = sources
+        self.settings = Settings(self.settings)
+        if image_width is not None:
+            self.settings["image_width"] = int(image_width)
+        if image_height is not None:
+            self.settings["image_height"] = int(image_height)
+        if "image_width" not in self.settings or "image_height" not in self.settings:
+            raise ValueError("The image_width and image_height are required")
+
+    def _table(self) -> "fits.HDUList":
+        from astropy.io import fits
+
+        columns = [
+            fits.Column(name="X", format="D", array=self.sources["x"] + 1),
+            fits.Column(name="Y", format="D", array=self.sources["y"] + 1),
+        ]
+        if "flux" in (self.sources.dtype.names or ()):
+            columns.append(
+                fits.Column(name="FLUX", format="D", array=self.sources["flux"])
+            )
+        table = fits.BinTableHDU.from_columns(columns)
+        return fits.HDUList([fits.PrimaryHDU(), table])
+
+    def _files(self):
+        buffer = io.BytesIO()
+        self._table().writeto(buffer)
+        buffer.seek(0)
+        return {"file": ("sources.xyls", buffer)}
+
+    def __repr__(self):
+        msg = "SourcesUpload(sources={}, session={})"
+        return msg.format(len(self.sources), self.session)
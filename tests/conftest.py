@@ -8,8 +8,10 @@ from astropy.io import fits
 from constants import (
     FAILED_SUBMISSION_RESULT,
     FILE,
+    FITS_FILE,
     JOB_FAILED_INFO,
     JOB_SUCCESS_INFO,
+    MULTI_JOB_SUBMISSION_RESULT,
     STATUS_FAILURE,
     STATUS_SUCCESS,
     SUCCESS_SUBMISSION_RESULT,
@@ -18,10 +20,12 @@ from constants import (
     VALID_KEY,
     VALID_TOKEN,
     WAITING_SUBMISSION_RESULT,
+    WCS_FILE,
 )
-from mocked_server import MockServer, ResponseObj
+from mocked_server import MockServer, ResponseObj, parse_multipart
 
 from astrometry_net_client import Job, Submission
+from astrometry_net_client.cache import default_product_cache
 
 
 class MockGetRequest:
@@ -37,6 +41,28 @@ class MockGetRequest:
         return ResponseObj(self._response, self.headers, self.status_code)
 
 
+class MockRangeRequest(MockGetRequest):
+    """
+    Serves a file, supporting the HTTP Range header (single range only).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ranges = []
+
+    def __call__(self, url, *args, headers=None, **kwargs):
+        byte_range = (headers or {}).get("Range")
+        if byte_range is None:
+            return super().__call__(url, *args, **kwargs)
+
+        first, last = byte_range[len("bytes=") :].split("-")
+        self.ranges.append((int(first), int(last)))
+        if int(first) >= len(self._response):
+            return ResponseObj(b"", self.headers, 416)
+        content = self._response[int(first) : int(last) + 1]
+        return ResponseObj(content, self.headers, 206)
+
+
 class MockSessionChecker:
     def __call__(self, url, data, **kwargs):
         payload = json.loads(data["request-json"])
@@ -69,17 +95,22 @@ class MockDelayedRequest(MockGetRequest):
 
 
 class MockUpload:
-    def __call__(self, url, data, **kwargs):
-        payload = json.loads(data["request-json"])
+    # Contents of the last uploaded file
+    last_upload = None
+
+    def __call__(self, url, data, headers=None, **kwargs):
+        assert "files" not in kwargs
+        fields = parse_multipart(data, headers)
+        upload_file = fields["file"]
+        MockUpload.last_upload = upload_file
+
+        payload = json.loads(fields["request-json"])
         if payload["session"] != VALID_TOKEN:
             # TODO: use correct error message
             return ResponseObj(
                 {"status": "error", "errormessage": "no session with key"}
             )
 
-        upload_file = kwargs["files"]["file"]
-        print(upload_file)
-
         request_hdul = fits.HDUList(file=upload_file)
         with open(FILE, "rb") as reffile:
             reference_hdul = fits.HDUList(file=reffile)
@@ -116,6 +147,17 @@ class MockURLUpload:
         )
 
 
+FITS_HEADERS = {"Content-Type": "application/fits"}
+
+
+@pytest.fixture(autouse=True)
+def clear_product_cache():
+    # Results of jobs with the same id are shared between the tests otherwise
+    default_product_cache.clear()
+    yield
+    default_product_cache.clear()
+
+
 # Submissions
 @pytest.fixture
 def mock_server(monkeypatch):
@@ -126,6 +168,7 @@ def mock_server(monkeypatch):
             content=SUCCESS_SUBMISSION_RESULT_2,
             wait_content=WAITING_SUBMISSION_RESULT,
         ),
+        "/api/submissions/3": MockGetRequest(MULTI_JOB_SUBMISSION_RESULT),
         "/api/jobs/0": MockGetRequest(STATUS_FAILURE),
         "/api/jobs/1": MockGetRequest(STATUS_SUCCESS),
         "/api/jobs/2": MockDelayedRequest(STATUS_SUCCESS),
@@ -136,6 +179,11 @@ def mock_server(monkeypatch):
         "/api/jobs/1/info": MockGetRequest(JOB_SUCCESS_INFO),
         "/api/jobs/4819815/info": MockGetRequest(JOB_FAILED_INFO),
         "/api/jobs/4489363/info": MockGetRequest(JOB_SUCCESS_INFO),
+        "/wcs_file/": MockGetRequest(WCS_FILE, headers=FITS_HEADERS),
+        "/new_fits_file/": MockRangeRequest(FITS_FILE, headers=FITS_HEADERS),
+        "/annotated_display/": MockGetRequest(
+            b"jpeg", headers={"Content-Type": "image/jpeg"}
+        ),
     }
 
     post_mapper = {
@@ -148,6 +196,10 @@ def mock_server(monkeypatch):
 
     monkeypatch.setattr(requests, "get", svr.get)
     monkeypatch.setattr(requests, "post", svr.post)
+    # Also catch requests made through a pooled Transport. The bound methods
+    # are not rebound to the requests.Session instance.
+    monkeypatch.setattr(requests.Session, "get", svr.get)
+    monkeypatch.setattr(requests.Session, "post", svr.post)
 
 
 # Online fixtures
@@ -1,3 +1,8 @@
+import io
+
+import numpy as np
+from astropy.io import fits
+
 VALID_KEY = "valid key"
 VALID_TOKEN = "the session token/key"
 
@@ -41,6 +46,16 @@ SUCCESS_SUBMISSION_RESULT = {
     "job_calibrations": [[4489363, 3030589]],
 }
 
+MULTI_JOB_SUBMISSION_RESULT = {
+    "user": 19291,
+    "processing_started": "2020-08-20 21:39:18.078664",
+    "processing_finished": "2020-08-20 21:39:23.751193",
+    "user_images": [3923714, 3923715, 3923716],
+    "images": [9000296, 9000297, 9000298],
+    "jobs": [0, 1, 4489363],
+    "job_calibrations": [[4489363, 3030589]],
+}
+
 FAILED_SUBMISSION_RESULT = {
     "user": 19291,
     "processing_started": "2020-12-26 12:54:38.285579",
@@ -73,3 +88,16 @@ JOB_SUCCESS_INFO = {
         "parity": 1.0,
     },
 }
+
+WCS_HEADER = fits.Header({"WCSAXES": 2, "CRPIX1": 12.5, "CRPIX2": 20.5})
+WCS_FILE = WCS_HEADER.tostring().encode()
+
+
+def _fits_file():
+    data = np.arange(3000, dtype=">i2").reshape(60, 50)
+    buffer = io.BytesIO()
+    fits.PrimaryHDU(data, header=WCS_HEADER).writeto(buffer)
+    return buffer.getvalue()
+
+
+FITS_FILE = _fits_file()
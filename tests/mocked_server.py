@@ -1,6 +1,31 @@
+from email.parser import BytesParser
+
 from requests.exceptions import HTTPError
 
 
+def parse_multipart(data, headers):
+    """
+    Read a (streamed) multipart/form-data body (or bytes), as a dictionary mapping the
+    field names to their (binary) values.
+    """
+    if isinstance(data, bytes):
+        body = data
+    else:
+        # Read in blocks, the same way http.client sends a file-like body
+        body = b"".join(iter(lambda: data.read(8192), b""))
+        assert len(body) == len(data)
+    message = BytesParser().parsebytes(
+        b"Content-Type: " + headers["Content-Type"].encode() + b"\r\n\r\n" + body
+    )
+    assert message.is_multipart()
+    return {
+        part.get_param("name", header="content-disposition"): part.get_payload(
+            decode=True
+        )
+        for part in message.get_payload()
+    }
+
+
 class ResponseObj:
     _DEFAULT_HEADER = {"Content-Type": "text/plain"}
 
@@ -9,6 +34,17 @@ class ResponseObj:
         self.headers = headers
         self.status_code = status_code
 
+    @property
+    def content(self):
+        return self._content
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self._content), chunk_size):
+            yield self._content[start : start + chunk_size]
+
+    def close(self):
+        pass
+
     def text(self):
         return str(self._content)
 
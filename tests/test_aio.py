@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+from constants import FILE, FITS_FILE, VALID_KEY
+
+from astrometry_net_client import (
+    AsyncClient,
+    AsyncJob,
+    AsyncSession,
+    AsyncSubmission,
+    aio,
+)
+from astrometry_net_client.exceptions import (
+    LoginFailedException,
+    StatusFailedException,
+)
+
+
+def test_async_session_login(mock_server):
+    session = AsyncSession(api_key=VALID_KEY)
+
+    async def login_many():
+        await asyncio.gather(*[session.login() for _ in range(5)])
+
+    asyncio.run(login_many())
+    assert session.logged_in
+    assert session.key
+
+    with pytest.raises(LoginFailedException):
+        asyncio.run(AsyncSession(api_key="invalid_key").login())
+
+
+def test_async_job(mock_server):
+    async def run():
+        job = AsyncJob(2)
+        assert not job.done()
+        await job.until_done(start=0.01)
+        assert job.done()
+        assert job.success()
+        assert job.resp_status == "success"
+
+        failed = AsyncJob(0)
+        await failed.status()
+        assert failed.done()
+        assert not failed.success()
+        info = await failed.info()
+        assert info["status"] == "failure"
+        with pytest.raises(StatusFailedException):
+            await failed.wcs_file()
+
+    asyncio.run(run())
+
+
+def test_async_job_download(mock_server, tmp_path):
+    path = str(tmp_path / "new.fits")
+    result = asyncio.run(AsyncJob(1).download_new_fits_file(path))
+    assert result == path
+    with open(path, "rb") as f:
+        assert f.read() == FITS_FILE
+
+
+def test_async_job_timeout(mock_server):
+    with pytest.raises(TimeoutError):
+        asyncio.run(AsyncJob(3).until_done(start=0.01, timeout=0.05))
+
+
+def test_async_submission(mock_server):
+    async def run():
+        submission = AsyncSubmission(2)
+        await submission.until_done(start=0.01)
+        assert submission.done()
+        assert [job.id for job in submission.jobs] == [2]
+        assert isinstance(submission.jobs[0], AsyncJob)
+
+    asyncio.run(run())
+
+
+def test_async_default_transport():
+    # Without a transport, all jobs and submissions share the default one
+    transport = AsyncJob(1).transport
+    assert transport is aio._default_transport
+    assert AsyncJob(2).transport is transport
+    assert AsyncSubmission(1).transport is transport
+
+
+def test_async_client_upload_files(mock_server):
+    async def run():
+        client = AsyncClient(api_key=VALID_KEY)
+        results = []
+        async for job, filename in client.upload_files(
+            [FILE] * 5, queue_size=3, start=0.01
+        ):
+            results.append((job, filename))
+        client.close()
+        return results
+
+    results = asyncio.run(run())
+    assert len(results) == 5
+    for job, filename in results:
+        assert filename == FILE
+        assert job.done()
+        assert job.success()
+
+
+def test_async_client_upload_files_lazy(mock_server):
+    taken = []
+
+    def files():
+        for i in range(6):
+            taken.append(i)
+            yield FILE
+
+    async def run():
+        client = AsyncClient(api_key=VALID_KEY)
+        consumed = []
+        async for _ in client.upload_files(files(), queue_size=2, start=0.01):
+            consumed.append(len(taken))
+        client.close()
+        return consumed
+
+    consumed = asyncio.run(run())
+    assert len(consumed) == 6
+    # Files are only taken from the iterable when there is room for them
+    assert consumed[0] <= 2
@@ -0,0 +1,148 @@
+import gc
+import os
+
+import requests
+from astropy.io import fits
+from constants import WCS_FILE, WCS_HEADER
+from utils import function_called_raiser
+
+from astrometry_net_client import Job
+from astrometry_net_client.cache import DiskCache, ProductCache, sizeof
+
+
+def test_disk_cache(tmp_path):
+    cache = DiskCache(str(tmp_path), max_size=100)
+    assert cache.get(1, "wcs_file") is None
+    assert cache.misses == 1
+
+    cache.put(1, "wcs_file", b"a" * 40)
+    assert (1, "wcs_file") in cache
+    assert cache.get(1, "wcs_file") == b"a" * 40
+    assert cache.hits == 1
+
+    # No temporary files are left behind
+    assert not [f for _, _, files in os.walk(tmp_path) for f in files if ".tmp" in f]
+
+    # Too large to be cached at all
+    cache.put(2, "new_fits_file", b"b" * 101)
+    assert (2, "new_fits_file") not in cache
+
+    # Make the first entry the least recently used one
+    path = cache._path(1, "wcs_file")
+    os.utime(path, (0, 0))
+    cache.put(3, "wcs_file", b"c" * 40)
+    cache.put(4, "wcs_file", b"d" * 40)
+
+    assert (1, "wcs_file") not in cache
+    assert (3, "wcs_file") in cache
+    assert (4, "wcs_file") in cache
+    assert cache.size() <= 100
+
+    # A new cache object (e.g. in a new process) uses the same files
+    other = DiskCache(str(tmp_path), max_size=100)
+    assert other.get(4, "wcs_file") == b"d" * 40
+
+    cache.clear()
+    assert cache.size() == 0
+
+
+def test_disk_cache_evicted_while_read(tmp_path, monkeypatch):
+    cache = DiskCache(str(tmp_path))
+    cache.put(1, "wcs_file", b"a" * 40)
+
+    def evicted(path):
+        raise FileNotFoundError(path)
+
+    # Removed by another process between the read and marking it as used
+    monkeypatch.setattr(os, "utime", evicted)
+    assert cache.get(1, "wcs_file") == b"a" * 40
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_disk_cache_shared_size(tmp_path):
+    first = DiskCache(str(tmp_path), max_size=100)
+    second = DiskCache(str(tmp_path), max_size=100)
+
+    # Replacing a result does not count its size twice
+    for _ in range(5):
+        first.put(1, "wcs_file", b"a" * 40)
+    assert (1, "wcs_file") in first
+
+    # The writes of another object (process) are included in the total
+    os.utime(first._path(1, "wcs_file"), (0, 0))
+    second.put(2, "wcs_file", b"b" * 40)
+    first.put(3, "wcs_file", b"c" * 40)
+    assert (1, "wcs_file") not in first
+    assert first.size() == 80
+
+
+def test_job_disk_cache(mock_server, tmp_path, monkeypatch):
+    cache = DiskCache(str(tmp_path))
+    job = Job(1, disk_cache=cache)
+    wcs = job.wcs_file()
+    assert wcs["CRPIX1"] == WCS_HEADER["CRPIX1"]
+    assert cache.misses == 1
+
+    # A new job object (with an empty memory cache) reads the result from
+    # the disk cache, not from the server
+    new_job = Job(1, disk_cache=cache, product_cache=ProductCache())
+    new_job.status()
+    monkeypatch.setattr(requests, "get", function_called_raiser)
+    assert new_job.wcs_file() == wcs
+    assert cache.hits == 1
+
+
+def test_product_cache():
+    cache = ProductCache(max_size=100)
+    assert cache.get(1, "annotated_display") is None
+    assert cache.misses == 1
+
+    cache.put(1, "annotated_display", b"a" * 60)
+    assert cache.get(1, "annotated_display") == b"a" * 60
+    assert cache.hits == 1
+
+    # Evicts the least recently used entry, bytes are not kept at all
+    cache.put(2, "annotated_display", b"b" * 60)
+    assert (1, "annotated_display") not in cache
+    assert cache.size() == 60
+
+    cache.release(2)
+    assert len(cache) == 0
+    assert cache.size() == 0
+
+
+def test_product_cache_weak(tmp_path):
+    header = fits.Header.fromstring(WCS_FILE)
+    size = sizeof(header)
+    cache = ProductCache(max_size=size)
+
+    cache.put(1, "wcs_file", header)
+    cache.put(2, "wcs_file", fits.Header.fromstring(WCS_FILE))
+    assert cache.size() == size
+
+    # Evicted, but still in use: the same object is returned
+    assert cache.get(1, "wcs_file") is header
+    # Which pushed out the other one, which is not used anymore
+    gc.collect()
+    assert (2, "wcs_file") not in cache
+
+    # Released entries are not returned, even if still in use
+    cache.release(1, "wcs_file")
+    assert cache.get(1, "wcs_file") is None
+
+
+def test_job_product_cache(mock_server, monkeypatch):
+    cache = ProductCache()
+    job = Job(1, product_cache=cache)
+    wcs = job.wcs_file()
+    assert (1, "wcs_file") in cache
+    assert not hasattr(job, "_wcs_file_result")
+
+    # Jobs with the same id share the results
+    other = Job(1, product_cache=cache)
+    other.status()
+    monkeypatch.setattr(requests, "get", function_called_raiser)
+    assert other.wcs_file() is wcs
+
+    job.release()
+    assert (1, "wcs_file") not in cache
@@ -1,11 +1,19 @@
+import io
 import os
 from unittest import mock
 
 import pytest
+import requests
+from astropy.io import fits
+from conftest import MockUpload
 from constants import FILE, VALID_KEY
 
-from astrometry_net_client import Client, Session, Settings
+from astrometry_net_client import Client, Session, SessionPool, Settings
 from astrometry_net_client.exceptions import LoginFailedException
+from astrometry_net_client.index import UploadIndex, file_hash
+from astrometry_net_client.pipeline import AdaptiveLimit
+from astrometry_net_client.transport import DirectTransport
+from astrometry_net_client.uploads import FileUpload
 
 some_key = "somekey"
 
@@ -64,3 +72,169 @@ def test_client_upload_multiple(mock_server):
         assert filename == FILE
         assert job.done()
         assert job.success()
+
+
+def test_client_run_batch(mock_server):
+    client = Client(api_key=VALID_KEY)
+    fetched = []
+    results, stats = client.run_batch(
+        [FILE] * 4, queue_size=2, fetch=fetched.append, start=0.01
+    )
+
+    assert len(results) == 4
+    assert all(job.success() for job, _ in results)
+    assert len(fetched) == 4
+    assert stats.finished == 4
+    assert stats["upload"].count == 4
+    assert stats["fetch"].count == 4
+    assert stats["poll"].count >= 4
+    assert stats["upload"].throughput > 0
+
+
+def test_client_concurrency(mock_server):
+    # Not capped by MAX_WORKERS anymore
+    client = Client(api_key=VALID_KEY)
+    results, stats = client.run_batch([FILE] * 2, queue_size=50, start=0.01)
+    assert stats.finished == 2
+    # Starts below the ceiling for nova.astrometry.net
+    assert client.concurrency.value == 5
+    assert client.concurrency.maximum == 10
+
+    limit = AdaptiveLimit(2, maximum=20)
+    client = Client(api_key=VALID_KEY, concurrency=limit)
+    results, stats = client.run_batch([FILE] * 4, start=0.01)
+    assert stats.finished == 4
+    # The mocked responses have no HTTP timing, so the limit does not adapt
+    assert limit.increases + limit.decreases == 0
+    assert limit.value == 2
+
+
+def test_client_endpoint(mock_server, monkeypatch, tmp_path):
+    endpoint = "https://astrometry.example.org"
+    urls = []
+
+    def redirect(func):
+        # Serve the requests to the endpoint with the mocked server
+        def send(url, *args, **kwargs):
+            urls.append(url)
+            url = url.replace(endpoint, "http://nova.astrometry.net")
+            return func(url, *args, **kwargs)
+
+        return send
+
+    for method in ("get", "post"):
+        monkeypatch.setattr(requests, method, redirect(getattr(requests, method)))
+
+    index = UploadIndex(str(tmp_path / "uploads.sqlite"))
+    client = Client(
+        api_key=VALID_KEY,
+        endpoint=endpoint,
+        journal=str(tmp_path / "journal"),
+        transport=DirectTransport(),
+        index=index,
+    )
+    results, _ = client.run_batch([FILE], start=0.01)
+    job, _ = results[0]
+    assert job.endpoint.url == endpoint
+    assert job.wcs_file() is not None
+    assert urls and all(url.startswith(endpoint) for url in urls)
+    assert client.journal.entries()[0].endpoint == endpoint
+    # No ceiling on the files in progress for other instances
+    assert client.concurrency.value == 10
+    assert client.concurrency.maximum is None
+
+    # The job is not found by clients of other instances sharing the index
+    assert index.get(file_hash(FILE), client.settings) is None
+    settings = dict(client.settings, endpoint=endpoint)
+    assert index.get(file_hash(FILE), settings).job_id == job.id
+
+    with pytest.raises(ValueError):
+        pool = SessionPool.from_endpoints([endpoint, "b.example.org"], api_key="key")
+        Client(session=pool, index=UploadIndex(str(tmp_path / "index")))
+
+
+def test_client_sources_mode(mock_server):
+    client = Client(api_key=VALID_KEY)
+    results, stats = client.run_batch([FILE] * 2, start=0.01, mode="sources")
+    client.close()
+
+    assert len(results) == 2
+    assert stats["upload"].count == 2
+    # Only the sources are uploaded, as a table
+    assert isinstance(
+        fits.open(io.BytesIO(MockUpload.last_upload))[1], fits.BinTableHDU
+    )
+
+    with pytest.raises(ValueError):
+        client.run_batch([FILE], mode="unknown")
+
+
+def test_client_index(mock_server, tmp_path):
+    index = UploadIndex(str(tmp_path / "uploads.sqlite"))
+    client = Client(api_key=VALID_KEY, index=index)
+    results, _ = client.run_batch([FILE], start=0.01)
+    job, _ = results[0]
+    assert index.get(file_hash(FILE), client.settings).job_id == job.id
+
+    # Solved before, so the file is not uploaded again
+    with mock.patch.object(FileUpload, "submit", side_effect=AssertionError):
+        results, stats = client.run_batch([FILE], start=0.01)
+        assert results[0][0] is job
+        assert client.upload_file(FILE) is job
+
+    # Not with other settings
+    other = Client(api_key=VALID_KEY, index=index, parity=2)
+    with mock.patch.object(FileUpload, "submit", side_effect=AssertionError):
+        with pytest.raises(AssertionError):
+            other.run_batch([FILE], start=0.01)
+
+    # A failed job is uploaded again
+    index.add(file_hash(FILE), client.settings, job_id=0)
+    results, _ = client.run_batch([FILE], start=0.01)
+    assert results[0][0].success()
+    assert index.get(file_hash(FILE), client.settings).job_id == results[0][0].id
+
+
+def test_client_index_pending(mock_server, tmp_path):
+    index = UploadIndex(str(tmp_path / "uploads.sqlite"))
+    client = Client(api_key=VALID_KEY, index=index)
+
+    # A failed upload leaves no pending index key behind
+    with mock.patch.object(FileUpload, "submit", side_effect=RuntimeError):
+        with pytest.raises(RuntimeError):
+            client.run_batch([FILE], start=0.01)
+    assert client._index_keys == {}
+
+    # The same file twice in a batch
+    results, _ = client.run_batch([FILE, FILE], start=0.01)
+    assert len(results) == 2
+    assert index.get(file_hash(FILE), client.settings).job_id == results[0][0].id
+    assert client._index_keys == {}
+
+
+def test_client_upload_multiple_error(mock_server):
+    client = Client(api_key=VALID_KEY)
+    jobs = client.upload_files_gen(["does/not/exist.fits"], start=0.01)
+    with pytest.raises(FileNotFoundError):
+        next(jobs)
+
+    with pytest.raises(ValueError):
+        next(client.upload_files_gen([FILE], queue_size=0))
+
+
+def test_client_registry(mock_server):
+    client = Client(api_key=VALID_KEY)
+    results, _ = client.run_batch([FILE], start=0.01)
+    job, _ = results[0]
+    assert client.get_job(job.id) is job
+
+
+@pytest.mark.long
+def test_client_upload_data(mock_server):
+    client = Client(api_key=VALID_KEY)
+
+    job = client.upload_data(fits.open(FILE))
+    assert job.success()
+
+    with pytest.raises(TypeError):
+        client.upload_data([[1, 2], [3, 4]])
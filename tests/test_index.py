@@ -0,0 +1,74 @@
+import io
+import threading
+
+from constants import FILE
+
+from astrometry_net_client.index import UploadIndex, file_hash, settings_hash
+
+
+def test_file_hash(tmp_path):
+    path = tmp_path / "file.fits"
+    path.write_bytes(b"a" * 1000)
+
+    # Hashing in chunks gives the same hash as hashing at once
+    assert file_hash(str(path), chunk_size=7) == file_hash(io.BytesIO(b"a" * 1000))
+    assert file_hash(path) != file_hash(io.BytesIO(b"b" * 1000))
+
+
+def test_settings_hash():
+    assert settings_hash({"parity": 2, "scale_est": 1.5}) == settings_hash(
+        {"scale_est": 1.5, "parity": 2}
+    )
+    assert settings_hash({"parity": 2}) != settings_hash({"parity": 1})
+    assert settings_hash(None) == settings_hash({})
+
+
+def test_upload_index(tmp_path):
+    index = UploadIndex(str(tmp_path / "index" / "uploads.sqlite"))
+    settings = {"parity": 2}
+    assert index.get("abc", settings) is None
+
+    index.add("abc", settings, submission_id=1, filename="a.fits")
+    entry = index.get("abc", settings)
+    assert (entry.submission_id, entry.job_id) == (1, None)
+    # Other settings are a different upload
+    assert index.get("abc", {"parity": 1}) is None
+
+    # The job is added to the existing entry
+    index.add("abc", settings, job_id=10)
+    entry = index.get("abc", settings)
+    assert (entry.submission_id, entry.job_id, entry.filename) == (1, 10, "a.fits")
+
+    # Persistent, also for a new object
+    assert UploadIndex(index.path).get("abc", settings) == entry
+
+    index.remove("abc", settings)
+    assert len(index) == 0
+
+
+def test_upload_index_warm(tmp_path):
+    index = UploadIndex(str(tmp_path / "uploads.sqlite"))
+    assert index.warm([(FILE, 5)], settings={"parity": 2}) == 1
+
+    assert index.lookup_file(FILE, {"parity": 2}).job_id == 5
+    assert [entry.filename for entry in index.entries()] == [FILE]
+
+    index.clear()
+    assert len(index) == 0
+
+
+def test_upload_index_threads(tmp_path):
+    index = UploadIndex(str(tmp_path / "uploads.sqlite"))
+
+    def add(start):
+        for i in range(start, start + 25):
+            index.add(str(i), job_id=i)
+            assert index.get(str(i)).job_id == i
+
+    threads = [threading.Thread(target=add, args=(i * 25,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(index) == 100
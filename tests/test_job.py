@@ -1,12 +1,22 @@
+import io
+import os
+
+import numpy as np
 import pytest
 import requests
+from astropy.io import fits
+from conftest import MockGetRequest, MockRangeRequest
+from constants import FITS_FILE, WCS_HEADER
+from mocked_server import ResponseObj
 from utils import function_called_raiser
 
 from astrometry_net_client import Job
 from astrometry_net_client.exceptions import (
     StatusFailedException,
     StillProcessingException,
+    UnkownContentError,
 )
+from astrometry_net_client.request import download_file, fits_header_request
 
 
 @pytest.mark.mocked
@@ -101,3 +111,109 @@ def test_job_timeout(mock_server):
     with pytest.raises(TimeoutError):
         # timeout after two queries
         job_2.until_done(start=1, end=1, timeout=2)
+
+
+@pytest.mark.mocked
+def test_mocked_job_download(mock_server, tmp_path):
+    job = Job(1)
+    path = str(tmp_path / "new.fits")
+
+    assert job.download_new_fits_file(path) == path
+    with open(path, "rb") as f:
+        assert f.read() == FITS_FILE
+    assert [p.name for p in tmp_path.iterdir()] == ["new.fits"]
+    # Same permissions as a file created with open()
+    with open(str(tmp_path / "reference"), "wb"):
+        pass
+    mode = os.stat(str(tmp_path / "reference")).st_mode
+    assert os.stat(path).st_mode == mode
+    os.remove(str(tmp_path / "reference"))
+
+    hdul = job.download("new_fits_file", path, memmap=True)
+    assert hdul[0].header["CRPIX1"] == WCS_HEADER["CRPIX1"]
+    assert hdul[0].data.shape == (60, 50)
+    hdul.close()
+
+    with pytest.raises(ValueError):
+        job.download("unknown", path)
+
+
+@pytest.mark.mocked
+def test_mocked_job_download_chunks(mock_server, tmp_path):
+    path = str(tmp_path / "display.jpg")
+    url = Job.annotated_display_url.format(job=Job(1))
+    download_file(url, path, chunk_size=3)
+    with open(path, "rb") as f:
+        assert f.read() == b"jpeg"
+
+    # Not a file: nothing is written
+    with pytest.raises(UnkownContentError):
+        download_file(Job(1).url, str(tmp_path / "status"))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["display.jpg"]
+
+
+@pytest.mark.mocked
+def test_mocked_job_new_fits_header(mock_server, monkeypatch):
+    header = Job(1).new_fits_header()
+    assert header["CRPIX1"] == WCS_HEADER["CRPIX1"]
+    assert header["NAXIS1"] == 50
+
+
+def _long_fits_file():
+    hdu = fits.PrimaryHDU(np.zeros((200, 200), dtype=">i2"))
+    for i in range(300):
+        hdu.header.add_history("history card {}".format(i))
+    buffer = io.BytesIO()
+    hdu.writeto(buffer)
+    return hdu.header, buffer.getvalue()
+
+
+@pytest.mark.mocked
+def test_mocked_fits_header_request(monkeypatch):
+    header, content = _long_fits_file()
+    header_size = len(header.tostring())
+    url = "http://nova.astrometry.net/new_fits_file/1"
+
+    # Server supporting range requests
+    server = MockRangeRequest(content, headers={"Content-Type": "application/fits"})
+    monkeypatch.setattr(requests, "get", server)
+    result = fits_header_request(url, blocks=1)
+    assert result == header
+    assert server.ranges[0] == (0, 2879)
+    assert server.ranges[-1][1] < 2 * header_size < len(content)
+    assert len(server.ranges) > 1
+
+    # Server without range requests, only reads the header
+    read = []
+
+    def stream(*args, **kwargs):
+        response = ResponseObj(content, {"Content-Type": "application/fits"})
+        chunks = response.iter_content
+
+        def iter_content(chunk_size=1):
+            for chunk in chunks(chunk_size):
+                read.append(len(chunk))
+                yield chunk
+
+        response.iter_content = iter_content
+        return response
+
+    monkeypatch.setattr(requests, "get", stream)
+    assert fits_header_request(url) == header
+    assert sum(read) == header_size
+
+    # Not a FITS file
+    monkeypatch.setattr(
+        requests,
+        "get",
+        MockGetRequest(b"x" * 3000, headers={"Content-Type": "application/fits"}),
+    )
+    with pytest.raises(UnkownContentError):
+        fits_header_request(url)
+
+    # Not a FITS file, which ends exactly on a requested range
+    server = MockRangeRequest(b"x" * 2880, headers={"Content-Type": "application/fits"})
+    monkeypatch.setattr(requests, "get", server)
+    with pytest.raises(UnkownContentError):
+        fits_header_request(url, blocks=1)
+    assert server.ranges == [(0, 2879), (2880, 8639)]
@@ -0,0 +1,108 @@
+from unittest import mock
+
+import pytest
+from constants import FILE, VALID_KEY
+
+from astrometry_net_client import Client
+from astrometry_net_client.journal import FAILURE, RUNNING, SUBMITTED, Journal
+from astrometry_net_client.uploads import FileUpload
+
+
+def test_journal(tmp_path):
+    path = str(tmp_path / "batch.journal")
+    with Journal(path) as journal:
+        journal.submitted("a.fits", 10)
+        journal.submitted("b.fits", 11)
+        journal.job("a.fits", 100, submission_id=10)
+        journal.finished("a.fits", 100, success=False)
+        # An earlier job, reused without a submission
+        journal.job("c.fits", 200)
+
+    entries = Journal(path).entries()
+    assert [(e.filename, e.submission_id, e.job_id, e.status) for e in entries] == [
+        ("a.fits", 10, 100, FAILURE),
+        ("b.fits", 11, None, SUBMITTED),
+        ("c.fits", None, 200, RUNNING),
+    ]
+    assert [e.filename for e in Journal(path).outstanding()] == ["b.fits", "c.fits"]
+
+
+def test_journal_endpoints(tmp_path):
+    with Journal(str(tmp_path / "batch.journal")) as journal:
+        journal.submitted("a.fits", 10, endpoint="https://a.example.org")
+        journal.submitted("b.fits", 10, endpoint="https://b.example.org")
+        journal.job("a.fits", 100, submission_id=10, endpoint="https://a.example.org")
+        journal.finished("a.fits", 100, True, endpoint="https://a.example.org")
+
+        # Same ids, but different uploads
+        (entry,) = journal.outstanding()
+        assert entry.filename == "b.fits"
+        assert entry.endpoint == "https://b.example.org"
+        assert entry.status == SUBMITTED
+
+
+def test_journal_truncated(tmp_path):
+    path = tmp_path / "batch.journal"
+    with Journal(str(path)) as journal:
+        journal.submitted("a.fits", 10)
+    # Crash in the middle of writing a record
+    with open(path, "ab") as f:
+        f.write(b'{"event": "subm')
+
+    with Journal(str(path)) as journal:
+        journal.submitted("b.fits", 11)
+        assert [e.submission_id for e in journal.entries()] == [10, 11]
+
+
+def test_client_journal(mock_server, tmp_path):
+    path = str(tmp_path / "batch.journal")
+    client = Client(api_key=VALID_KEY, journal=path)
+    results, _ = client.run_batch([FILE], start=0.01)
+    client.close()
+
+    (entry,) = Journal(path).entries()
+    assert entry.finished
+    assert (entry.filename, entry.job_id) == (FILE, results[0][0].id)
+
+
+def test_client_resume(mock_server, tmp_path):
+    path = str(tmp_path / "batch.journal")
+    with Journal(path) as journal:
+        journal.submitted("a.fits", 1)
+        journal.submitted("b.fits", 2)
+        journal.job("b.fits", 2, submission_id=2)
+        journal.submitted("c.fits", 3)
+        journal.job("c.fits", 4489363, submission_id=3)
+        journal.finished("c.fits", 4489363, success=True)
+
+    client = Client(api_key=VALID_KEY)
+    with pytest.raises(ValueError):
+        next(client.resume())
+
+    # The outstanding uploads are polled, nothing is uploaded again
+    with mock.patch.object(FileUpload, "submit", side_effect=AssertionError):
+        results = dict(
+            (filename, job) for job, filename in client.resume(path, start=0.01)
+        )
+    client.close()
+
+    assert set(results) == {"a.fits", "b.fits"}
+    assert results["a.fits"].id == 4489363
+    assert results["b.fits"].id == 2
+    assert Journal(path).outstanding() == []
+
+
+def test_client_journal_ownership(mock_server, tmp_path):
+    given = Journal(str(tmp_path / "given.journal"))
+    client = Client(api_key=VALID_KEY, journal=str(tmp_path / "own.journal"))
+    opened = client.journal
+
+    # The journal opened by the client is closed when it is replaced
+    list(client.resume(given))
+    assert opened._file.closed
+    assert client.journal is given
+
+    # A given journal is not closed by the client
+    client.close()
+    assert not given._file.closed
+    given.close()
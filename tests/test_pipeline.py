@@ -0,0 +1,145 @@
+import threading
+import time
+
+import pytest
+
+from astrometry_net_client.pipeline import AdaptiveLimit, UploadPipeline
+from astrometry_net_client.statusables import Job, Submission
+from astrometry_net_client.transport import RetryPolicy
+
+
+def test_adaptive_limit_aimd():
+    limit = AdaptiveLimit(4, minimum=2, maximum=6)
+    assert limit.value == 4
+    for _ in range(20):
+        limit.record(1.0)
+    # Increases by about one per round of `value` uploads, up to the ceiling
+    assert limit.value == 6
+    assert limit.decreases == 0
+
+    # Much slower than the lowest recent latency
+    before = time.monotonic()
+    limit.record(3.0)
+    assert limit.value == 3
+    assert limit.decreases == 1
+    # Started before the decrease, ignored
+    limit.record(5.0, start=before)
+    assert limit.value == 3
+    assert limit.ignored == 1
+
+    # A new lowest latency, then a slow one which started after the decrease
+    limit.record(0.001, start=time.monotonic())
+    limit.record(0.005, start=time.monotonic())
+    assert limit.value == 2  # the floor
+    assert limit.decreases == 2
+
+
+def test_adaptive_limit_sizes():
+    # Constant server speed: a fixed cost per request and a cost per byte
+    limit = AdaptiveLimit(4, maximum=8)
+    for _ in range(20):
+        for size in (1000, 10**7):
+            limit.record(0.05 + size / 10**7, size=size)
+    assert limit.decreases == 0
+    assert limit.value == 8
+
+    # Similar sizes are compared
+    limit.record(0.05 + 1.2 * 10**7 / 10**7, size=int(1.2 * 10**7))
+    assert limit.decreases == 0
+    limit.record(3 * (0.05 + 1000 / 10**7), size=1000)
+    assert limit.decreases == 1
+
+
+def test_adaptive_limit_kinds():
+    limit = AdaptiveLimit(4)
+    limit.record(1.0, kind="solve")
+    limit.record(1.0, kind="solve")
+    # Only uploads increase the limit
+    assert limit.increases == 0
+    # Not slower by more than the resolution
+    limit.record(3.0, kind="solve", resolution=1.5)
+    assert limit.decreases == 0
+    limit.record(3.0, kind="solve")
+    assert limit.decreases == 1
+    assert limit.value == 2
+
+
+def test_adaptive_limit_retries():
+    retry = RetryPolicy()
+    limit = AdaptiveLimit(8)
+    limit.watch(retry)
+    limit.record(1.0)
+    assert limit.decreases == 0
+
+    retry.retries += 1
+    limit.record(0.001)
+    assert limit.value == 4
+    assert limit.decreases == 1
+
+
+def test_adaptive_limit_invalid():
+    with pytest.raises(ValueError):
+        AdaptiveLimit(4, minimum=0)
+    with pytest.raises(ValueError):
+        AdaptiveLimit(4, minimum=5, maximum=2)
+    with pytest.raises(ValueError):
+        AdaptiveLimit(4, decrease=1)
+    assert AdaptiveLimit(20, maximum=5).value == 5
+    assert AdaptiveLimit.fixed(3).value == 3
+
+
+def test_pipeline_respects_limit(mock_server):
+    limit = AdaptiveLimit.fixed(2)
+    lock = threading.Lock()
+    counts = {"in_flight": 0, "max": 0}
+
+    def submit(filename):
+        with lock:
+            counts["in_flight"] += 1
+            counts["max"] = max(counts["max"], counts["in_flight"])
+        return Job(1)
+
+    def fetch(job):
+        with lock:
+            counts["in_flight"] -= 1
+
+    pipeline = UploadPipeline(submit, limit, fetch=fetch, upload_workers=4, start=0.01)
+    results = list(pipeline.run(range(6)))
+    assert len(results) == 6
+    assert counts["max"] <= 2
+
+
+def test_pipeline_records_upload_latency(mock_server):
+    limit = AdaptiveLimit(4, maximum=8)
+    latencies = iter([1e-6, 1e-6, 1e-5, None])
+
+    def submit(filename):
+        submission = Submission(2)
+        submission.upload_latency = next(latencies)
+        return submission
+
+    pipeline = UploadPipeline(submit, limit, upload_workers=1, start=0.01)
+    results = list(pipeline.run(range(4)))
+    assert len(results) == 4
+    # The slow upload decreases the limit, without a latency nothing is recorded
+    assert (limit.increases, limit.decreases) == (2, 1)
+
+
+def test_pipeline_records_poll_stages(mock_server):
+    recorded = []
+
+    class RecordingLimit(AdaptiveLimit):
+        def record(self, latency, **kwargs):
+            recorded.append((kwargs.get("kind", "upload"), kwargs.get("size")))
+
+    def submit(filename):
+        if filename == 0:
+            return Job(1)  # e.g. from the index, not recorded
+        submission = Submission(2)
+        submission.upload_latency = 0.1
+        submission.upload_size = 1000
+        return submission
+
+    pipeline = UploadPipeline(submit, RecordingLimit(2), start=0.01)
+    assert len(list(pipeline.run(range(2)))) == 2
+    assert sorted(recorded) == [("queue", None), ("solve", None), ("upload", 1000)]
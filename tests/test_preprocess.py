@@ -0,0 +1,161 @@
+import io
+
+import numpy as np
+import pytest
+from astropy.io import fits
+from astropy.wcs import WCS
+from conftest import MockUpload
+from constants import FILE, VALID_KEY, WCS_HEADER
+
+from astrometry_net_client import FileUpload, Session, Settings, Submission
+from astrometry_net_client.preprocess import Preprocessor, bin_image, rescale
+
+
+def test_bin_image():
+    data = np.arange(7 * 5, dtype=">i2").reshape(7, 5)
+    binned = bin_image(data, 2)
+    assert binned.shape == (3, 2)
+    assert binned.dtype == np.float32
+    assert binned[0, 0] == np.mean([0, 1, 5, 6])
+    assert binned[2, 1] == np.mean([22, 23, 27, 28])
+
+
+def test_rescale():
+    data = np.linspace(-10, 10, 1000).reshape(20, 50)
+    data[0, 0] = np.nan
+    scaled = rescale(data, np.uint16, clip=(0, 100))
+    assert scaled.dtype == np.uint16
+    assert scaled[0, 0] == 0
+    assert scaled.max() == 65535
+    assert scaled[0, 1] == 0
+
+
+def test_reduce():
+    data = np.random.default_rng(1).normal(size=(100, 80)).astype(np.float64)
+    header = fits.Header({"OBJECT": "M31", "BZERO": 0, **WCS_HEADER})
+
+    reduction = Preprocessor(binning=2, crop=0.5, dtype="uint16").reduce(data, header)
+    assert reduction.offset == (20, 25)
+    assert reduction.shape == (25, 20)
+    assert reduction.original_shape == (100, 80)
+
+    hdu = fits.open(reduction.fileobj())[0]
+    assert hdu.data.dtype == np.uint16
+    assert hdu.data.shape == (25, 20)
+    assert hdu.header["OBJECT"] == "M31"
+    # The WCS of the original image no longer applies
+    assert "CRPIX1" not in hdu.header
+
+    # Compressed variants
+    gzipped = Preprocessor(compression="gzip", crop=(10, 10)).reduce(data)
+    assert gzipped.fileobj().read(2) == b"\x1f\x8b"
+    rice = Preprocessor(dtype="uint16", compression="rice").reduce(data)
+    with fits.open(rice.fileobj()) as hdulist:
+        assert isinstance(hdulist[1], fits.CompImageHDU)
+        assert np.array_equal(hdulist[1].data, rescale(data, np.uint16))
+
+    with pytest.raises(ValueError):
+        Preprocessor(dtype="float16")
+
+
+def test_adjust_settings():
+    data = np.zeros((100, 80))
+    reduction = Preprocessor(binning=4, crop=0.5).reduce(data)
+    settings = Settings(downsample_factor=2)
+    settings.set_scale_range(1, 2, unit="arcsecperpix")
+
+    adjusted = reduction.adjust_settings(settings)
+    assert adjusted["image_width"] == 10
+    assert adjusted["image_height"] == 12
+    assert adjusted["downsample_factor"] == 1
+    assert adjusted["scale_lower"] == 4
+    assert adjusted["scale_upper"] == 8
+    # The original is not changed
+    assert settings["scale_lower"] == 1
+
+    settings.set_scale_estimate(30, 10, unit="arcminwidth")
+    adjusted = reduction.adjust_settings(settings)
+    assert adjusted["scale_est"] == 15
+
+
+def test_restore_wcs_linear():
+    wcs = WCS(naxis=2)
+    wcs.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+    wcs.wcs.crval = [10, 20]
+    wcs.wcs.crpix = [50.3, 40.7]
+    wcs.wcs.cdelt = [-1e-4, 1e-4]
+    wcs.wcs.pc = [[0.9, 0.1], [-0.1, 0.9]]
+
+    reduction = Preprocessor(binning=3, crop=(60, 90)).reduce(np.zeros((80, 100)))
+    col, row = reduction.offset
+    # Independent reference: astropy slicing with a step (in numpy order)
+    reduced = wcs[row : row + 60 : 3, col : col + 90 : 3]
+    restored = WCS(reduction.restore_wcs(reduced.to_header()))
+
+    pixels = np.array([[1, 1], [20, 70], [99, 79]])
+    assert np.allclose(
+        restored.wcs_pix2world(pixels, 1), wcs.wcs_pix2world(pixels, 1), atol=1e-10
+    )
+
+
+def test_restore_wcs_sip():
+    header = fits.Header(
+        {
+            "CTYPE1": "RA---TAN-SIP",
+            "CTYPE2": "DEC--TAN-SIP",
+            "CRVAL1": 10.0,
+            "CRVAL2": 20.0,
+            "CRPIX1": 12.5,
+            "CRPIX2": 9.25,
+            "CD1_1": -3e-4,
+            "CD1_2": 1e-5,
+            "CD2_1": -2e-5,
+            "CD2_2": 3e-4,
+            "A_ORDER": 2,
+            "A_0_2": 1e-4,
+            "A_1_1": -2e-4,
+            "A_2_0": 3e-4,
+            "B_ORDER": 2,
+            "B_0_2": -1e-4,
+            "B_1_1": 2e-4,
+            "B_2_0": 1e-4,
+            "IMAGEW": 25,
+            "IMAGEH": 20,
+        }
+    )
+    reduction = Preprocessor(binning=4, crop=0.5).reduce(np.zeros((80, 100)))
+    reduced = WCS(header)
+    restored_header = reduction.restore_wcs(header)
+    restored = WCS(restored_header)
+    assert restored_header["IMAGEW"] == 100
+
+    # A reduced pixel corresponds to the center of its block in the original
+    reduced_pixels = np.array([[1.0, 1.0], [10.0, 3.0], [25.0, 20.0]])
+    col, row = reduction.offset
+    original_pixels = 4 * reduced_pixels + [col, row] - 1.5
+    assert np.allclose(
+        restored.all_pix2world(original_pixels, 1),
+        reduced.all_pix2world(reduced_pixels, 1),
+        atol=1e-10,
+    )
+
+
+def test_preprocess_upload(mock_server):
+    preprocess = Preprocessor(binning=2, dtype="uint8")
+    upl = FileUpload(FILE, Session(VALID_KEY), preprocess=preprocess)
+    submission = upl.submit()
+
+    with fits.open(FILE) as original:
+        shape = original[0].data.shape
+    uploaded = fits.open(io.BytesIO(MockUpload.last_upload))[0].data
+    assert uploaded.dtype == np.uint8
+    assert uploaded.shape == (shape[0] // 2, shape[1] // 2)
+    assert upl.settings["image_width"] == shape[1] // 2
+    assert submission.reduction is upl.reduction
+
+    # The WCS of the jobs is mapped to the original image
+    submission = Submission(1, reduction=upl.reduction)
+    submission.status()
+    job = submission.jobs[0]
+    assert job.reduction is upl.reduction
+    assert job.wcs_file()["CRPIX1"] == 2 * WCS_HEADER["CRPIX1"] - 0.5
@@ -0,0 +1,107 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from constants import JOB_SUCCESS_INFO
+from mocked_server import ResponseObj
+
+from astrometry_net_client.ratelimit import (
+    DOWNLOADS,
+    POLLS,
+    UPLOADS,
+    FileTokenBucket,
+    RateLimiter,
+    TokenBucket,
+)
+from astrometry_net_client.request import download_file, file_request
+from astrometry_net_client.statusables import Job
+from astrometry_net_client.transport import DirectTransport
+
+
+class RecordingBucket(TokenBucket):
+    def __init__(self, category, taken):
+        super().__init__(1000)
+        self.category = category
+        self.taken = taken
+
+    def acquire(self, tokens=1):
+        self.taken.append(self.category)
+        return super().acquire(tokens)
+
+
+class FileTransport(DirectTransport):
+    def _send(self, method, url, **kwargs):
+        if "files" in url:
+            return ResponseObj(b"SIMPLE", {"Content-Type": "application/fits"})
+        return ResponseObj(JOB_SUCCESS_INFO)
+
+
+def test_token_bucket_burst():
+    bucket = TokenBucket(rate=100, burst=2)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    # Empty, waits for a new token (1 / rate seconds)
+    assert bucket.acquire() == pytest.approx(0.01, abs=0.01)
+
+    with pytest.raises(ValueError):
+        bucket.acquire(3)
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0.1, burst=0.5)
+
+
+def test_file_token_bucket_shared(tmp_path):
+    path = str(tmp_path / "limits" / "uploads.bucket")
+    first = FileTokenBucket(path, rate=0.001, burst=2)
+    second = FileTokenBucket(path, rate=0.001, burst=2)
+    assert first._take(1) == 0
+    assert second._take(1) == 0
+    # Both used the same bucket, so it is empty now
+    assert first._take(1) > 0
+    assert second._take(1) > 0
+
+
+def _take_all(path):
+    bucket = FileTokenBucket(path, rate=0.001, burst=3)
+    return sum(bucket._take(1) == 0 for _ in range(3))
+
+
+def test_file_token_bucket_processes(tmp_path):
+    path = str(tmp_path / "polls.bucket")
+    with ProcessPoolExecutor(2) as pool:
+        taken = list(pool.map(_take_all, [path, path]))
+    assert sum(taken) == 3
+
+
+def test_limiter_categories(tmp_path):
+    taken = []
+    limiter = RateLimiter(
+        **{c: RecordingBucket(c, taken) for c in (UPLOADS, POLLS, DOWNLOADS)}
+    )
+    transport = FileTransport(limiter=limiter)
+
+    Job(1, transport=transport).info()
+    assert taken and set(taken) == {POLLS}
+    taken.clear()
+
+    transport.post("https://nova.astrometry.net/api/upload")
+    file_request("https://nova.astrometry.net/files/1", transport=transport)
+    download_file(
+        "https://nova.astrometry.net/files/2",
+        str(tmp_path / "file.fits"),
+        transport=transport,
+    )
+    assert taken == [UPLOADS, DOWNLOADS, DOWNLOADS]
+    assert limiter.waited == {}
+
+
+def test_limiter_unlimited(tmp_path):
+    limiter = RateLimiter(polls=1000)
+    assert set(limiter.buckets) == {POLLS}
+    # No bucket for uploads, never waits
+    for _ in range(5):
+        limiter.acquire(UPLOADS)
+
+    shared = RateLimiter.shared(str(tmp_path), uploads=0.5, downloads=2)
+    assert set(shared.buckets) == {UPLOADS, DOWNLOADS}
+    assert shared.buckets[UPLOADS].path == str(tmp_path / "uploads.bucket")
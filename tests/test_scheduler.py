@@ -0,0 +1,90 @@
+import threading
+import time
+from concurrent.futures import wait
+
+import pytest
+
+from astrometry_net_client import Job, Submission
+from astrometry_net_client.exceptions import InvalidRequest
+from astrometry_net_client.scheduler import PollScheduler
+
+
+class FailingJob(Job):
+    def _make_status_request(self):
+        raise InvalidRequest("failing")
+
+
+class BlockingJob(Job):
+    """
+    Job of which the status query waits until it is released.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def _make_status_request(self):
+        self.started.set()
+        self.release.wait(10)
+        return super()._make_status_request()
+
+
+def test_scheduler_many(mock_server):
+    done = []
+    with PollScheduler(workers=2, start=0.01, end=0.02) as scheduler:
+        futures = [
+            scheduler.register(Job(job_id), callback=done.append)
+            for job_id in [0, 1, 2, 3]
+        ]
+        futures.append(scheduler.register(Submission(2)))
+        wait(futures, timeout=10)
+
+        assert len(scheduler) == 0
+
+    results = [future.result() for future in futures]
+    assert [s.id for s in results] == [0, 1, 2, 3, 2]
+    assert all(s.done() for s in results)
+    assert results[1].success() and not results[0].success()
+    assert len(done) == 4
+
+
+def test_scheduler_rate(mock_server):
+    with PollScheduler(workers=4, rate=20, start=0.01) as scheduler:
+        start = time.monotonic()
+        futures = [scheduler.register(Job(1)) for _ in range(6)]
+        wait(futures, timeout=10)
+        elapsed = time.monotonic() - start
+
+    # 6 queries at 20 per second take at least 5 intervals of 0.05s
+    assert elapsed >= 0.25
+
+
+def test_scheduler_errors(mock_server):
+    with PollScheduler(start=0.01) as scheduler:
+        failing = scheduler.register(FailingJob(1))
+        timeout = scheduler.register(Job(3), timeout=0.02)
+
+        with pytest.raises(InvalidRequest):
+            failing.result(timeout=10)
+        with pytest.raises(TimeoutError):
+            timeout.result(timeout=10)
+
+    with pytest.raises(RuntimeError):
+        scheduler.register(Job(1))
+
+
+def test_scheduler_cancel(mock_server):
+    with PollScheduler(start=0.01) as scheduler:
+        job = BlockingJob(1)
+        future = scheduler.register(job)
+        assert job.started.wait(10)
+        # Cancelled while its status is queried, the result is not set
+        assert future.cancel()
+        job.release.set()
+
+        deadline = time.monotonic() + 10
+        while len(scheduler) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(scheduler) == 0
+        assert future.cancelled()
@@ -1,13 +1,18 @@
 import os
+import threading
+import time
 from unittest import mock
 
 import pytest
 import requests
-from constants import VALID_KEY
+from constants import FILE, URL_TO_UPLOAD, VALID_KEY
 from utils import FunctionCalledException, function_called_raiser
 
-from astrometry_net_client import Session
+from astrometry_net_client import Client, Job, Session, Submission
+from astrometry_net_client.cache import SessionCache
 from astrometry_net_client.exceptions import APIKeyError, LoginFailedException
+from astrometry_net_client.session import SessionPool
+from astrometry_net_client.uploads import URLUpload
 
 some_key = "somekey"
 
@@ -60,3 +65,207 @@ def test_invalid_session_login(mock_server):
     session = Session(api_key="invalid_key")
     with pytest.raises(LoginFailedException):
         session.login()
+
+
+def count_logins(monkeypatch):
+    logins = []
+    original = Session._login
+
+    def login(self):
+        logins.append(threading.get_ident())
+        time.sleep(0.05)  # give the other threads time to pile up
+        original(self)
+
+    monkeypatch.setattr(Session, "_login", login)
+    return logins
+
+
+def test_session_single_flight_login(mock_server, monkeypatch):
+    session = Session(api_key=VALID_KEY)
+    logins = count_logins(monkeypatch)
+
+    threads = [threading.Thread(target=session.login) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(logins) == 1
+    assert session.credentials() == (session.key, 1)
+
+    # Only the first renewal of an expired generation logs in again
+    assert session.renew(1)[1] == 2
+    assert session.renew(1)[1] == 2
+    assert len(logins) == 2
+
+
+def test_session_request_expired(mock_server, monkeypatch):
+    session = Session(api_key=VALID_KEY)
+    session.login()
+    # The session key expired on the server
+    session.key = "expired"
+    logins = count_logins(monkeypatch)
+
+    results = []
+
+    def upload():
+        upload = URLUpload(URL_TO_UPLOAD, session=session)
+        results.append(upload.make())
+
+    threads = [threading.Thread(target=upload) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # A single login for all requests, which are all retried once
+    assert len(logins) == 1
+    assert len(results) == 8
+    assert session.generation == 2
+
+
+def test_session_key_cache(mock_server, monkeypatch, tmp_path):
+    cache = SessionCache(str(tmp_path / "sessions.json"))
+    session = Session(api_key=VALID_KEY, key_cache=cache)
+    session.login()
+    assert cache.get(VALID_KEY) == session.key
+    assert cache.get("other key") is None
+
+    # A new session (e.g. in a new process) does not log in at all
+    monkeypatch.setattr(requests, "post", function_called_raiser)
+    other = Session(api_key=VALID_KEY, key_cache=SessionCache(cache.path))
+    other.login()
+    assert other.key == session.key
+
+    # Expired keys are not used
+    with pytest.raises(FunctionCalledException):
+        Session(api_key=VALID_KEY, key_cache=SessionCache(cache.path, 0)).login()
+
+
+def test_session_key_cache_expired(mock_server, tmp_path):
+    cache = SessionCache(str(tmp_path / "sessions.json"))
+    cache.put(VALID_KEY, "expired")
+
+    # The cached key is rejected, so a real login is made and cached
+    session = Session(api_key=VALID_KEY, key_cache=cache)
+    URLUpload(URL_TO_UPLOAD, session=session).make()
+    assert session.key != "expired"
+    assert cache.get(VALID_KEY) == session.key
+
+    cache.remove(VALID_KEY)
+    assert cache.get(VALID_KEY) is None
+
+
+class FakeUpload:
+    """
+    Upload which records its session, and fails with the given status.
+    """
+
+    ids = iter(range(100, 200))
+
+    def __init__(self, session, status_code=None):
+        self.session = session
+        self.status_code = status_code
+
+    def submit(self, registry=None):
+        if self.status_code is not None:
+            response = requests.Response()
+            response.status_code = self.status_code
+            response.headers["Retry-After"] = "30"
+            raise requests.HTTPError(response=response)
+        return Submission(next(self.ids))
+
+
+def test_session_pool_balance():
+    first, second = Session(VALID_KEY), Session(VALID_KEY)
+    pool = SessionPool([first, second])
+
+    submissions = [pool.submit(FakeUpload) for _ in range(4)]
+    assert pool.outstanding(first) == pool.outstanding(second) == 2
+    assert [pool.owner(s) for s in submissions] == [first, second, first, second]
+
+    # The job of a submission is finished, so its session is least busy
+    job = Job(1)
+    submissions[1].jobs = [job]
+    assert pool.owner(job) is second
+    pool.finished(job)
+    assert pool.outstanding(second) == 1
+    # The owners of finished submissions and jobs are forgotten
+    assert pool.owner(job) is None
+    assert pool.owner(submissions[1]) is None
+    assert len(pool._owners) == 3
+    assert pool.owner(pool.submit(FakeUpload)) is second
+
+    with pytest.raises(ValueError):
+        SessionPool([])
+
+
+def test_session_pool_throttle(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(time, "sleep", sleeps.append)
+    first, second = Session(VALID_KEY), Session(VALID_KEY)
+    pool = SessionPool([first, second])
+
+    def make_upload(session):
+        return FakeUpload(session, status_code=429 if session is first else None)
+
+    # The throttled session is skipped, also for the next uploads
+    submission = pool.submit(make_upload)
+    assert pool.owner(submission) is second
+    assert pool.owner(pool.submit(FakeUpload)) is second
+    assert sleeps == []
+
+    # All sessions throttled, waits for the first one before trying it
+    with pytest.raises(requests.HTTPError):
+        pool.submit(lambda session: FakeUpload(session, status_code=503))
+    assert len(sleeps) == 1 and 29 < sleeps[0] <= 30
+    assert pool.owner(pool.submit(FakeUpload)) in (first, second)
+    assert len(sleeps) == 2
+
+    # Other errors are not retried
+    with pytest.raises(requests.HTTPError):
+        pool.submit(lambda session: FakeUpload(session, status_code=500))
+
+
+def test_session_pool_endpoints():
+    pool = SessionPool.from_endpoints(
+        {"https://a.example.org": "key-a", "https://b.example.org": "key-b"}
+    )
+    first, second = pool.sessions
+    assert first.endpoint.url == "https://a.example.org"
+    assert first.url == "https://a.example.org/api/login"
+    assert second.api_key == "key-b"
+
+    class EndpointUpload(FakeUpload):
+        def submit(self, registry=None):
+            if self.session is first:
+                time.sleep(0.05)
+            return Submission(next(self.ids), endpoint=self.session.endpoint)
+
+    # Both are tried first, afterwards the faster endpoint is preferred
+    submissions = [pool.submit(EndpointUpload) for _ in range(4)]
+    assert pool.latency(first) > pool.latency(second)
+    assert [pool.owner(s) for s in submissions] == [first, second, second, second]
+    # Pinned to the endpoint of the session which made the upload
+    assert submissions[0].endpoint == first.endpoint
+
+    # An unreachable endpoint is skipped
+    class DownUpload(EndpointUpload):
+        def submit(self, registry=None):
+            if self.session is second:
+                raise requests.ConnectionError("refused")
+            return super().submit(registry)
+
+    assert pool.owner(pool.submit(DownUpload)) is first
+    assert pool.owner(pool.submit(EndpointUpload)) is first
+
+
+def test_client_session_pool(mock_server):
+    pool = SessionPool([Session(VALID_KEY), Session(VALID_KEY)])
+    client = Client(session=pool)
+    assert pool.logged_in
+
+    results, _ = client.run_batch([FILE] * 2, start=0.01)
+    assert all(job.success() for job, _ in results)
+    assert all(pool.outstanding(session) == 0 for session in pool.sessions)
+    assert pool._owners == {}
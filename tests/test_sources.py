@@ -0,0 +1,99 @@
+import io
+
+import numpy as np
+import pytest
+from astropy.io import fits
+from conftest import MockUpload
+from constants import VALID_KEY
+
+from astrometry_net_client import Session
+from astrometry_net_client.sources import (
+    estimate_background,
+    extract_file_sources,
+    extract_sources,
+)
+from astrometry_net_client.uploads import SourcesUpload
+
+STARS = [(20.3, 30.7, 1000), (70.0, 15.25, 500), (45.6, 80.1, 200)]
+
+
+def star_field(saturate=None):
+    rng = np.random.default_rng(3)
+    y, x = np.mgrid[0:100, 0:120]
+    image = 100 + rng.normal(0, 1, size=x.shape)
+    for sx, sy, amplitude in STARS:
+        image += amplitude * np.exp(-((x - sx) ** 2 + (y - sy) ** 2) / (2 * 1.2**2))
+    if saturate is not None:
+        image = np.minimum(image, saturate)
+    return image
+
+
+def test_estimate_background():
+    background, sigma = estimate_background(star_field(), box=32)
+    assert background.shape == (100, 120)
+    assert np.allclose(background, 100, atol=0.5)
+    assert sigma == pytest.approx(1, rel=0.2)
+
+
+def test_extract_sources():
+    sources = extract_sources(star_field())
+    assert len(sources) == len(STARS)
+    # Sorted by flux, positions within a fraction of a pixel
+    for source, (x, y, _) in zip(sources, STARS):
+        assert source["x"] == pytest.approx(x, abs=0.1)
+        assert source["y"] == pytest.approx(y, abs=0.1)
+    assert list(sources["flux"]) == sorted(sources["flux"], reverse=True)
+
+    assert len(extract_sources(star_field(), max_sources=2)) == 2
+
+    # Flat (saturated) tops are a single source
+    assert len(extract_sources(star_field(saturate=150))) == len(STARS)
+
+
+def test_extract_sources_no_noise():
+    # Integer frame without noise: the median absolute deviation is 0
+    y, x = np.mgrid[0:100, 0:120]
+    image = np.full(x.shape, 100, dtype=np.int16)
+    for sx, sy, _ in STARS:
+        image[int(sy) - 1 : int(sy) + 2, int(sx) - 1 : int(sx) + 2] += 50
+    background, sigma = estimate_background(image)
+    assert sigma > 0
+    sources = extract_sources(image)
+    assert len(sources) == len(STARS)
+
+    assert len(extract_sources(np.full(x.shape, 100, dtype=np.int16))) == 0
+
+
+def test_extract_sources_candidates():
+    # Many more local maxima than sources, only the brightest are measured
+    image = star_field()
+    image[::4, ::4] += 10
+    sources = extract_sources(image, max_sources=3)
+    assert len(sources) == 3
+    for source, (x, y, _) in zip(sources, STARS):
+        assert source["x"] == pytest.approx(x, abs=0.1)
+
+
+def test_extract_file_sources(tmp_path):
+    path = str(tmp_path / "stars.fits")
+    fits.PrimaryHDU(star_field().astype(np.float32)).writeto(path)
+    sources, shape = extract_file_sources(path, threshold=10)
+    assert shape == (100, 120)
+    assert len(sources) == len(STARS)
+
+
+def test_sources_upload(mock_server):
+    session = Session(VALID_KEY)
+    sources = extract_sources(star_field())
+    with pytest.raises(ValueError):
+        SourcesUpload(sources, session)
+
+    upl = SourcesUpload(sources, session, image_width=120, image_height=100)
+    submission = upl.submit()
+    assert submission.id == 2
+    assert upl.settings["image_width"] == 120
+
+    table = fits.open(io.BytesIO(MockUpload.last_upload))[1].data
+    assert np.allclose(table["X"], sources["x"] + 1)
+    assert np.allclose(table["Y"], sources["y"] + 1)
+    assert np.allclose(table["FLUX"], sources["flux"])
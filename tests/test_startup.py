@@ -0,0 +1,71 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+import astrometry_net_client
+from astrometry_net_client.client import Client
+
+# Modules which are slow to import, and only needed to read FITS files
+HEAVY_MODULES = ["astropy", "numpy"]
+
+
+def imported_modules(code):
+    """
+    Run ``code`` in a new interpreter, returning the heavy modules which are
+    imported afterwards and the time (in seconds) it took.
+    """
+    script = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        "{}\n"
+        "elapsed = time.perf_counter() - start\n"
+        "print(json.dumps([[m for m in {!r} if m in sys.modules], elapsed]))\n"
+    ).format(code, HEAVY_MODULES)
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, check=True, text=True
+    )
+    modules, elapsed = json.loads(result.stdout.splitlines()[-1])
+    return modules, elapsed
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "import astrometry_net_client",
+        "from astrometry_net_client import Job, Session, Submission",
+        "from astrometry_net_client import Client, FileUpload, AsyncClient",
+    ],
+)
+def test_import_is_light(code):
+    modules, elapsed = imported_modules(code)
+    assert modules == [], "{} took {:.3f}s".format(code, elapsed)
+
+
+def test_cli_help_is_light():
+    code = (
+        "from astrometry_net_client.scripts import anc_upload\n"
+        "sys.argv = ['anc_upload', '--help']\n"
+        "try:\n"
+        "    anc_upload.main()\n"
+        "except SystemExit:\n"
+        "    pass"
+    )
+    modules, _ = imported_modules(code)
+    assert modules == []
+
+
+def test_fits_imported_when_needed():
+    modules, _ = imported_modules(
+        "from astrometry_net_client import ArrayUpload, Session\n"
+        "ArrayUpload([[1]], session=Session(api_key='XXXX'))"
+    )
+    assert "astropy" in modules
+
+
+def test_lazy_attributes():
+    assert astrometry_net_client.Client is Client
+    assert set(astrometry_net_client.__all__) <= set(dir(astrometry_net_client))
+    with pytest.raises(AttributeError):
+        astrometry_net_client.Unknown
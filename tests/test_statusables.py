@@ -1,9 +1,30 @@
 # Tests concerning Statusables
+import gc
+
 import pytest
+import requests
 from constants import FAILED_SUBMISSION_RESULT, SUCCESS_SUBMISSION_RESULT
+from utils import FunctionCalledException
 
 from astrometry_net_client import Job, Submission
+from astrometry_net_client.config import Endpoint
 from astrometry_net_client.exceptions import StillProcessingException
+from astrometry_net_client.statusables import JobRegistry, bulk_status
+
+
+class ForbidPaths:
+    """
+    Wraps a (mocked) request function, raising when the url contains ``path``.
+    """
+
+    def __init__(self, func, path):
+        self.func = func
+        self.path = path
+
+    def __call__(self, url, *args, **kwargs):
+        if self.path in url:
+            raise FunctionCalledException(url)
+        return self.func(url, *args, **kwargs)
 
 
 @pytest.mark.parametrize(
@@ -113,3 +134,87 @@ def test_submission_still_solving(mock_server):
     submission = Submission(2)
     with pytest.raises(StillProcessingException):
         iter(submission)
+
+
+def test_submission_calibrated_jobs(mock_server, monkeypatch):
+    # The job of submission 1 has a calibration, so it is known to be
+    # successful without querying the job itself.
+    monkeypatch.setattr(requests, "get", ForbidPaths(requests.get, "/api/jobs"))
+    submission = Submission(1)
+    submission.status()
+
+    job = submission.jobs[0]
+    assert job.done()
+    assert job.success()
+    assert submission.success()
+
+
+def test_bulk_status(mock_server, monkeypatch):
+    submission = Submission(1)
+    job = Job(4489363)
+    failed_job = Job(0)
+    solving_job = Job(3)
+
+    monkeypatch.setattr(requests, "get", ForbidPaths(requests.get, "/api/jobs/448"))
+    bulk_status([submission, job, failed_job, solving_job])
+
+    assert submission.done()
+    assert job.success()
+    assert failed_job.done() and not failed_job.success()
+    assert not solving_job.done()
+
+
+def test_job_registry(mock_server):
+    registry = JobRegistry()
+    job = registry.get(1)
+    assert registry.get(1) is job
+    assert 1 in registry
+    assert registry.add(Job(1)) is job
+
+    # Jobs are only weakly referenced
+    del job
+    gc.collect()
+    assert 1 not in registry
+
+
+def test_submission_keeps_jobs(mock_server):
+    registry = JobRegistry()
+    submission = Submission(1, registry=registry)
+    submission.status()
+    job = submission.jobs[0]
+    info = job.info()
+
+    submission.status(force=True)
+    assert submission.jobs[0] is job
+    assert registry.get(job.id) is job
+    assert job.info() is info
+
+
+def test_endpoint_urls():
+    endpoint = Endpoint("https://astrometry.example.org/api/")
+    assert endpoint.url == "https://astrometry.example.org"
+    assert endpoint.login_url == "https://astrometry.example.org/api/login"
+    assert Endpoint("https://astrometry.example.org") == endpoint
+
+    job = Job(5, endpoint="https://astrometry.example.org")
+    assert job.url == "https://astrometry.example.org/api/jobs/5"
+    assert job.wcs_file_url.format(job=job) == (
+        "https://astrometry.example.org/wcs_file/5"
+    )
+    assert job.cache_key != Job(5).cache_key
+    assert Job(5).url == "http://nova.astrometry.net/api/jobs/5"
+
+    submission = Submission(7, endpoint=endpoint)
+    assert submission.url == "https://astrometry.example.org/api/submissions/7"
+
+
+def test_job_registry_endpoints():
+    registry = JobRegistry(endpoint="https://a.example.org")
+    job = registry.get(5)
+    assert job.endpoint == Endpoint("https://a.example.org")
+    assert 5 in registry
+    # The same id at another endpoint is another job
+    other = registry.get(5, endpoint="https://b.example.org")
+    assert other is not job
+    assert other.endpoint.url == "https://b.example.org"
+    assert registry.get(5, endpoint="https://b.example.org") is other
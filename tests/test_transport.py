@@ -0,0 +1,195 @@
+import io
+import time
+from email.utils import formatdate
+
+import pytest
+import requests
+from constants import JOB_SUCCESS_INFO, VALID_KEY
+from mocked_server import ResponseObj
+
+from astrometry_net_client import Client, Job, Session, Submission
+from astrometry_net_client.exceptions import ExhaustedAttemptsException, InvalidRequest
+from astrometry_net_client.multipart import MultipartEncoder
+from astrometry_net_client.transport import (
+    DirectTransport,
+    RetryPolicy,
+    Transport,
+    retry_after,
+)
+
+
+class RecordingTransport(DirectTransport):
+    def __init__(self):
+        super().__init__()
+        self.urls = []
+
+    def _send(self, method, url, **kwargs):
+        self.urls.append((method, url))
+        return ResponseObj(JOB_SUCCESS_INFO)
+
+
+def test_transport_pool():
+    transport = Transport(pool_connections=2, pool_maxsize=5, keep_alive=False)
+    http = transport.http
+    assert isinstance(http, requests.Session)
+    # Created once, reused afterwards
+    assert transport.http is http
+
+    adapter = http.get_adapter("https://nova.astrometry.net")
+    assert adapter._pool_maxsize == 5
+    assert adapter._pool_connections == 2
+    assert http.headers["Connection"] == "close"
+
+    transport.close()
+    assert transport.http is not http
+
+
+def test_transport_invalid_pool_size():
+    with pytest.raises(ValueError):
+        Transport(pool_maxsize=0)
+
+
+def test_job_transport():
+    transport = RecordingTransport()
+    job = Job(1, transport=transport)
+    job.status()
+    job.info()
+
+    assert transport.urls == [
+        ("get", "http://nova.astrometry.net/api/jobs/1"),
+        ("get", "http://nova.astrometry.net/api/jobs/1/info"),
+    ]
+
+
+def test_client_transport(mock_server):
+    client = Client(api_key=VALID_KEY)
+    assert isinstance(client.transport, Transport)
+    assert client.session.transport is client.transport
+
+    transport = Transport()
+    client = Client(session=Session(VALID_KEY, transport=transport))
+    assert client.transport is transport
+
+
+@pytest.mark.parametrize("parallelism", [1, 4])
+def test_transport_run_all(parallelism):
+    transport = DirectTransport(parallelism=parallelism)
+    assert transport.run_all(lambda x: 2 * x, range(5)) == [0, 2, 4, 6, 8]
+
+    done = []
+
+    def fail_odd(x):
+        if x % 2:
+            raise InvalidRequest(str(x))
+        done.append(x)
+
+    with pytest.raises(InvalidRequest) as e:
+        transport.run_all(fail_odd, range(6))
+    # The first failure is raised, after all calls are finished
+    assert str(e.value) == "1"
+    assert sorted(done) == [0, 2, 4]
+    transport.close()
+
+
+def test_submission_concurrent_jobs(mock_server):
+    transport = Transport(parallelism=3)
+    submission = Submission(3, transport=transport)
+    submission.status()
+
+    assert [job.id for job in submission.jobs] == [0, 1, 4489363]
+    assert all(job.done() for job in submission.jobs)
+    assert [job.success() for job in submission.jobs] == [False, True, True]
+    transport.close()
+
+
+class FlakyTransport(DirectTransport):
+    """
+    Transport which returns the given responses (status codes or exceptions)
+    in order, recording the sent bodies.
+    """
+
+    def __init__(self, outcomes, headers=None, **kwargs):
+        super().__init__(retry=RetryPolicy(base=0.001, cap=0.01, **kwargs))
+        self.outcomes = list(outcomes)
+        self.headers = {"Content-Type": "text/plain", **(headers or {})}
+        self.bodies = []
+
+    def _send(self, method, url, data=None, **kwargs):
+        self.bodies.append(data.read() if hasattr(data, "read") else data)
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return ResponseObj(JOB_SUCCESS_INFO, self.headers, outcome)
+
+
+def test_retry_idempotent():
+    transport = FlakyTransport([502, requests.ConnectionError(), 503, 200])
+    assert transport.get("url").status_code == 200
+    assert transport.retry.retries == 3
+    assert transport.retry.reasons == {"502": 1, "503": 1, "ConnectionError": 1}
+
+    # Not a transient error
+    transport = FlakyTransport([404, 200])
+    assert transport.get("url").status_code == 404
+
+
+def test_retry_not_idempotent():
+    # Possibly processed by the server, so not retried
+    transport = FlakyTransport([502, 200])
+    assert transport.post("url", data={}).status_code == 502
+    transport = FlakyTransport([requests.ConnectionError(), 200])
+    with pytest.raises(requests.ConnectionError):
+        transport.post("url", data={})
+
+    # Certainly not processed
+    transport = FlakyTransport([429, requests.exceptions.ConnectTimeout(), 200])
+    assert transport.post("url", data={}).status_code == 200
+    # Unless marked as idempotent
+    transport = FlakyTransport([502, 200])
+    assert transport.post("url", data={}, idempotent=True).status_code == 200
+
+
+def test_retry_rewinds_body():
+    files = {"file": ("a.fits", io.BytesIO(b"data" * 100))}
+    encoder = MultipartEncoder({"request-json": "{}"}, files)
+    transport = FlakyTransport([503, 200])
+    assert transport.post("url", data=encoder).status_code == 200
+    first, second = transport.bodies
+    assert first == second
+    assert len(first) == len(encoder)
+
+    # A stream which cannot be rewound is sent only once
+    transport = FlakyTransport([503, 200])
+    assert transport.post("url", data=iter([b"data"])).status_code == 503
+
+
+def test_retry_exhausted():
+    transport = FlakyTransport([503] * 3, attempts=3)
+    with pytest.raises(ExhaustedAttemptsException) as e:
+        transport.get("url")
+    assert e.value.response.status_code == 503
+    assert transport.retry.retries == 2
+    assert transport.retry.exhausted == 1
+
+    transport = FlakyTransport([requests.Timeout()] * 2, attempts=2)
+    with pytest.raises(ExhaustedAttemptsException) as e:
+        transport.get("url")
+    assert isinstance(e.value.__cause__, requests.Timeout)
+
+    # The server asks to wait longer than the deadline
+    transport = FlakyTransport([429, 200], headers={"Retry-After": "60"}, deadline=1)
+    with pytest.raises(ExhaustedAttemptsException):
+        transport.get("url")
+
+    with pytest.raises(ValueError):
+        RetryPolicy(attempts=0)
+
+
+def test_retry_after():
+    def response(value):
+        return ResponseObj(None, {} if value is None else {"Retry-After": value})
+
+    assert retry_after(response("5")) == 5
+    assert retry_after(response(None)) is None
+    assert retry_after(response("soon")) is None
+    assert 50 < retry_after(response(formatdate(time.time() + 60, usegmt=True))) <= 60
@@ -1,8 +1,23 @@
+import io
+import os
+from datetime import timedelta
+
+import numpy as np
 import pytest
+from astropy.io import fits
+from conftest import MockUpload
 from constants import FILE, URL_TO_UPLOAD, VALID_KEY
+from mocked_server import ResponseObj, parse_multipart
 
 from astrometry_net_client import FileUpload, Session
-from astrometry_net_client.uploads import URLUpload
+from astrometry_net_client.multipart import MultipartEncoder
+from astrometry_net_client.uploads import (
+    ArrayUpload,
+    BytesUpload,
+    HDUListReader,
+    HDUListUpload,
+    URLUpload,
+)
 
 
 def test_upload(mock_server):
@@ -77,3 +92,89 @@ def test_upload_until_done(mock_server):
     submission = upl.submit()
     submission.until_done()
     assert submission.done()
+
+
+def test_upload_progress(mock_server):
+    progress = []
+    upl = FileUpload(
+        FILE, Session(VALID_KEY), progress=lambda sent, total: progress.append(sent)
+    )
+    submission = upl.submit()
+    assert submission.id == 2
+
+    # Sent in multiple chunks, up to the complete body
+    assert len(progress) > 1
+    assert progress == sorted(progress)
+    assert progress[-1] > os.path.getsize(FILE)
+
+
+def test_upload_latency(mock_server, monkeypatch):
+    upl = FileUpload(FILE, Session(VALID_KEY))
+    # Not known without the timing of the HTTP request
+    assert upl.submit().upload_latency is None
+
+    monkeypatch.setattr(ResponseObj, "elapsed", timedelta(seconds=2), raising=False)
+    submission = upl.submit()
+    assert submission.upload_latency == upl.latency == 2
+    # The size of the request body, which is larger than the file
+    assert submission.upload_size == upl.size > os.path.getsize(FILE)
+
+
+def test_multipart_encoder():
+    content = bytes(range(256)) * 1000
+    encoder = MultipartEncoder(
+        {"request-json": '{"session": "key"}'},
+        {"file": ("some/dir/image.fits", io.BytesIO(content))},
+        chunk_size=1000,
+    )
+    assert encoder.content_type.startswith("multipart/form-data; boundary=")
+
+    chunks = list(encoder)
+    assert max(len(chunk) for chunk in chunks) <= 1000
+    assert sum(len(chunk) for chunk in chunks) == len(encoder)
+
+    body = b"".join(chunks)
+    assert b'filename="image.fits"' in body
+    fields = parse_multipart(body, {"Content-Type": encoder.content_type})
+    assert fields["file"] == content
+    assert fields["request-json"] == b'{"session": "key"}'
+
+
+def test_data_uploads(mock_server):
+    session = Session(VALID_KEY)
+    with open(FILE, "rb") as f:
+        content = f.read()
+    hdul = fits.open(FILE)
+
+    submission = BytesUpload(content, session).submit()
+    assert submission.id == 2
+    assert MockUpload.last_upload == content
+
+    HDUListUpload(hdul, session).submit()
+    uploaded = fits.open(io.BytesIO(MockUpload.last_upload))
+    assert uploaded[0].header == hdul[0].header
+    assert np.array_equal(uploaded[0].data, hdul[0].data)
+
+    array = np.arange(40 * 30, dtype="<u2").reshape(40, 30)
+    upl = ArrayUpload(array, session, header=fits.Header({"OBJECT": "M31"}))
+    upl.submit()
+    assert upl.filename == "upload.fits"
+    uploaded = fits.open(io.BytesIO(MockUpload.last_upload))
+    assert uploaded[0].header["OBJECT"] == "M31"
+    assert np.array_equal(uploaded[0].data, array)
+
+
+@pytest.mark.parametrize("dtype", ["<f4", ">f8", "<i2", "<u2", "u1", "<u4", "i1"])
+def test_hdulist_reader(dtype):
+    array = (np.arange(37 * 41).reshape(37, 41) % 200).astype(dtype)
+    hdul = fits.HDUList([fits.PrimaryHDU(array), fits.ImageHDU(array[::2, ::3])])
+    expected = io.BytesIO()
+    hdul.writeto(expected)
+    expected = expected.getvalue()
+
+    reader = HDUListReader(hdul, chunk_size=100)
+    assert len(reader) == len(expected)
+    assert b"".join(iter(lambda: reader.read(777), b"")) == expected
+
+    reader.seek(3000)
+    assert reader.read(5000) == expected[3000:8000]